@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the hot paths in sci-wms. Run each module directly from
+the root of the repository, e.g. ``python -m benchmarks.rtree_build``.
+"""
+import time
+import tempfile
+
+import numpy as np
+
+
+def setup():
+    """ Minimal Django settings so the wms modules can be imported """
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(TOPOLOGY_PATH=tempfile.mkdtemp(),
+                           TOPOLOGY_REGISTRY_MAX_BYTES=None,
+                           PIXEL_LOOKUP_MAX_BYTES=None,
+                           CONTOUR_CACHE_MAX_BYTES=None,
+                           SLAB_CACHE_MAX_BYTES=None,
+                           SLAB_STORE_PATH='',
+                           TILE_CACHE_PATH='',
+                           TILE_CACHE_MAX_BYTES=0,
+                           SLAB_STORE_MAX_BYTES=0,
+                           PNG_COMPRESSION_LEVEL=6,
+                           PNG_PALETTE=True,
+                           VECTOR_SPACING=16,
+                           DATASET_HANDLE_MAX_FILES=None,
+                           DATASET_VERSION_INTERVAL=0)
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """ Best wall clock time in seconds over ``repeat`` runs """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def triangle_mesh(num_faces, seed=0):
+    """
+    A jittered, triangulated regular grid with roughly ``num_faces`` faces.
+    Returns (nodes, faces) like a pyugrid UGrid.
+    """
+    side = max(int(np.sqrt(num_faces / 2)), 1) + 1
+    rs = np.random.RandomState(seed)
+    x, y = np.meshgrid(np.linspace(-80, -60, side), np.linspace(30, 45, side))
+    nodes = np.column_stack((x.ravel(), y.ravel()))
+    nodes += rs.uniform(-0.1, 0.1, nodes.shape) * (20. / side)
+    ll = (np.arange(side - 1)[None, :] + side * np.arange(side - 1)[:, None]).ravel()
+    faces = np.concatenate((
+        np.column_stack((ll, ll + 1, ll + side)),
+        np.column_stack((ll + 1, ll + side + 1, ll + side)),
+    ))
+    return nodes, faces
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+The first request of a worker to a time aggregation of NetCDF files: opening
+every file of the glob (EnhancedMFDataset) versus opening the files holding
+the time step from the file index of the time cache (``wms.aggregation``).
+
+    python -m benchmarks.aggregation [files]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+import netCDF4
+
+from benchmarks import setup, timed
+setup()
+
+from wms.aggregation import LazyAggregation, file_index  # noqa: E402
+from wms.handles import HandlePool, open_dataset  # noqa: E402
+
+
+def main(files=500, requests=5):
+    path = tempfile.mkdtemp()
+    try:
+        for i in range(files):
+            with netCDF4.Dataset(os.path.join(path, 'run_{:04d}.nc'.format(i)), 'w', format='NETCDF4_CLASSIC') as nc:
+                nc.createDimension('time', None)
+                nc.createDimension('node', 1000)
+                time = nc.createVariable('time', 'f8', ('time',))
+                time.units = 'hours since 2018-01-01'
+                time[:] = [2 * i, 2 * i + 1]
+                temp = nc.createVariable('temp', 'f4', ('time', 'node'))
+                temp[:] = np.random.random((2, 1000))
+        pattern = os.path.join(path, 'run_*.nc')
+
+        full = open_dataset(pattern)
+        files_index = file_index(full)
+        full.close()
+
+        def whole():
+            nc = open_dataset(pattern)
+            nc.variables['temp'][files, :]
+            nc.close()
+
+        held = []
+
+        def lazy():
+            pool = HandlePool()
+            with LazyAggregation(files_index, pool=pool) as nc:
+                nc.variables['temp'][files, :]
+            held.append(pool.files)
+            pool.clear()
+
+        opened = timed(whole, repeat=requests)
+        indexed = timed(lazy, repeat=requests)
+    finally:
+        shutil.rmtree(path)
+
+    print('Aggregation of {} files, first read of a time step in a worker'.format(files))
+    print('{:>24} {:>8.1f} ms {:>6} files'.format('open every file', opened * 1000, files))
+    print('{:>24} {:>8.1f} ms {:>6} files {:>8.1f}x'.format('file index', indexed * 1000, held[-1], opened / indexed))
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
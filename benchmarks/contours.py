@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Filled contour tiles traced by matplotlib for every tile versus contours of
+the whole field traced once (``wms.contours``) and only drawn by each tile,
+for 256x256 tiles over a curvilinear grid and a triangular mesh.
+
+    python -m benchmarks.contours [grid_side] [mesh_faces]
+"""
+import sys
+
+import numpy as np
+import matplotlib.tri as Tri
+
+from benchmarks import setup, timed, triangle_mesh
+setup()
+
+from wms import contours, data_handler, mpl_handler, projections  # noqa: E402
+from wms.topology import UGridTopology  # noqa: E402
+from benchmarks.raster import curvilinear_grid, tile_request  # noqa: E402
+
+
+def contour_request(x, y):
+    request = tile_request(x, y)
+    request.GET.update(image_type='filledcontours', numcontours=12)
+    return request
+
+
+def sgrid(side):
+    lon, lat, data = curvilinear_grid(side)
+    x, y = projections.from_wgs84('EPSG:3857', lon, lat)
+    request = contour_request(x, y)
+
+    old = timed(mpl_handler.contouring_response, lon, lat, data.copy(), request, projected=(x, y), repeat=3)
+    build = timed(contours.contour_set, x, y, data, request)
+    cs = contours.contour_set(x, y, data, request)
+    tile = timed(contours.contour_response, cs, request, repeat=3)
+
+    print('SGRID {}x{} grid, 256x256 tile'.format(side, side))
+    report(build, old, tile, cs)
+
+
+def ugrid(num_faces):
+    nodes, faces = triangle_mesh(num_faces)
+    ug = UGridTopology('mesh', nodes, faces)
+    data = np.sin(nodes[:, 0]) * np.cos(nodes[:, 1])
+    x, y = ug.projected('node', 'EPSG:3857')
+    request = contour_request(x, y)
+    bbox = request.GET['bbox']
+    minlon, minlat = projections.to_wgs84('EPSG:3857', bbox.minx, bbox.miny)
+    maxlon, maxlat = projections.to_wgs84('EPSG:3857', bbox.maxx, bbox.maxy)
+    wgs84_bbox = (minlon, minlat, maxlon, maxlat)
+
+    def matplotlib_tile():
+        node_idx = data_handler.ugrid_lat_lon_subset_idx(nodes[:, 0], nodes[:, 1], wgs84_bbox, index=ug.bucket_index('node'))
+        candidates = ug.face_bucket_index().query(data_handler.padded_bbox(wgs84_bbox))
+        face_idx = data_handler.face_idx_from_node_idx(faces, node_idx, candidates=candidates)
+        tri = Tri.Triangulation(nodes[:, 0], nodes[:, 1], triangles=faces[face_idx])
+        return mpl_handler.tricontouring_response(tri, data.copy(), request, projected=(x, y))
+
+    ug.bucket_index('node')
+    ug.face_bucket_index()
+    old = timed(matplotlib_tile, repeat=3)
+    build = timed(contours.contour_set, x, y, data, request, triangles=faces)
+    cs = contours.contour_set(x, y, data, request, triangles=faces)
+    tile = timed(contours.contour_response, cs, request, repeat=3)
+
+    print('UGRID {} faces, 256x256 tile'.format(faces.shape[0]))
+    report(build, old, tile, cs)
+
+
+def report(build, old, tile, cs):
+    print('{:>28} {:>8.1f} ms (once per field, {:.1f} MB)'.format('trace whole field', build * 1000, cs.nbytes / 1e6))
+    print('{:>28} {:>8.1f} ms'.format('matplotlib per tile', old * 1000))
+    print('{:>28} {:>8.1f} ms {:>6.1f}x'.format('cached contours per tile', tile * 1000, old / tile))
+
+
+def main(side=500, num_faces=1000000):
+    sgrid(side)
+    ugrid(num_faces)
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
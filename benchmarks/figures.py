@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tiles per second of the matplotlib renderers in ``wms.mpl_handler`` with a
+new Figure and canvas for every tile versus the figures kept by
+``wms.figures.pool``, on a small curvilinear grid so figure setup is a
+visible part of each tile.
+
+    python -m benchmarks.figures [tiles] [grid_side]
+"""
+import sys
+
+import numpy as np
+
+from benchmarks import setup, timed
+setup()
+
+from wms import figures, mpl_handler  # noqa: E402
+from wms.utils import DotDict  # noqa: E402
+
+
+def tile_request(image_type):
+    return DotDict(GET={
+        'bbox': DotDict(minx=0.1, miny=0.1, maxx=0.9, maxy=0.9),
+        'width': 256,
+        'height': 256,
+        'crs': 'EPSG:4326',
+        'colormap': 'jet',
+        'colorscalerange': DotDict(min=-1, max=1),
+        'logscale': False,
+        'numcontours': 10,
+        'vectorscale': 20,
+        'image_type': image_type,
+    })
+
+
+def renderers(side):
+    x, y = np.meshgrid(np.linspace(0, 1, side), np.linspace(0, 1, side))
+    data = np.sin(6 * x) * np.cos(4 * y)
+    step = max(side // 20, 1)
+    u = data[::step, ::step]
+    v = np.cos(6 * x)[::step, ::step]
+    return [
+        ('pcolormesh', lambda: mpl_handler.pcolormesh_response(x, y, data.copy(), tile_request('pcolor'), projected=(x, y))),
+        ('filledcontours', lambda: mpl_handler.contouring_response(x, y, data.copy(), tile_request('filledcontours'), projected=(x, y))),
+        ('vectors', lambda: mpl_handler.quiver_response(None, None, u, v, tile_request('vectors'), projected=(x[::step, ::step], y[::step, ::step]))),
+    ]
+
+
+def tiles(render, n):
+    for _ in range(n):
+        render()
+
+
+def main(n=50, side=50):
+    max_figures = figures.pool.max_figures
+    print('{:>16} {:>12} {:>12} {:>8}'.format('', 'new figure', 'pooled', ''))
+    for name, render in renderers(side):
+        figures.pool.max_figures = 0
+        figures.pool.clear()
+        old = timed(tiles, render, n)
+
+        figures.pool.max_figures = max_figures
+        render()
+        new = timed(tiles, render, n)
+        print('{:>16} {:>8.1f}/s {:>9.1f}/s {:>7.1f}x'.format(name, n / old, n / new, old / new))
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Opening a time aggregation of NetCDF files for every request (what each tile
+did) versus taking an open handle from the worker's pool (``wms.handles``),
+with the stat of every file that detects a changed aggregation for every
+request or every ``DATASET_VERSION_INTERVAL`` seconds.
+
+    python -m benchmarks.handles [files]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+import netCDF4
+
+from benchmarks import setup, timed
+setup()
+
+from wms.handles import HandlePool, open_dataset, path_version  # noqa: E402
+
+
+def main(files=500, requests=5):
+    path = tempfile.mkdtemp()
+    try:
+        for i in range(files):
+            with netCDF4.Dataset(os.path.join(path, 'run_{:04d}.nc'.format(i)), 'w', format='NETCDF4_CLASSIC') as nc:
+                nc.createDimension('time', None)
+                nc.createDimension('node', 1000)
+                time = nc.createVariable('time', 'f8', ('time',))
+                time.units = 'hours since 2018-01-01'
+                time[:] = [i]
+                temp = nc.createVariable('temp', 'f4', ('time', 'node'))
+                temp[:] = np.random.random((1, 1000))
+        pattern = os.path.join(path, 'run_*.nc')
+
+        def reopen():
+            nc = open_dataset(pattern)
+            nc.variables['temp'][files // 2, :]
+            nc.close()
+
+        pool = HandlePool()
+
+        def pooled():
+            with pool.checkout(pattern, path_version(pattern)) as nc:
+                nc.variables['temp'][files // 2, :]
+
+        throttled_pool = HandlePool(version_interval=10)
+
+        def throttled():
+            with throttled_pool.checkout(pattern, throttled_pool.path_version(pattern)) as nc:
+                nc.variables['temp'][files // 2, :]
+
+        pooled()
+        throttled()
+        opened = timed(reopen, repeat=requests)
+        reused = timed(pooled, repeat=requests)
+        checked = timed(throttled, repeat=requests)
+        pool.clear()
+        throttled_pool.clear()
+    finally:
+        shutil.rmtree(path)
+
+    print('Aggregation of {} files, one time step read per request'.format(files))
+    print('{:>24} {:>8.1f} ms'.format('open per request', opened * 1000))
+    print('{:>24} {:>8.1f} ms {:>8.1f}x'.format('pooled handle', reused * 1000, opened / reused))
+    print('{:>24} {:>8.1f} ms {:>8.1f}x'.format('pooled, stat every 10s', checked * 1000, opened / checked))
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Time and size of encoding a 256x256 tile: the tight bbox ``print_png`` of
+matplotlib versus drawing the figure once and encoding its pixels with
+``wms.png`` (RGBA or 8-bit indexed, at several zlib levels), and the tiles of
+the numpy renderer in ``wms.raster``.
+
+    python -m benchmarks.png [repeat]
+"""
+import io
+import sys
+
+import numpy as np
+import matplotlib as mpl
+
+from benchmarks import setup, timed
+setup()
+
+from django.conf import settings  # noqa: E402
+
+from wms import data_handler, figures, png, raster  # noqa: E402
+
+
+def tile_figure():
+    x, y = np.meshgrid(np.linspace(0, 1, 40), np.linspace(0, 1, 40))
+    data = np.sin(6 * x) * np.cos(4 * y)
+    fig, ax = figures.new_figure(256, 256, 80.)
+    ax.pcolormesh(x, y, data, cmap='jet')
+    ax.set_xlim(0.1, 0.9)
+    ax.set_ylim(0.1, 0.9)
+    return fig
+
+
+def tight_png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', pad_inches=0.1)
+    return buf.getvalue()
+
+
+def figure_png(fig, level, palette):
+    settings.PNG_COMPRESSION_LEVEL = level
+    settings.PNG_PALETTE = palette
+    return data_handler.figure_response(fig, None, tight=False).content
+
+
+def raster_tile():
+    x, y = np.meshgrid(np.linspace(0, 1, 256), np.linspace(0, 1, 256))
+    # Most tiles only show part of the color scale
+    values = 0.6 * np.sin(6 * x) * np.cos(4 * y)
+    values[:, :40] = np.nan
+    return raster.color_indexes(values, mpl.colors.Normalize(vmin=-1, vmax=1))
+
+
+def raster_png(idx, missing, level, palette):
+    settings.PNG_COMPRESSION_LEVEL = level
+    settings.PNG_PALETTE = palette
+    return raster.encode_colors(idx, missing, 'jet')
+
+
+def report(name, func, repeat):
+    print('{:>32} {:>8.2f} ms {:>8} bytes'.format(name, timed(func, repeat=repeat) * 1000, len(func())))
+
+
+def main(repeat=20):
+    fig = tile_figure()
+    print('matplotlib tile')
+    report('tight bbox print_png', lambda: tight_png(fig), repeat)
+    for level in (6, 1):
+        report('RGBA, level {}'.format(level), lambda: figure_png(fig, level, False), repeat)
+        report('palette, level {}'.format(level), lambda: figure_png(fig, level, True), repeat)
+
+    idx, missing = raster_tile()
+    print('numpy raster tile')
+    for level in (6, 1):
+        report('RGBA, level {}'.format(level), lambda: raster_png(idx, missing, level, False), repeat)
+        report('palette, level {}'.format(level), lambda: raster_png(idx, missing, level, True), repeat)
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request projection overhead of a GetMap request: building ``pyproj.Proj``
+objects and calling ``pyproj.transform`` for every bbox corner (the old
+``wms_handler`` code) versus the reusable transformers in ``wms.projections``.
+
+    python -m benchmarks.projections [requests]
+"""
+import sys
+import warnings
+
+import pyproj
+
+from benchmarks import setup, timed
+setup()
+
+from wms import projections  # noqa: E402
+
+BBOX = (-7792364.355529149, 5009377.085697312, -7514065.628545966, 5160979.444049783)
+
+
+def per_request_proj(n):
+    for _ in range(n):
+        # get_projection() is called once for 'crs' and again by get_wgs84_bbox()
+        pyproj.Proj(init='EPSG:3857')
+        crs = pyproj.Proj(init='EPSG:3857')
+        EPSG4326 = pyproj.Proj(init='EPSG:4326')
+        pyproj.transform(crs, EPSG4326, BBOX[0], BBOX[1])
+        pyproj.transform(crs, EPSG4326, BBOX[2], BBOX[3])
+
+
+def transformer_registry(n):
+    for _ in range(n):
+        projections.normalize('EPSG:3857')
+        crs = projections.normalize('EPSG:3857')
+        projections.to_wgs84(crs, BBOX[0], BBOX[1])
+        projections.to_wgs84(crs, BBOX[2], BBOX[3])
+
+
+def main(n=200):
+    warnings.simplefilter('ignore')
+    old = timed(per_request_proj, n)
+    new = timed(transformer_registry, n)
+    print('{:>24} {:>10}'.format('', 'ms/request'))
+    print('{:>24} {:>10.3f}'.format('Proj + pyproj.transform', old / n * 1000))
+    print('{:>24} {:>10.3f}'.format('transformer registry', new / n * 1000))
+    print('{:>24} {:>9.1f}x'.format('speedup', old / new))
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
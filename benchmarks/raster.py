@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+pcolor tile rendering with matplotlib (pcolormesh/tripcolor on a Figure)
+versus the numpy renderer in ``wms.raster``, for 256x256 tiles over a
+curvilinear grid and a triangular mesh. Animation frames of the same view
+reuse the pixel lookup and only gather and color the new data.
+
+    python -m benchmarks.raster [grid_side] [mesh_faces]
+"""
+import sys
+
+import numpy as np
+import matplotlib.tri as Tri
+
+from benchmarks import setup, timed, triangle_mesh
+setup()
+
+from wms import data_handler, mpl_handler, raster, projections  # noqa: E402
+from wms.topology import UGridTopology  # noqa: E402
+from wms.utils import DotDict  # noqa: E402
+
+
+def curvilinear_grid(side):
+    i, j = np.meshgrid(np.linspace(0, 1, side), np.linspace(0, 1, side))
+    lon = -75 + 10 * i + 0.5 * np.sin(3 * j)
+    lat = 35 + 8 * j + 0.5 * np.cos(3 * i)
+    data = np.sin(6 * i) * np.cos(4 * j)
+    return lon, lat, data
+
+
+def tile_request(x, y):
+    cx, cy = np.median(x), np.median(y)
+    span = (x.max() - x.min()) / 8
+    return DotDict(GET={
+        'bbox': DotDict(minx=cx - span, miny=cy - span, maxx=cx + span, maxy=cy + span),
+        'width': 256,
+        'height': 256,
+        'crs': 'EPSG:3857',
+        'colormap': 'jet',
+        'colorscalerange': DotDict(min=-1, max=1),
+        'logscale': False,
+    })
+
+
+def sgrid(side):
+    lon, lat, data = curvilinear_grid(side)
+    x, y = projections.from_wgs84('EPSG:3857', lon, lat)
+    request = tile_request(x, y)
+
+    build = timed(raster.QuadLocator, x, y)
+    locator = raster.QuadLocator(x, y)
+    old = timed(mpl_handler.pcolormesh_response, lon, lat, data.copy(), request, projected=(x, y), repeat=3)
+    first = timed(lambda: raster.pcolor_response(raster.quad_lookup(locator, request.GET['bbox'], 256, 256), data, request), repeat=3)
+    lookup = raster.quad_lookup(locator, request.GET['bbox'], 256, 256)
+    frame = timed(raster.pcolor_response, lookup, data, request, repeat=3)
+
+    print('SGRID {}x{} grid, 256x256 tile'.format(side, side))
+    report('QuadLocator build', build, old, first, frame)
+
+
+def ugrid(num_faces):
+    nodes, faces = triangle_mesh(num_faces)
+    ug = UGridTopology('mesh', nodes, faces)
+    data = np.sin(nodes[:, 0]) * np.cos(nodes[:, 1])
+    x, y = ug.projected('node', 'EPSG:3857')
+    request = tile_request(x, y)
+    bbox = request.GET['bbox']
+    minlon, minlat = projections.to_wgs84('EPSG:3857', bbox.minx, bbox.miny)
+    maxlon, maxlat = projections.to_wgs84('EPSG:3857', bbox.maxx, bbox.maxy)
+    wgs84_bbox = (minlon, minlat, maxlon, maxlat)
+
+    def face_ids():
+        node_idx = data_handler.ugrid_lat_lon_subset_idx(nodes[:, 0], nodes[:, 1], wgs84_bbox, index=ug.bucket_index('node'))
+        candidates = ug.face_bucket_index().query(data_handler.padded_bbox(wgs84_bbox))
+        return np.flatnonzero(data_handler.face_idx_from_node_idx(faces, node_idx, candidates=candidates))
+
+    def matplotlib_frame():
+        tri = Tri.Triangulation(nodes[:, 0], nodes[:, 1], triangles=faces[face_ids()])
+        return mpl_handler.tripcolor_response(tri, data.copy(), request, data_location='node', projected=(x, y))
+
+    build = timed(lambda: ug.triangle_locator('EPSG:3857'))
+
+    def lookup():
+        return raster.triangle_lookup(ug.triangle_locator('EPSG:3857'), bbox, 256, 256)
+
+    ug.bucket_index('node')
+    ug.face_bucket_index()
+    old = timed(matplotlib_frame, repeat=3)
+    first = timed(lambda: raster.pcolor_response(lookup(), data, request), repeat=3)
+    cached = lookup()
+    frame = timed(raster.pcolor_response, cached, data, request, repeat=3)
+
+    print('UGRID {} faces, 256x256 tile'.format(faces.shape[0]))
+    report('TriangleLocator build', build, old, first, frame)
+
+
+def report(locator, build, old, first, frame):
+    print('{:>28} {:>8.1f} ms (once per grid and CRS)'.format(locator, build * 1000))
+    print('{:>28} {:>8.1f} ms'.format('matplotlib', old * 1000))
+    print('{:>28} {:>8.1f} ms {:>6.1f}x'.format('numpy raster, new view', first * 1000, old / first))
+    print('{:>28} {:>8.1f} ms {:>6.1f}x'.format('numpy raster, next frame', frame * 1000, old / frame))
+
+
+def main(side=500, num_faces=1000000):
+    sgrid(side)
+    ugrid(num_faces)
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
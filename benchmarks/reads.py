@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Reading the data of a pcolor tile from a NetCDF file: the whole time step of
+a mesh (what UGRID tiles read) versus the few contiguous index ranges that
+hold the values under the tile (``data_handler.read_indexes``), and the whole
+time step of a curvilinear grid versus the window of the cells under the tile
+(``SGridTopology.window``).
+
+    python -m benchmarks.reads [mesh_faces] [grid_side]
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import netCDF4
+
+from benchmarks import setup, timed, triangle_mesh
+setup()
+
+from wms import data_handler, projections, raster  # noqa: E402
+from wms.topology import UGridTopology, SGridTopology  # noqa: E402
+from benchmarks.raster import curvilinear_grid, tile_request  # noqa: E402
+
+
+def ugrid(num_faces, times=24):
+    nodes, faces = triangle_mesh(num_faces)
+    ug = UGridTopology('mesh', nodes, faces)
+    x, y = ug.projected('node', 'EPSG:3857')
+    request = tile_request(x, y)
+    lookup = raster.triangle_lookup(ug.triangle_locator('EPSG:3857'), request.GET['bbox'], 256, 256)
+
+    handle, path = tempfile.mkstemp(suffix='.nc')
+    os.close(handle)
+    try:
+        with netCDF4.Dataset(path, 'w') as nc:
+            nc.createDimension('time', times)
+            nc.createDimension('node', nodes.shape[0])
+            temp = nc.createVariable('temp', 'f4', ('time', 'node'), zlib=True, chunksizes=(1, 65536))
+            for t in range(times):
+                temp[t, :] = np.sin(nodes[:, 0] + t) * np.cos(nodes[:, 1])
+
+        with netCDF4.Dataset(path) as nc:
+            temp = nc.variables['temp']
+            # Another time step each time, the HDF5 chunk cache holds the last one read
+            steps = iter(range(times))
+            full = timed(lambda: temp[next(steps), :], repeat=3)
+            subset = timed(lambda: data_handler.read_indexes(temp, (next(steps),), lookup.cells), repeat=3)
+            runs = data_handler.index_runs(lookup.cells)
+            np.testing.assert_array_equal(data_handler.read_indexes(temp, (5,), lookup.cells), temp[5, :][lookup.cells])
+    finally:
+        os.remove(path)
+
+    read = sum(stop - start for start, stop in runs)
+    print('UGRID {} nodes, 256x256 tile, {} nodes under it'.format(nodes.shape[0], lookup.cells.size))
+    print('{:>28} {:>8.1f} ms {:>10} values'.format('whole time step', full * 1000, nodes.shape[0]))
+    print('{:>28} {:>8.1f} ms {:>10} values in {} ranges {:>6.1f}x'.format('index ranges', subset * 1000, read, len(runs), full / subset))
+
+
+def sgrid(side, times=24):
+    lon, lat, data = curvilinear_grid(side)
+    sg = SGridTopology(None, lon, lat)
+    x, y = sg.projected('face', 'EPSG:3857')
+    request = tile_request(x, y)
+    bbox = request.GET['bbox']
+    (minx, maxx), (miny, maxy) = projections.to_wgs84('EPSG:3857', [bbox.minx, bbox.maxx], [bbox.miny, bbox.maxy])
+    sg.extents()
+    lookup = timed(lambda: sg.window((minx, miny, maxx, maxy)), repeat=3)
+    window = sg.window((minx, miny, maxx, maxy))
+
+    handle, path = tempfile.mkstemp(suffix='.nc')
+    os.close(handle)
+    try:
+        with netCDF4.Dataset(path, 'w') as nc:
+            nc.createDimension('time', times)
+            nc.createDimension('y', side)
+            nc.createDimension('x', side)
+            temp = nc.createVariable('temp', 'f4', ('time', 'y', 'x'), zlib=True, chunksizes=(1, 256, 256))
+            for t in range(times):
+                temp[t, :, :] = data + t
+
+        with netCDF4.Dataset(path) as nc:
+            temp = nc.variables['temp']
+            steps = iter(range(times))
+            full = timed(lambda: temp[next(steps), :, :], repeat=3)
+            subset = timed(lambda: temp[(next(steps),) + window], repeat=3)
+    finally:
+        os.remove(path)
+
+    cells = (window[0].stop - window[0].start) * (window[1].stop - window[1].start)
+    print('SGRID {}x{} cells, 256x256 tile, window lookup {:.2f} ms'.format(side, side, lookup * 1000))
+    print('{:>28} {:>8.1f} ms {:>10} values'.format('whole time step', full * 1000, lon.size))
+    print('{:>28} {:>8.1f} ms {:>10} values {:>6.1f}x'.format('window', subset * 1000, cells, full / subset))
+
+
+def main(num_faces=1000000, side=2000):
+    ugrid(num_faces)
+    sgrid(side)
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
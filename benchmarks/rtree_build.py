@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+R-tree build time against mesh size: the per-face Python generator that
+``make_rtree`` used to feed the index versus the vectorized bounds computed
+by ``wms.topology.face_bounds`` and bulk loaded by ``write_rtree``.
+
+    python -m benchmarks.rtree_build [max_faces]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+from rtree import index
+
+from benchmarks import setup, timed, triangle_mesh
+setup()
+
+from wms import topology  # noqa: E402
+
+
+def per_face_generator(root, nodes, faces):
+    def generator():
+        for face_idx, node_list in enumerate(faces):
+            n = nodes[node_list]
+            xmin, ymin = np.min(n, 0)
+            xmax, ymax = np.max(n, 0)
+            yield (face_idx, (xmin, ymin, xmax, ymax), face_idx)
+
+    p = index.Property()
+    p.filename = root
+    p.overwrite = True
+    p.storage = index.RT_Disk
+    p.dimension = 2
+    idx = index.Index(root, generator(), properties=p, interleaved=True, overwrite=True)
+    idx.close()
+
+
+def vectorized(root, nodes, faces):
+    topology.write_rtree(root, topology.face_bounds(nodes, faces))
+
+
+def main(max_faces=1000000):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('{:>10} {:>14} {:>14} {:>9}'.format('faces', 'generator (s)', 'vectorized (s)', 'speedup'))
+        size = 10000
+        while size <= max_faces:
+            nodes, faces = triangle_mesh(size)
+            root = os.path.join(tmpdir, 'faces')
+            old = timed(per_face_generator, root, nodes, faces)
+            new = timed(vectorized, root, nodes, faces)
+            print('{:>10} {:>14.3f} {:>14.3f} {:>8.1f}x'.format(faces.shape[0], old, new, old / new))
+            size *= 10
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
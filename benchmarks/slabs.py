@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+A client session on one layer, time and elevation: a GetMetadata minmax over
+the view and then a dozen tiles, each reading the cells under it. Every read
+goes to the file (what each request did) versus the decoded slab read once
+and indexed in memory (``wms.slabs``). Then the same slab read by several
+workers, each decoding a copy of its own versus mapping the one the first
+worker stored (``SlabStore``).
+
+    python -m benchmarks.slabs [nodes] [tiles] [workers]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+import netCDF4
+
+from benchmarks import setup, timed
+setup()
+
+from wms import slabs  # noqa: E402
+from wms.data_handler import read_indexes  # noqa: E402
+from wms.lru import LRUCache  # noqa: E402
+from wms.slabs import SharedSlabs, SlabStore  # noqa: E402
+
+
+def main(nodes=1000000, tiles=12, workers=4, requests=3):
+    path = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(path, 'model.nc')
+        with netCDF4.Dataset(filename, 'w', format='NETCDF4_CLASSIC') as nc:
+            nc.createDimension('time', None)
+            nc.createDimension('node', nodes)
+            temp = nc.createVariable('temp', 'f4', ('time', 'node'), zlib=True)
+            for t in range(4):
+                temp[t, :] = np.random.random(nodes)
+
+        rs = np.random.RandomState(0)
+        view = np.zeros(nodes, dtype=bool)
+        view[nodes // 4:3 * nodes // 4] = True
+        # The cells under each tile, a few runs of nodes
+        cells = [ np.unique(np.concatenate([ np.arange(s, s + 2000) for s in rs.randint(0, nodes - 2000, 20) ]))
+                  for _ in range(tiles) ]
+
+        nc = netCDF4.Dataset(filename)
+        variable = nc.variables['temp']
+
+        def direct():
+            variable[2, view]
+            for c in cells:
+                read_indexes(variable, (2,), c)
+
+        def cached():
+            cache = LRUCache(max_bytes=None)
+            key = (filename, 'temp', 2)
+            slabs.read(key, variable, (2,), view, slabs=cache)
+            for c in cells:
+                slabs.read(key, variable, (2,), c, slabs=cache)
+
+        key = (filename, 'temp', 3)
+        held = {}
+
+        def private():
+            caches = [ LRUCache(max_bytes=None) for _ in range(workers) ]
+            for cache in caches:
+                slabs.read(key, variable, (3,), view, slabs=cache)
+            held['private'] = sum(c.nbytes for c in caches)
+
+        def shared():
+            store = os.path.join(path, 'slabs')
+            stores = [ SharedSlabs(SlabStore(store, 1024 ** 3), 'model') for _ in range(workers) ]
+            for worker in stores:
+                slabs.read(key, variable, (3,), view, slabs=worker)
+            held['shared'] = sum(size for _, size, _ in stores[0].store.files())
+            stores[0].store.clear()
+
+        uncached = timed(direct, repeat=requests)
+        slabbed = timed(cached, repeat=requests)
+        copies = timed(private, repeat=requests)
+        mapped = timed(shared, repeat=requests)
+        nc.close()
+    finally:
+        shutil.rmtree(path)
+
+    print('{} nodes, GetMetadata minmax and {} tiles of one time step'.format(nodes, tiles))
+    print('{:>24} {:>8.1f} ms'.format('read per request', uncached * 1000))
+    print('{:>24} {:>8.1f} ms {:>8.1f}x'.format('slab cache', slabbed * 1000, uncached / slabbed))
+    print('{} workers reading the same slab'.format(workers))
+    print('{:>24} {:>8.1f} ms {:>8.1f} MB'.format('slab per worker', copies * 1000, held['private'] / 1024 ** 2))
+    print('{:>24} {:>8.1f} ms {:>8.1f} MB'.format('shared slab store', mapped * 1000, held['shared'] / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
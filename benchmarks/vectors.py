@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Vector tiles of a dense triangular mesh: every vector in the tile drawn with
+matplotlib's quiver (what UGRID tiles did, the VECTORSTEP thinning had no
+effect) versus screen space thinning and the batched arrow renderer in
+``wms.vectors``, and both renderers for the same (thinned) vectors.
+
+    python -m benchmarks.vectors [mesh_faces]
+"""
+import sys
+
+import numpy as np
+
+from benchmarks import setup, timed, triangle_mesh
+setup()
+
+from wms import data_handler, mpl_handler, vectors, projections  # noqa: E402
+from wms.topology import UGridTopology  # noqa: E402
+from wms.utils import DotDict  # noqa: E402
+from benchmarks.raster import tile_request  # noqa: E402
+
+
+def main(num_faces=1000000):
+    nodes, faces = triangle_mesh(num_faces)
+    ug = UGridTopology('mesh', nodes, faces)
+    u = np.sin(nodes[:, 1] * 3)
+    v = np.cos(nodes[:, 0] * 3)
+    x, y = ug.projected('node', 'EPSG:3857')
+    request = tile_request(x, y)
+    request.GET.update(vectorscale=30, vectorstep=1)
+    bbox = request.GET['bbox']
+    minlon, minlat = projections.to_wgs84('EPSG:3857', bbox.minx, bbox.miny)
+    maxlon, maxlat = projections.to_wgs84('EPSG:3857', bbox.maxx, bbox.maxy)
+    idx = data_handler.ugrid_lat_lon_subset_idx(nodes[:, 0], nodes[:, 1], (minlon, minlat, maxlon, maxlat),
+                                                index=ug.bucket_index('node'))
+
+    thinned = vectors.thin_mask(x, y, idx, request)
+    everything = timed(mpl_handler.quiver_response, None, None, u[idx], v[idx], request,
+                       projected=(x[idx], y[idx]), repeat=3)
+    thin = timed(vectors.thin_mask, x, y, idx, request, repeat=3)
+    quiver = timed(mpl_handler.quiver_response, None, None, u[thinned], v[thinned], request,
+                   projected=(x[thinned], y[thinned]), repeat=3)
+    arrows = timed(vectors.arrows_response, x[thinned], y[thinned], u[thinned], v[thinned], request, repeat=3)
+    dense = timed(vectors.arrows_response, x[idx], y[idx], u[idx], v[idx], request, repeat=3)
+
+    print('UGRID {} faces, 256x256 tile, {} vectors, {} after thinning'.format(faces.shape[0], idx.sum(), thinned.sum()))
+    print('{:>28} {:>8.1f} ms'.format('quiver, every vector', everything * 1000))
+    print('{:>28} {:>8.1f} ms'.format('thinning', thin * 1000))
+    print('{:>28} {:>8.1f} ms'.format('quiver, thinned', quiver * 1000))
+    print('{:>28} {:>8.1f} ms {:>6.1f}x'.format('arrows, thinned', arrows * 1000, everything / (thin + arrows)))
+    print('{:>28} {:>8.1f} ms {:>6.1f}x'.format('arrows, every vector', dense * 1000, everything / dense))
+
+
+if __name__ == '__main__':
+    main(*[ int(x) for x in sys.argv[1:] ])
@@ -42,7 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    'django.middleware.gzip.GZipMiddleware',
+    'wms.middleware.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -138,6 +138,59 @@ TOPOLOGY_PATH = os.environ.get('TOPOLOGY_PATH', os.path.join(BASE_DIR, "wms", "t
 if not os.path.exists(TOPOLOGY_PATH):
     os.makedirs(TOPOLOGY_PATH)
 
+# Upper bound (bytes) of parsed topology held in memory by each worker process
+TOPOLOGY_REGISTRY_MAX_BYTES = int(os.environ.get('TOPOLOGY_REGISTRY_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Upper bound (bytes) of pixel to cell lookup tables (one per map view) held by each worker process
+PIXEL_LOOKUP_MAX_BYTES = int(os.environ.get('PIXEL_LOOKUP_MAX_BYTES', 256 * 1024 * 1024))
+
+# Upper bound (bytes) of contour geometry (one per field, time step and contour levels) held by each worker process
+CONTOUR_CACHE_MAX_BYTES = int(os.environ.get('CONTOUR_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Upper bound (bytes) of decoded data slabs (one per variable, time step and elevation) held by each worker process, 0 disables it
+SLAB_CACHE_MAX_BYTES = int(os.environ.get('SLAB_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Decoded data slabs shared by all workers on the host as memory mapped files, instead of each worker
+# keeping its own. Best on a tmpfs. Bounded to SLAB_STORE_MAX_BYTES, 0 (the default) turns it off.
+SLAB_STORE_PATH = os.environ.get('SLAB_STORE_PATH', '/dev/shm/sci-wms-slabs')
+SLAB_STORE_MAX_BYTES = int(os.environ.get('SLAB_STORE_MAX_BYTES', 0))
+
+# Time steps each worker reads ahead (between requests) after a GetMap, in the direction a layer is animated. 0 turns it off.
+# At most PREFETCH_RATE of them per second, PREFETCH_TILES also renders the same tile into the tile cache.
+PREFETCH_STEPS = int(os.environ.get('PREFETCH_STEPS', 2))
+PREFETCH_RATE = float(os.environ.get('PREFETCH_RATE', 4))
+PREFETCH_TILES = os.environ.get('PREFETCH_TILES', 'false').lower() in ('true', '1', 'yes')
+
+# Files (an aggregation counts each of its files) held open by the dataset handles each worker process keeps between requests
+DATASET_HANDLE_MAX_FILES = int(os.environ.get('DATASET_HANDLE_MAX_FILES', 512))
+
+# Seconds a dataset handle is used before the files of the dataset are checked for changes (stat of every
+# file of an aggregation), 0 checks them for every request
+DATASET_VERSION_INTERVAL = int(os.environ.get('DATASET_VERSION_INTERVAL', 10))
+
+# zlib compression level (0-9) of the PNG map tiles: lower is faster, higher is smaller
+PNG_COMPRESSION_LEVEL = int(os.environ.get('PNG_COMPRESSION_LEVEL', 6))
+
+# Write map tiles with at most 256 colors as 8-bit indexed PNGs
+PNG_PALETTE = os.environ.get('PNG_PALETTE', 'true').lower() in ('true', '1', 'yes')
+
+# Draw at most one vector per VECTOR_SPACING x VECTOR_SPACING pixels (times VECTORSTEP) of a tile, 0 draws all of them
+VECTOR_SPACING = int(os.environ.get('VECTOR_SPACING', 16))
+
+# Rendered GetMap, GetLegendGraphic and GetMetadata responses, shared by all workers on the host.
+# Bounded to TILE_CACHE_MAX_BYTES on disk, 0 disables the cache.
+TILE_CACHE_PATH = os.environ.get('TILE_CACHE_PATH', os.path.join(BASE_DIR, 'wms', 'cache', 'tiles'))
+TILE_CACHE_MAX_BYTES = int(os.environ.get('TILE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Blocks of the variables of remote (OPeNDAP, HTTP) datasets downloaded by the workers, shared by all
+# workers on the host. Bounded to BLOCK_CACHE_MAX_BYTES on disk, 0 disables the cache.
+BLOCK_CACHE_PATH = os.environ.get('BLOCK_CACHE_PATH', os.path.join(BASE_DIR, 'wms', 'cache', 'blocks'))
+BLOCK_CACHE_MAX_BYTES = int(os.environ.get('BLOCK_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Draw web mercator tiles in blocks of METATILE_SIZE x METATILE_SIZE tiles and keep the
+# others in the tile cache. 1 turns metatiles off.
+METATILE_SIZE = int(os.environ.get('METATILE_SIZE', 2))
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
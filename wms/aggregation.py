@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Time aggregations (a glob of files opened as an EnhancedMFDataset) read one
+member file at a time.
+
+Opening the aggregation opens every file matching the glob, even though a
+tile only reads from the file holding its time index. update_time_cache,
+which opens the whole aggregation anyway, stores the member files and their
+number of times in the time cache and requests then open the first file (for
+the attributes and the variables without a time dimension) and the files
+they read from, through the worker's handle pool.
+
+The index is as current as the time cache: files added to the glob are seen
+once update_time_cache runs again, like their times. A member file that no
+longer holds the times the index says it does (a forecast file growing or
+rewritten in place) or that is gone (the oldest file of a rolling archive) is
+noticed when it is opened: the read is made from the whole aggregation instead
+and the worker stops using the index until the time cache is rebuilt.
+"""
+from contextlib import ExitStack
+from collections.abc import Mapping
+
+import numpy as np
+
+from wms import handles
+from wms.lru import LRUCache
+from wms import logger  # noqa
+
+AGGDIM = 'time'
+
+
+def file_index(nc):
+    """ [(file, number of times)] of the members of an aggregation, None for any other dataset """
+    # The first file's dimensions are replaced by the aggregated ones, the
+    # length of each file is kept aside
+    files = getattr(nc, '_files', None)
+    lengths = getattr(nc, '_cdfVLen', None)
+    if files is None or lengths is None or len(files) != len(lengths):
+        return None
+    return [ (str(f), int(n)) for f, n in zip(files, lengths) ]
+
+
+class StaleIndex(ValueError):
+    """ A member file does not hold the times the file index says it does """
+
+
+class AggregatedVariable(object):
+    """
+    A variable of the first file, read across the member files when its first
+    dimension is the aggregated one.
+    """
+
+    def __init__(self, aggregation, variable):
+        self.aggregation = aggregation
+        self.variable = variable
+        self.aggregated = bool(variable.dimensions) and variable.dimensions[0] == aggregation.aggdim
+
+    def __getattr__(self, name):
+        return getattr(self.variable, name)
+
+    @property
+    def shape(self):
+        if not self.aggregated:
+            return self.variable.shape
+        return (self.aggregation.size,) + tuple(self.variable.shape[1:])
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not self.aggregated:
+            return self.variable[key]
+
+        if not self.aggregation.stale:
+            try:
+                return self.read(key)
+            except StaleIndex as e:
+                if self.aggregation.fallback is None:
+                    raise
+                # The times of the glob are not the ones of the time cache anymore
+                logger.error("Reading {} from the whole aggregation, time indexes are off until the time cache "
+                             "is updated: {}".format(self.name, e))
+        return self.aggregation.whole().variables[self.name][key]
+
+    def read(self, key):
+        """ ``variable[key]`` from the member files holding the times """
+        first, rest = split_key(key, self.variable.ndim)
+        total = self.aggregation.size
+        if isinstance(first, (int, np.integer)) and not isinstance(first, (bool, np.bool_)):
+            index = int(first) + total if first < 0 else int(first)
+            if not 0 <= index < total:
+                raise IndexError('index {} is out of bounds for axis 0 with size {}'.format(first, total))
+            member, local = self.aggregation.locate(index)
+            return self.aggregation.member(member).variables[self.name][(local,) + rest]
+
+        # Slices, index lists and masks
+        indexes = np.arange(total)[first]
+        if indexes.ndim != 1:
+            raise IndexError('Unsupported index {!r} of an aggregated variable'.format(first))
+        if not indexes.size:
+            return self.variable[(slice(0, 0),) + rest]
+
+        members, locals_ = self.aggregation.locate(indexes)
+        parts = []
+        # Runs of indexes in the same file are read together
+        for run in np.split(np.arange(indexes.size), np.flatnonzero(np.diff(members)) + 1):
+            variable = self.aggregation.member(members[run[0]]).variables[self.name]
+            parts.append(variable[(as_slice(locals_[run]),) + rest])
+        if len(parts) == 1:
+            return parts[0]
+        return np.ma.concatenate([ np.ma.asarray(p) for p in parts ], axis=0)
+
+
+def split_key(key, ndim):
+    """ The index of the first axis and the index of the others """
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = [ k is Ellipsis for k in key ].index(True)
+        key = key[:i] + (slice(None),) * (ndim - len(key) + 1) + key[i + 1:]
+    if not key:
+        return slice(None), ()
+    return key[0], tuple(key[1:])
+
+
+def as_slice(indexes):
+    """ A slice for evenly spaced increasing indexes, the indexes otherwise """
+    if indexes.size == 1:
+        return slice(int(indexes[0]), int(indexes[0]) + 1)
+    steps = np.diff(indexes)
+    if steps[0] > 0 and (steps == steps[0]).all():
+        return slice(int(indexes[0]), int(indexes[-1]) + 1, int(steps[0]))
+    return indexes
+
+
+class AggregatedVariables(Mapping):
+    """ The variables of the first file, wrapped as they are looked up """
+
+    def __init__(self, aggregation):
+        self.aggregation = aggregation
+        self.wrapped = {}
+
+    def __getitem__(self, name):
+        if name not in self.wrapped:
+            self.wrapped[name] = AggregatedVariable(self.aggregation, self.aggregation.master.variables[name])
+        return self.wrapped[name]
+
+    def __iter__(self):
+        return iter(self.aggregation.master.variables)
+
+    def __len__(self):
+        return len(self.aggregation.master.variables)
+
+
+class LazyAggregation(object):
+    """
+    An aggregation opened from its file index, a context manager returning the
+    member handles it checked out to ``pool`` on exit. ``master`` (the first
+    file) is None when it could not be opened.
+
+    ``fallback`` returns a context manager of the handle of the whole
+    aggregation, read from once a member file is found ``stale`` (it does
+    not match the index). Without one StaleIndex is raised.
+    """
+
+    def __init__(self, files, aggdim=AGGDIM, pool=None, fallback=None):
+        self.files = [ f for f, _ in files ]
+        self.lengths = [ n for _, n in files ]
+        self.offsets = np.cumsum([0] + self.lengths)
+        self.size = int(self.offsets[-1])
+        self.aggdim = aggdim
+        self.pool = pool or handles.pool
+        self.fallback = fallback
+        self.stale = False
+        self.members = {}
+        self.master = None
+        self._whole = None
+        self.variables = AggregatedVariables(self)
+        self._stack = ExitStack()
+
+    def __enter__(self):
+        try:
+            self.master = self.member(0)
+        except (OSError, StaleIndex) as e:
+            logger.warning("Could not open {} from its file index: {}".format(self.files[0], e))
+            self.master = None
+        return self
+
+    def __exit__(self, *exc):
+        self.members.clear()
+        return self._stack.__exit__(*exc)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or self.master is None:
+            raise AttributeError(name)
+        return getattr(self.master, name)
+
+    def locate(self, index):
+        """ The member and the index within the member of aggregated indexes """
+        member = np.searchsorted(self.offsets, index, side='right') - 1
+        return member, index - self.offsets[member]
+
+    def member(self, i):
+        """ The open handle of the i-th file """
+        i = int(i)
+        if i not in self.members:
+            path = self.files[i]
+            nc = self._stack.enter_context(self.pool.checkout(path, self.pool.path_version(path)))
+            if nc is None:
+                # Removed from the glob, like the oldest file of a rolling archive
+                self.stale = True
+                raise StaleIndex('Could not open {}, it changed since the time cache was built'.format(path))
+            if self.aggdim not in nc.dimensions or len(nc.dimensions[self.aggdim]) != self.lengths[i]:
+                self.stale = True
+                raise StaleIndex('{} changed since the time cache was built'.format(path))
+            self.members[i] = nc
+        return self.members[i]
+
+    def whole(self):
+        """ The handle of the whole aggregation from ``fallback``, opened on first use """
+        if self._whole is None:
+            self._whole = self._stack.enter_context(self.fallback())
+            if self._whole is None:
+                raise OSError('Could not open the aggregation of {}'.format(self.files[0]))
+        return self._whole
+
+    def get_variables_by_attributes(self, **kwargs):
+        return [ self.variables[v.name] for v in self.master.get_variables_by_attributes(**kwargs) ]
+
+    def isopen(self):
+        return self.master is not None and self.master.isopen()
+
+    def close(self):
+        # Handles belong to the pool
+        pass
+
+
+class FileIndexRegistry(object):
+    """
+    Per-worker copy of the file index of each aggregation, loaded from the time
+    cache and tagged with the dataset's ``cache_last_updated`` like the time
+    axes.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.cache = LRUCache(max_bytes)
+
+    def get(self, time_cache_file, version, load):
+        entry = self.cache.get(time_cache_file)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        files = load()
+        if files is not None:
+            self.cache.set(time_cache_file, (version, files))
+        return files
+
+    def discard(self, time_cache_file, version):
+        """ The file index at ``version`` is stale, use none until the time cache changes """
+        self.cache.set(time_cache_file, (version, None))
+
+    def invalidate(self, time_cache_file):
+        self.cache.delete(time_cache_file)
+
+    def clear(self):
+        self.cache.clear()
+
+
+registry = FileIndexRegistry(max_bytes=16 * 1024 * 1024)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Blocks of the variables of remote (OPeNDAP or HTTP) datasets kept on local
+disk, so tiles reading a part of a variable that was downloaded before
+(zooming back and forth over an area, an animation played again) don't
+download it again.
+
+Reads are split into blocks of about ``BLOCK_BYTES``: the trailing (spatial)
+axes are split first and the leading (time, depth) axes are one index per
+block. Blocks are keyed by the URI, variable and block index and kept in a
+directory per dataset, shared by every worker on the host and bounded by
+``BLOCK_CACHE_MAX_BYTES``. update_time_cache removes the blocks of a dataset
+when its times change.
+
+Reads that would need many blocks (a time series at a point) or download a
+lot more than they ask for are passed straight to the dataset.
+"""
+import io
+import hashlib
+import itertools
+from collections.abc import Mapping
+
+import numpy as np
+from django.conf import settings
+
+from wms.tilecache import TileCache
+
+from wms import logger  # noqa
+
+BLOCK_BYTES = 1024 * 1024
+# Reads of more blocks than this are not cached
+MAX_BLOCKS = 64
+# Reads download at most OVERFETCH times what they ask for (or a block, for small reads)
+OVERFETCH = 16
+
+
+def block_shape(shape, itemsize, nbytes=None):
+    """ The shape of the blocks of a variable, the last axes are split first """
+    budget = max((nbytes or BLOCK_BYTES) // itemsize, 1)
+    block = []
+    for size in reversed(shape):
+        size = max(min(size, budget), 1)
+        block.append(size)
+        budget = max(budget // size, 1)
+    return tuple(reversed(block))
+
+
+def basic_bounds(key, shape):
+    """
+    The (start, stop) of every axis and the axes indexed with an integer for
+    an index of integers and contiguous slices, None for any other index
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = key.index(Ellipsis)
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i + 1:]
+    key = key + (slice(None),) * (len(shape) - len(key))
+    if len(key) != len(shape):
+        return None
+
+    bounds = []
+    squeeze = []
+    for axis, (k, size) in enumerate(zip(key, shape)):
+        if isinstance(k, (int, np.integer)) and not isinstance(k, (bool, np.bool_)):
+            k = int(k)
+            if k < 0:
+                k += size
+            if not 0 <= k < size:
+                return None
+            bounds.append((k, k + 1))
+            squeeze.append(axis)
+        elif isinstance(k, slice):
+            start, stop, step = k.indices(size)
+            if step != 1 or start >= stop:
+                return None
+            bounds.append((start, stop))
+        else:
+            return None
+    return bounds, squeeze
+
+
+def pack(data):
+    data = np.ma.asarray(data)
+    buf = io.BytesIO()
+    np.savez(buf, data=np.ma.getdata(data), mask=np.ma.getmaskarray(data))
+    return buf.getvalue()
+
+
+def unpack(content):
+    with np.load(io.BytesIO(content)) as npz:
+        return np.ma.masked_array(npz['data'], mask=npz['mask'])
+
+
+class BlockCache(TileCache):
+    """ Blocks stored as ``.npz`` files, one directory per dataset, evicted like the tile cache """
+
+    def get_block(self, dataset, key):
+        cached = self.get(dataset, key)
+        if cached is None:
+            return None
+        try:
+            return unpack(cached[1])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set_block(self, dataset, key, data):
+        self.set(dataset, key, 'application/x-npz', pack(data))
+
+
+class CachedVariable(object):
+    """ A variable of a remote dataset that reads through the block cache """
+
+    def __init__(self, variable, cache, dataset, uri):
+        self.variable = variable
+        self.cache = cache
+        self.dataset = dataset
+        self.uri = uri
+
+    def __getattr__(self, name):
+        return getattr(self.variable, name)
+
+    def __len__(self):
+        return len(self.variable)
+
+    def block_key(self, block, index):
+        key = repr((self.uri, self.variable.name, block, index))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def __getitem__(self, key):
+        shape = self.variable.shape
+        basic = basic_bounds(key, shape)
+        if basic is None or not shape or not isinstance(self.variable.dtype, np.dtype):
+            return self.variable[key]
+        bounds, squeeze = basic
+
+        block = block_shape(shape, self.variable.dtype.itemsize)
+        ranges = [ range(start // b, (stop - 1) // b + 1) for (start, stop), b in zip(bounds, block) ]
+        indexes = list(itertools.product(*ranges))
+        if len(indexes) > MAX_BLOCKS:
+            return self.variable[key]
+
+        def extent(index):
+            return [ (i * b, min((i + 1) * b, size)) for i, b, size in zip(index, block, shape) ]
+
+        blocks = {}
+        missing = []
+        for index in indexes:
+            data = self.cache.get_block(self.dataset, self.block_key(block, index))
+            if data is None:
+                missing.append(index)
+            else:
+                blocks[index] = data
+
+        if missing:
+            # One read of the hyperslab holding all of the missing blocks
+            lower = [ min(e[0] for e in axis) for axis in zip(*[ extent(i) for i in missing ]) ]
+            upper = [ max(e[1] for e in axis) for axis in zip(*[ extent(i) for i in missing ]) ]
+            requested = np.prod([ stop - start for start, stop in bounds ])
+            limit = OVERFETCH * max(requested, BLOCK_BYTES // self.variable.dtype.itemsize)
+            if np.prod([ u - l for l, u in zip(lower, upper) ]) > limit:
+                return self.variable[key]
+
+            slab = np.ma.asarray(self.variable[tuple(slice(l, u) for l, u in zip(lower, upper))])
+            for index in missing:
+                data = slab[tuple(slice(s - l, e - l) for (s, e), l in zip(extent(index), lower))]
+                self.cache.set_block(self.dataset, self.block_key(block, index), data)
+                blocks[index] = data
+
+        out = None
+        for index, data in blocks.items():
+            if out is None:
+                out = np.ma.masked_all([ stop - start for start, stop in bounds ], dtype=data.dtype)
+            # Where the block and the read overlap, in the coordinates of each
+            inside = [ (max(s, start), min(e, stop)) for (s, e), (start, stop) in zip(extent(index), bounds) ]
+            out[tuple(slice(a - start, b - start) for (a, b), (start, _) in zip(inside, bounds))] = \
+                data[tuple(slice(a - s, b - s) for (a, b), (s, _) in zip(inside, extent(index)))]
+        return out[tuple(0 if axis in squeeze else slice(None) for axis in range(len(shape)))]
+
+
+class CachedVariables(Mapping):
+
+    def __init__(self, variables, cache, dataset, uri):
+        self.variables = variables
+        self.cache = cache
+        self.dataset = dataset
+        self.uri = uri
+
+    def __getitem__(self, name):
+        return CachedVariable(self.variables[name], self.cache, self.dataset, self.uri)
+
+    def __iter__(self):
+        return iter(self.variables)
+
+    def __len__(self):
+        return len(self.variables)
+
+
+class CachedDataset(object):
+    """
+    A remote dataset whose ``variables`` read through the block cache, everything
+    else is the dataset's own. ``dataset`` names the directory of its blocks.
+    """
+
+    def __init__(self, nc, dataset, uri, block_cache=None):
+        self.nc = nc
+        self.variables = CachedVariables(nc.variables, block_cache or cache, dataset, uri)
+
+    def __getattr__(self, name):
+        return getattr(self.nc, name)
+
+
+cache = BlockCache(settings.BLOCK_CACHE_PATH, settings.BLOCK_CACHE_MAX_BYTES)
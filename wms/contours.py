@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Contours of a whole field, computed once in projected coordinates and drawn
+by every tile (and style) of it. A tile only draws the contour polygons or
+lines that cross its bbox, without reading the data or tracing the contours
+again.
+"""
+import numpy as np
+import matplotlib as mpl
+import matplotlib.tri as Tri
+from matplotlib.path import Path
+from matplotlib.collections import PathCollection
+from django.conf import settings
+
+from wms import figures
+from wms.lru import LRUCache
+from wms.mpl_handler import DEFAULT_HATCHES
+from wms.data_handler import figure_response
+
+from wms import logger  # noqa
+
+FILLED = ('filledcontours', 'filledhatches', 'hatches')
+
+
+def split_lines(path):
+    """ A compound path of contour lines as one path per line """
+    if path.codes is None:
+        return [path]
+    starts = np.flatnonzero(path.codes == Path.MOVETO)
+    ends = np.append(starts[1:], len(path.codes))
+    return [Path(path.vertices[s:e], path.codes[s:e]) for s, e in zip(starts, ends)]
+
+
+def level_paths(cs, filled):
+    """ The paths of each level of a matplotlib ContourSet """
+    if isinstance(cs, mpl.collections.Collection):
+        # matplotlib >= 3.8, a single compound path per level. Polygons are
+        # kept together with their holes, lines can be culled one by one.
+        paths = [[p] if len(p.vertices) else [] for p in cs.get_paths()]
+        if not filled:
+            paths = [[line for p in level for line in split_lines(p)] for level in paths]
+        return paths
+    return [c.get_paths() for c in cs.collections]
+
+
+class ContourSet(object):
+    """
+    The contour lines (or filled contours between levels) of a field. ``values``
+    are what each level is colored by, like matplotlib does: the levels for
+    lines, the middle of each pair of levels for filled contours.
+    """
+
+    def __init__(self, levels, values, paths, filled):
+        self.levels = np.asarray(levels)
+        self.values = np.asarray(values)
+        self.paths = paths
+        self.filled = filled
+        # (minx, miny, maxx, maxy) of every path of every level
+        self.extents = [
+            np.array([p.get_extents().extents for p in level]).reshape(-1, 4)
+            for level in paths
+        ]
+
+    @classmethod
+    def from_mpl(cls, cs, filled):
+        values = cs.layers if filled else cs.levels
+        return cls(cs.levels, values, level_paths(cs, filled), filled)
+
+    def visible(self, bbox):
+        """ The paths of each level that cross a bbox """
+        for paths, extents in zip(self.paths, self.extents):
+            inside = (
+                (extents[:, 0] <= bbox.maxx) & (extents[:, 2] >= bbox.minx) &
+                (extents[:, 1] <= bbox.maxy) & (extents[:, 3] >= bbox.miny)
+            )
+            yield [p for p, keep in zip(paths, inside) if keep]
+
+    @property
+    def nbytes(self):
+        paths = sum(
+            p.vertices.nbytes + (0 if p.codes is None else p.codes.nbytes)
+            for level in self.paths for p in level
+        )
+        return paths + sum(e.nbytes for e in self.extents) + self.levels.nbytes + self.values.nbytes
+
+
+def get_norm(request, vmin=None, vmax=None):
+    if request.GET['logscale'] is True:
+        return mpl.colors.LogNorm(vmin=vmin, vmax=vmax)
+    return mpl.colors.Normalize(vmin=vmin, vmax=vmax)
+
+
+def request_key(request):
+    """ What the contours of a field depend on besides the data """
+    colorscalerange = request.GET['colorscalerange']
+    return (
+        request.GET['crs'],
+        request.GET['image_type'] in FILLED,
+        colorscalerange.min,
+        colorscalerange.max,
+        request.GET['numcontours'],
+        request.GET['logscale'] is True,
+    )
+
+
+def contour_set(x, y, data, request, triangles=None):
+    """
+    Contours of a field at projected x/y, the levels are chosen the way
+    mpl_handler.contouring_response does. With ``triangles`` the field is a
+    triangular mesh (node data), otherwise a curvilinear grid.
+    """
+    colorscalerange = request.GET['colorscalerange']
+    cmin = colorscalerange.min
+    cmax = colorscalerange.max
+    filled = request.GET['image_type'] in FILLED
+
+    data = np.ma.masked_invalid(data).astype(np.float64)
+    if cmin is not None and cmax is not None:
+        data = np.ma.clip(data, cmin, cmax)
+        levels = np.linspace(cmin, cmax, request.GET['numcontours'])
+        norm = get_norm(request, cmin, cmax)
+    else:
+        levels = request.GET['numcontours']
+        norm = get_norm(request)
+
+    # Any figure will do, the contours are in data coordinates
+    with figures.pool.figure(1, 1, 72.) as (fig, ax):
+        if triangles is not None:
+            tri = Tri.Triangulation(x, y, triangles=triangles)
+            # Avoid triangles with nan values
+            invalid = np.ma.getmaskarray(data) | ~np.isfinite(x) | ~np.isfinite(y)
+            tri.set_mask(np.any(invalid[triangles], axis=1))
+            contour = ax.tricontourf if filled else ax.tricontour
+            # Masked triangles are not contoured, their values only have to be within the range
+            cs = contour(tri, data.filled(data.min()), levels, norm=norm)
+        else:
+            contour = ax.contourf if filled else ax.contour
+            cs = contour(x, y, data, levels, norm=norm)
+        return ContourSet.from_mpl(cs, filled)
+
+
+contour_sets = LRUCache(max_bytes=settings.CONTOUR_CACHE_MAX_BYTES)
+
+
+def cached(topo, key, build):
+    """
+    The contour set of a field of a topology (wms.topology), built on first
+    use. The topology version is part of the key so rebuilt grids never reuse one.
+    """
+    key = (topo.key, topo.version) + tuple(key)
+    cs = contour_sets.get(key)
+    if cs is None:
+        cs = contour_sets.set(key, build())
+    return cs
+
+
+def contour_response(cs, request, dpi=None):
+    """ A tile of a cached ContourSet, drawn like mpl_handler.contouring_response """
+    dpi = dpi or 80.
+    bbox = request.GET['bbox']
+    image_type = request.GET['image_type']
+    cmap = mpl.cm.get_cmap(request.GET['colormap'])
+    colorscalerange = request.GET['colorscalerange']
+
+    norm = get_norm(request, colorscalerange.min, colorscalerange.max)
+    # matplotlib scales colors to the levels, filled contours are colored by the layers between them
+    norm.autoscale_None(cs.levels)
+    colors = cmap(norm(cs.values))
+
+    hatches = [None] * len(cs.paths)
+    if image_type in ('filledhatches', 'hatches'):
+        nhatches = request.GET['numcontours']
+        hatches = [DEFAULT_HATCHES[:nhatches][i % nhatches] for i in range(len(cs.paths))]
+
+    with figures.pool.figure(request.GET['width'], request.GET['height'], dpi) as (fig, ax):
+        for paths, color, hatch in zip(cs.visible(bbox), colors, hatches):
+            if not paths:
+                continue
+            if not cs.filled:
+                collection = PathCollection(paths, facecolors='none', edgecolors=[color],
+                                            linewidths=mpl.rcParams['lines.linewidth'])
+            elif image_type == 'hatches':
+                collection = PathCollection(paths, facecolors='none', edgecolors='none',
+                                            antialiaseds=False, hatch=hatch)
+            else:
+                collection = PathCollection(paths, facecolors=[color], edgecolors='none',
+                                            antialiaseds=False, hatch=hatch)
+            ax.add_collection(collection, autolim=False)
+
+        ax.set_xlim(bbox.minx, bbox.maxx)
+        ax.set_ylim(bbox.miny, bbox.maxy)
+        ax.set_frame_on(False)
+        ax.set_clip_on(False)
+        ax.set_position([0., 0., 1., 1.])
+
+        return figure_response(fig, request, tight=False)
@@ -5,8 +5,11 @@ import numpy as np
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 
+from django.conf import settings
 from django.http.response import HttpResponse
 
+from wms import png
+
 
 def lat_lon_subset_idx(lon, lat, lonmin, latmin, lonmax, latmax, padding=0.18):
     """
@@ -30,7 +33,20 @@ def faces_subset_idx(face_indicies, spatial_idx):
     return np.asarray(np.where(np.all(np.in1d(face_indicies, spatial_idx).reshape(face_indicies.shape), axis=1))).squeeze()
 
 
-def face_idx_from_node_idx(faces, spatial_idx):
+def face_idx_from_node_idx(faces, spatial_idx, candidates=None):
+    """
+    Faces with all of their nodes in ``spatial_idx``. When ``candidates`` (the
+    face indexes that may qualify) are given only those faces are tested.
+    """
+    if candidates is not None:
+        sub = np.asarray(faces[candidates])
+        # Masked (padded) vertices are never in the subset
+        valid = (sub >= 0) & (sub < spatial_idx.size)
+        keep = np.all(valid & spatial_idx[np.where(valid, sub, 0)], axis=1)
+        faces_idx = np.zeros(faces.shape[0], dtype=bool)
+        faces_idx[candidates[keep]] = True
+        return faces_idx
+
     # Convert from bool array to index array
     subset_indexes = np.where(spatial_idx==True)  # noqa: E225
     intersect = np.in1d(faces, subset_indexes).reshape(faces.shape)  # Intersect on the node indexes
@@ -38,8 +54,33 @@ def face_idx_from_node_idx(faces, spatial_idx):
     return faces_idx
 
 
-def figure_response(fig, request, adjust=None, **kwargs):
-    canvas = FigureCanvasAgg(fig)
+def png_response(rgba):
+    """
+    PNG response of a (height, width, 4) uint8 image. The image is kept as
+    ``response.pixels()``, e.g. to cut a metatile into tiles.
+    """
+    data = png.encode(rgba, level=settings.PNG_COMPRESSION_LEVEL, palette=settings.PNG_PALETTE)
+    response = HttpResponse(data, content_type='image/png')
+    response.pixels = lambda: rgba
+    return response
+
+
+def figure_response(fig, request, adjust=None, tight=True, **kwargs):
+    """
+    PNG response of a figure. Map tiles fill their whole figure and pass
+    ``tight=False``: a tight bbox only pads them and costs a second draw.
+    """
+    canvas = fig.canvas
+    if not isinstance(canvas, FigureCanvasAgg):
+        canvas = FigureCanvasAgg(fig)
+
+    if tight is False:
+        canvas.draw()
+        renderer = canvas.get_renderer()
+        # A copy, the buffer is drawn over by the next request using the figure
+        rgba = np.frombuffer(renderer.buffer_rgba(), dtype=np.uint8).copy()
+        return png_response(rgba.reshape(int(renderer.height), int(renderer.width), 4))
+
     figdata = io.BytesIO()
     canvas.print_png(figdata, bbox_inches='tight', pad_inches=0.1, **kwargs)
     response = HttpResponse(figdata.getvalue(), content_type='image/png')
@@ -62,19 +103,77 @@ def blank_figure(width, height, dpi=5):
     return fig
 
 
-def ugrid_lat_lon_subset_idx(lon, lat, bbox, padding=None):
+def padded_bbox(bbox, padding=None):
+    padding = padding or 0.18
+    return (bbox[0] - padding, bbox[1] - padding, bbox[2] + padding, bbox[3] + padding)
+
+
+def ugrid_lat_lon_subset_idx(lon, lat, bbox, padding=None, index=None):
     """
     Assumes the size of lat/lon are equal (UGRID variables).
     Returns a boolean mask array of the indexes, suitable for slicing
-    """
 
-    padding = padding or 0.18
+    If a spatial ``index`` (wms.topology.BucketIndex) over lon/lat is given
+    only the points it returns for the bbox are tested.
+    """
 
-    minlon = bbox[0] - padding
-    minlat = bbox[1] - padding
-    maxlon = bbox[2] + padding
-    maxlat = bbox[3] + padding
+    minlon, minlat, maxlon, maxlat = padded_bbox(bbox, padding)
 
     land = np.logical_and
+    if index is not None:
+        candidates = index.query((minlon, minlat, maxlon, maxlat))
+        clon = lon[candidates]
+        clat = lat[candidates]
+        spatial_idx = np.zeros(lon.size, dtype=bool)
+        spatial_idx[candidates] = land(land(clon >= minlon, clon <= maxlon),
+                                       land(clat >= minlat, clat <= maxlat))
+        return spatial_idx
+
     return land(land(lon >= minlon, lon <= maxlon),
                 land(lat >= minlat, lat <= maxlat))
+
+
+# Gaps of up to READ_MAX_GAP values between the indexes read are read through, and
+# no more than READ_MAX_RUNS contiguous hyperslabs are read for one request
+READ_MAX_GAP = 4096
+READ_MAX_RUNS = 32
+
+
+def index_runs(indexes, max_gap=READ_MAX_GAP, max_runs=READ_MAX_RUNS):
+    """
+    The (start, stop) ranges to read to get the values at sorted, unique
+    ``indexes``. Ranges closer than ``max_gap`` are joined, then the closest
+    ones until there are at most ``max_runs`` of them.
+    """
+    indexes = np.asarray(indexes)
+    if indexes.size == 0:
+        return []
+
+    gaps = np.diff(indexes) - 1
+    breaks = np.flatnonzero(gaps > max_gap)
+    if breaks.size >= max_runs:
+        # Only keep the widest gaps
+        breaks = np.sort(breaks[np.argsort(gaps[breaks], kind='stable')[breaks.size - max_runs + 1:]])
+    starts = np.concatenate(([indexes[0]], indexes[breaks + 1]))
+    stops = np.concatenate((indexes[breaks] + 1, [indexes[-1] + 1]))
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def read_indexes(variable, prefix, indexes, **kwargs):
+    """
+    ``variable[prefix + (indexes,)]`` for sorted, unique indexes into the last
+    dimension of a NetCDF variable, read as a few contiguous hyperslabs
+    (index_runs) instead of the whole dimension or value by value.
+    """
+    indexes = np.asarray(indexes)
+    runs = index_runs(indexes, **kwargs)
+    if not runs:
+        return np.ma.masked_all(indexes.shape)
+
+    parts = [ variable[tuple(prefix) + (slice(start, stop),)] for start, stop in runs ]
+    data = parts[0] if len(parts) == 1 else np.ma.concatenate(parts, axis=-1)
+
+    starts = np.array([ start for start, _ in runs ])
+    offsets = np.cumsum([0] + [ stop - start for start, stop in runs[:-1] ])
+    run = np.searchsorted(starts, indexes, side='right') - 1
+    return data[..., offsets[run] + indexes - starts[run]]
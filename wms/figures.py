@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+def new_figure(width, height, dpi):
+    """ A transparent (width, height) pixel figure with one axes covering all of it """
+    fig = Figure(dpi=dpi, facecolor='none', edgecolor='none')
+    fig.set_alpha(0)
+    fig.set_figheight(height / dpi)
+    fig.set_figwidth(width / dpi)
+    ax = fig.add_axes([0., 0., 1., 1.], xticks=[], yticks=[])
+    ax.set_axis_off()
+    FigureCanvasAgg(fig)
+    return fig, ax
+
+
+class PooledFigure(object):
+    """ A tile figure that remembers what it held when it was new """
+
+    def __init__(self, width, height, dpi):
+        self.fig, self.ax = new_figure(width, height, dpi)
+        self.empty = set(self.ax.get_children())
+
+    def clear(self):
+        # Much cheaper than ax.cla(), which rebuilds the axis and spines
+        for artist in self.ax.get_children():
+            if artist not in self.empty:
+                artist.remove()
+
+
+class FigurePool(object):
+    """
+    Reusable figure, axes and Agg canvas for each tile size (width, height,
+    dpi). Building a Figure and its canvas costs about as much as drawing a
+    tile, so each thread keeps one of each size it renders and clears what
+    was drawn on it before handing it out again.
+
+    Figures are not safe to share between threads, so each thread keeps its
+    own.
+    """
+
+    def __init__(self, max_figures=8):
+        self.max_figures = max_figures
+        self._local = threading.local()
+
+    def _free(self):
+        free = getattr(self._local, 'free', None)
+        if free is None:
+            free = self._local.free = OrderedDict()
+        return free
+
+    @contextmanager
+    def figure(self, width, height, dpi):
+        """
+        Yields (fig, ax) to draw a tile on. The figure goes back to the pool when
+        the block exits, so it has to be rendered inside of it.
+        """
+        key = (width, height, dpi)
+        free = self._free()
+        pooled = free.pop(key, None) or PooledFigure(width, height, dpi)
+
+        # A figure that failed half way through a drawing is not reused
+        yield pooled.fig, pooled.ax
+
+        pooled.clear()
+        free[key] = pooled
+        while len(free) > self.max_figures:
+            free.popitem(last=False)
+
+    def clear(self):
+        self._local.free = OrderedDict()
+
+
+pool = FigurePool()
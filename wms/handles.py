@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Open dataset handles kept by each worker between requests, so a tile does not
+reopen the NetCDF file (or every file of an aggregation) it reads from.
+
+A handle is used by one request at a time: requests for a dataset that is
+already in use open another handle. Idle handles are closed, least recently
+used first, when the files held open go over ``DATASET_HANDLE_MAX_FILES``,
+and a handle is reopened when its version (the files on disk and the time the
+dataset was last updated) changes. The files on disk are looked at again at
+most every ``DATASET_VERSION_INTERVAL`` seconds, a tile of an aggregation does
+not glob and stat every file.
+"""
+import os
+import glob
+import time
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from django.conf import settings
+from pyaxiom.netcdf import EnhancedDataset, EnhancedMFDataset
+
+from wms import logger
+
+
+def open_dataset(path):
+    """ A single file or OPeNDAP dataset, or else an aggregation over time. None if neither opens """
+    try:
+        return EnhancedDataset(path)
+    except (RuntimeError, OSError):
+        try:
+            return EnhancedMFDataset(path, aggdim='time')
+        except (IndexError, RuntimeError, OSError, ValueError):
+            return None
+
+
+def path_version(path):
+    """
+    Identify the version of the files of a dataset on disk, from the name, mtime
+    and size of each (every file matching the glob of an aggregation). Remote
+    datasets have no version of their own.
+    """
+    if urlparse(path).scheme:
+        return None
+    files = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+    version = []
+    for f in files:
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+        version.append((f, st.st_mtime_ns, st.st_size))
+    return tuple(version)
+
+
+def open_files(nc):
+    """ The number of files a handle holds open """
+    return max(len(getattr(nc, '_cdf', ())), 1)
+
+
+class HandlePool(object):
+    """
+    Per-worker pool of open dataset handles keyed by path. ``idle`` holds the
+    handles not in use, least recently used first.
+    """
+
+    def __init__(self, max_files=None, opener=open_dataset, version_interval=None):
+        self.max_files = max_files
+        self.opener = opener
+        self.version_interval = version_interval
+        self.files = 0
+        self.hits = 0
+        self.misses = 0
+        self.idle = OrderedDict()
+        self.versions = {}
+        self._lock = threading.RLock()
+
+    def path_version(self, path):
+        """ path_version of ``path``, looked up again once it is ``version_interval`` seconds old """
+        if not self.version_interval:
+            return path_version(path)
+        now = time.monotonic()
+        with self._lock:
+            checked = self.versions.get(path)
+        if checked is not None and now - checked[0] < self.version_interval:
+            return checked[1]
+        version = path_version(path)
+        with self._lock:
+            self.versions[path] = (now, version)
+        return version
+
+    @contextmanager
+    def checkout(self, path, version=None):
+        """ An open handle of ``path`` for the duration of the block, None if it can't be opened """
+        nc = self._take(path, version)
+        if nc is None:
+            nc = self.opener(path)
+            if nc is None:
+                yield None
+                return
+            with self._lock:
+                self.files += open_files(nc)
+
+        try:
+            yield nc
+        except NotImplementedError:
+            # An unsupported request, not a failed read
+            self._give(path, version, nc)
+            raise
+        except (RuntimeError, OSError):
+            # Failed reads (a dropped OPeNDAP connection, ...) may leave the handle unusable
+            self._close(nc)
+            raise
+        except BaseException:
+            self._give(path, version, nc)
+            raise
+        self._give(path, version, nc)
+
+    def _take(self, path, version):
+        with self._lock:
+            for key in reversed(list(self.idle)):
+                if key[0] != path:
+                    continue
+                nc, handle_version = self.idle.pop(key)
+                if handle_version == version:
+                    self.hits += 1
+                    return nc
+                logger.debug("Reopening dataset {}, it changed".format(path))
+                self._close(nc)
+            self.misses += 1
+        return None
+
+    def _give(self, path, version, nc):
+        with self._lock:
+            self.idle[(path, id(nc))] = (nc, version)
+            self._evict()
+
+    def _evict(self):
+        if self.max_files is None:
+            return
+        while self.files > self.max_files and self.idle:
+            _, (nc, _) = self.idle.popitem(last=False)
+            self._close(nc)
+
+    def _close(self, nc):
+        with self._lock:
+            self.files -= open_files(nc)
+        try:
+            nc.close()
+        except BaseException:
+            pass
+
+    def invalidate(self, path):
+        """ Close the idle handles of a path, the ones in use are reopened once their version changes """
+        with self._lock:
+            self.versions.pop(path, None)
+            for key in [ k for k in self.idle if k[0] == path ]:
+                nc, _ = self.idle.pop(key)
+                self._close(nc)
+
+    def clear(self):
+        with self._lock:
+            self.versions.clear()
+            while self.idle:
+                _, (nc, _) = self.idle.popitem()
+                self._close(nc)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(idle=len(self.idle), files=self.files, max_files=self.max_files,
+                        hits=self.hits, misses=self.misses)
+
+
+pool = HandlePool(max_files=settings.DATASET_HANDLE_MAX_FILES, version_interval=settings.DATASET_VERSION_INTERVAL)
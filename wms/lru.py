@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def sizeof(obj):
+    """
+    Approximate the number of bytes held by a cached object. numpy arrays report
+    their buffer size (memory mapped arrays are backed by the page cache and are
+    not counted), containers are summed and objects may define an ``nbytes``.
+    """
+    if isinstance(obj, np.memmap):
+        return 0
+    elif isinstance(obj, np.ma.MaskedArray):
+        mask = np.ma.getmask(obj)
+        return obj.data.nbytes + (0 if mask is np.ma.nomask else mask.nbytes)
+    elif isinstance(obj, np.ndarray):
+        return obj.nbytes
+    elif isinstance(obj, (list, tuple)):
+        return sum(sizeof(x) for x in obj)
+    elif isinstance(obj, dict):
+        return sum(sizeof(x) for x in obj.values())
+    elif hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    return sys.getsizeof(obj)
+
+
+class LRUCache(object):
+    """
+    A thread-safe, least-recently-used cache bounded by the total number of
+    bytes held rather than the number of entries. Used for the per-worker
+    in-memory caches (topology, slabs, ...).
+    """
+
+    def __init__(self, max_bytes, sizeof=sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Never hold something larger than the whole budget
+                return value
+            self._data[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def delete_matching(self, predicate):
+        with self._lock:
+            for key in [ k for k in self._data if predicate(k) ]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def resize(self, key):
+        """ Re-measure an entry that grew after it was stored """
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                return
+            newsize = self.sizeof(value)
+            self._data[key] = (value, newsize)
+            self.nbytes += newsize - size
+            self._evict(keep=key)
+
+    def _discard(self, key):
+        try:
+            _, size = self._data.pop(key)
+            self.nbytes -= size
+        except KeyError:
+            pass
+
+    def _evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        while self.nbytes > self.max_bytes and self._data:
+            key = next(iter(self._data))
+            if key == keep:
+                if len(self._data) == 1:
+                    break
+                self._data.move_to_end(key)
+                continue
+            self._discard(key)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._data), nbytes=self.nbytes, max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Metatiles: a GetMap request for a tile of the web mercator tile grid is drawn
+as part of a block of N x N neighbouring tiles (a metatile). The metatile is
+cut into its tiles, the requested one is returned and the others are stored
+in the tile cache (wms.tilecache) for the requests that will follow. The data
+is read, subset and contoured once per metatile instead of once per tile, and
+contours and colors don't break at tile edges.
+"""
+import io
+import math
+from copy import copy
+
+import numpy as np
+import matplotlib.image
+from django.conf import settings
+
+from wms import projections
+from wms.utils import DotDict
+from wms.data_handler import png_response
+
+from wms import logger  # noqa
+
+# Half of the width of the web mercator world, in meters
+HALF_WORLD = 20037508.342789244
+
+WEB_MERCATOR = ('EPSG:3857', 'EPSG:900913', 'EPSG:102100', 'EPSG:102113')
+
+# Image types that draw the same on a metatile as on each of its tiles. Arrows
+# are scaled to the size of the image, so vectors are drawn tile by tile.
+IMAGE_TYPES = ('pcolor', 'contours', 'filledcontours', 'hatches', 'filledhatches')
+
+
+def tile_index(crs, bbox, width, height):
+    """
+    (zoom, x, y) of the tile of the web mercator tile grid (top left tile is
+    0, 0) a request is for, None if the request is not for a square tile of it.
+    """
+    if crs not in WEB_MERCATOR or width != height:
+        return None
+
+    size = bbox.maxx - bbox.minx
+    if size <= 0 or not math.isclose(bbox.maxy - bbox.miny, size, rel_tol=1e-6):
+        return None
+    zoom = math.log2(2 * HALF_WORLD / size)
+    x = (bbox.minx + HALF_WORLD) / size
+    y = (HALF_WORLD - bbox.maxy) / size
+    if not all(abs(v - round(v)) < 1e-6 for v in (zoom, x, y)):
+        return None
+
+    zoom, x, y = int(round(zoom)), int(round(x)), int(round(y))
+    if zoom < 0 or not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+        return None
+    return zoom, x, y
+
+
+def tile_bbox(zoom, x, y, nx=1, ny=1):
+    """ Web mercator bbox of the nx by ny tiles with (x, y) at the top left """
+    size = 2 * HALF_WORLD / 2 ** zoom
+    minx = -HALF_WORLD + x * size
+    maxy = HALF_WORLD - y * size
+    return DotDict(minx=minx, miny=maxy - ny * size, maxx=minx + nx * size, maxy=maxy)
+
+
+def with_view(request, crs, bbox, width, height):
+    """ A copy of a GetMap request for another bbox and size """
+    view = copy(request)
+    view.GET = request.GET.copy()
+    minx, miny = projections.to_wgs84(crs, bbox.minx, bbox.miny)
+    maxx, maxy = projections.to_wgs84(crs, bbox.maxx, bbox.maxy)
+    view.GET.update(dict(
+        bbox=bbox,
+        wgs84_bbox=DotDict(minx=minx, miny=miny, maxx=maxx, maxy=maxy, bbox=(minx, miny, maxx, maxy)),
+        width=width,
+        height=height,
+    ))
+    return view
+
+
+def metatile(request, size=None):
+    """
+    The tiles of the metatile a GetMap request belongs to, as (zoom, x0, y0,
+    nx, ny). None if the request is not for a tile, it can't be drawn as part
+    of a metatile or metatiles are turned off.
+    """
+    size = size or settings.METATILE_SIZE
+    if size <= 1 or request.GET.get('image_type') not in IMAGE_TYPES:
+        return None
+
+    index = tile_index(request.GET['crs'], request.GET['bbox'], request.GET['width'], request.GET['height'])
+    if index is None:
+        return None
+
+    zoom, x, y = index
+    x0 = x - x % size
+    y0 = y - y % size
+    # Fewer tiles at the edge of the world
+    nx = min(size, 2 ** zoom - x0)
+    ny = min(size, 2 ** zoom - y0)
+    if nx * ny == 1:
+        return None
+    return zoom, x0, y0, nx, ny
+
+
+def pixels(response):
+    """ The (height, width, 4) uint8 image of a PNG response, None for other responses """
+    if hasattr(response, 'pixels'):
+        return response.pixels()
+    if response.streaming or not response['Content-Type'].startswith('image/png'):
+        return None
+    image = matplotlib.image.imread(io.BytesIO(response.content), format='png')
+    image = (image * 255).round().astype(np.uint8)
+    if image.shape[2] == 3:
+        image = np.dstack((image, np.full(image.shape[:2], 255, dtype=np.uint8)))
+    return image
+
+
+def render(request, render_view, size=None):
+    """
+    Draw the metatile of a GetMap request with ``render_view(request)``. Returns
+    (the response for the request, [(request, response) for each other tile]),
+    None if the request is not part of a metatile or the metatile is not a PNG.
+    An error drawing the metatile is returned as the response, with no other
+    tiles.
+    """
+    block = metatile(request, size)
+    if block is None:
+        return None
+
+    zoom, x0, y0, nx, ny = block
+    crs = request.GET['crs']
+    width = request.GET['width']
+    height = request.GET['height']
+    view = with_view(request, crs, tile_bbox(zoom, x0, y0, nx, ny), nx * width, ny * height)
+    response = render_view(view)
+    if response.status_code != 200:
+        return response, []
+    rgba = pixels(response)
+    if rgba is None:
+        # Not an image that can be cut, the tile is drawn on its own
+        return None
+    _, x, y = tile_index(crs, request.GET['bbox'], width, height)
+    requested = None
+    siblings = []
+    for j in range(ny):
+        for i in range(nx):
+            tile = png_response(rgba[j * height:(j + 1) * height, i * width:(i + 1) * width])
+            if (x0 + i, y0 + j) == (x, y):
+                requested = tile
+            else:
+                tile_request = with_view(request, crs, tile_bbox(zoom, x0 + i, y0 + j), width, height)
+                siblings.append((tile_request, tile))
+    return requested, siblings
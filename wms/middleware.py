@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from django.middleware import gzip
+
+
+class GZipMiddleware(gzip.GZipMiddleware):
+    """
+    Django's GZipMiddleware for everything but images. PNG tiles are already
+    deflate compressed, gzipping them again costs CPU and saves nothing.
+    """
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith('image/'):
+            return response
+        return super().process_response(request, response)
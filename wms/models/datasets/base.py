@@ -14,9 +14,10 @@ from autoslug.settings import slugify as default_slugify
 import numpy as np
 
 from wms.utils import DotDict, calculate_time_windows
-from wms.data_handler import blank_figure
-from wms.mpl_handler import figure_response
+from wms.data_handler import png_response
 from wms import glg_handler
+from wms import tilecache
+from wms import blockcache
 
 from wms import logger  # noqa
 
@@ -93,8 +94,7 @@ class Dataset(TypedModel):
         if content_type == 'image/png':
             width = request.GET['width']
             height = request.GET['height']
-            fig = blank_figure(width, height)
-            return figure_response(fig, request)
+            return png_response(np.zeros((height, width, 4), dtype=np.uint8))
 
     def wgs84_bounds(self, layer):
         raise NotImplementedError
@@ -138,7 +138,10 @@ class Dataset(TypedModel):
     def clear_cache(self):
         cache_file_list = glob.glob(os.path.join(settings.TOPOLOGY_PATH, self.safe_filename + '*'))
         for cache_file in cache_file_list:
-            os.remove(cache_file)
+            if os.path.isfile(cache_file):
+                os.remove(cache_file)
+        tilecache.cache.clear(self.slug)
+        blockcache.cache.clear(self.slug)
 
     def active_layers(self):
         layers = self.layer_set.prefetch_related('styles').filter(active=True)
@@ -2,15 +2,22 @@
 from contextlib import contextmanager
 
 import os
+import glob
 import rtree
 import numpy as np
 import netCDF4 as nc4
 
 from django.conf import settings
+from django.core.cache import caches
 
-from pyaxiom.netcdf import EnhancedDataset, EnhancedMFDataset
+from pyaxiom.netcdf import EnhancedDataset
 
 from wms.utils import find_appropriate_time
+from wms import timeaxis
+from wms import handles
+from wms import blockcache
+from wms import aggregation
+from wms import slabs
 from wms.models import VirtualLayer, Layer, Style
 from wms import logger  # noqa
 
@@ -24,22 +31,117 @@ def try_float(obj):
 
 class NetCDFDataset(object):
 
+    # The number of dimensions of the grid, None for datasets that are not read a time step at a time
+    horizontal_ndim = None
+
     @contextmanager
-    def dataset(self):
-        try:
+    def dataset(self, direct=False):
+        """
+        The open dataset. ``direct`` reads the dataset itself, every file of an
+        aggregation and no block cache, for the tasks building the caches.
+        """
+        if getattr(self, '_dataset', None) is not None:
             # Dataset is already loaded
-            self._dataset.variables
             yield self._dataset
-        except AttributeError:
+            return
+
+        with self.open_dataset(direct) as nc:
+            self._dataset = nc
             try:
-                self._dataset = EnhancedDataset(self.path())
-                yield self._dataset
-            except (RuntimeError, FileNotFoundError):
-                try:
-                    self._dataset = EnhancedMFDataset(self.path(), aggdim='time')
-                    yield self._dataset
-                except (IndexError, RuntimeError, FileNotFoundError):
-                    yield None
+                yield nc
+            finally:
+                self._dataset = None
+
+    @contextmanager
+    def open_dataset(self, direct=False):
+        files = None if direct else self.file_index()
+        if files:
+            # An aggregation opens the files it reads from, not the whole glob
+            lazy = aggregation.LazyAggregation(files, fallback=lambda: handles.pool.checkout(self.path(), self.dataset_version()))
+            try:
+                with lazy as nc:
+                    if nc.master is not None:
+                        yield nc
+                        return
+            finally:
+                if lazy.stale:
+                    # A file changed or is gone since the time cache was built, open the whole glob until it is rebuilt
+                    aggregation.registry.discard(self.time_cache_file, getattr(self, 'cache_last_updated', None))
+
+        # An open handle from the worker's pool, reopened when the files or the time cache change
+        with handles.pool.checkout(self.path(), self.dataset_version()) as nc:
+            if nc is not None and not direct and self.online and blockcache.cache.enabled:
+                # Remote data is read through the local block cache
+                nc = blockcache.CachedDataset(nc, self.slug, self.path())
+            yield nc
+
+    def file_index(self):
+        """ The files of an aggregation and their number of times, from the time cache """
+        if not glob.has_magic(self.path()):
+            return None
+
+        def load():
+            time_cache = caches['time'].get(self.time_cache_file)
+            return (time_cache or {}).get('files')
+
+        return aggregation.registry.get(self.time_cache_file,
+                                        getattr(self, 'cache_last_updated', None),
+                                        load)
+
+    def dataset_version(self):
+        return (getattr(self, 'cache_last_updated', None), handles.pool.path_version(self.path()))
+
+    def slab_key(self, variable, prefix):
+        return (self.path(), variable.name, tuple(int(i) for i in prefix), getattr(self, 'cache_last_updated', None))
+
+    def read_slab(self, variable, prefix, index=Ellipsis, partial=None):
+        """
+        ``variable[prefix + index]`` through the slab cache, ``prefix``
+        being the time (and depth) index of the slab. ``partial`` reads only the
+        values asked for, for slabs too large to cache.
+        """
+        return slabs.read(self.slab_key(variable, prefix), variable, prefix, index, partial,
+                          slabs=slabs.dataset_slabs(self.slug))
+
+    def layer_variables(self, layer):
+        """ The names of the variables a layer is drawn from """
+        if isinstance(layer, VirtualLayer):
+            return [ l.var_name for l in layer.layers ]
+        return [ layer.access_name ]
+
+    def prefetch(self, layer, names, time_index, elevation):
+        """
+        Read the slabs of the variables ``names`` of a layer at a time index
+        into the slab cache, ahead of the requests for them
+        """
+        if self.horizontal_ndim is None:
+            return
+        with self.dataset() as nc:
+            for name in names:
+                variable = nc.variables[name]
+                leading = len(variable.shape) - self.horizontal_ndim
+                if leading == 2:
+                    z_index, _ = self.nearest_z(layer, elevation)
+                    prefix = (time_index, z_index)
+                elif leading == 1:
+                    prefix = (time_index,)
+                else:
+                    continue
+                if time_index < variable.shape[0]:
+                    slabs.preload(self.slab_key(variable, prefix), variable, prefix,
+                                  slabs=slabs.dataset_slabs(self.slug))
+
+    def read_series(self, variable, start, end, inner, index):
+        """
+        ``variable[start:end, inner + index]``, the values at a point from
+        ``start`` to ``end``. A single time is taken from its slab when cached.
+        """
+        index = index if isinstance(index, tuple) else (index,)
+        if end - start == 1:
+            slab = slabs.get(self.slab_key(variable, (start,) + tuple(inner)), slabs=slabs.dataset_slabs(self.slug))
+            if slab is not None:
+                return np.ma.asarray(slab[index])[np.newaxis].copy()
+        return variable[(slice(start, end),) + tuple(inner) + index]
 
     @contextmanager
     def topology(self):
@@ -54,11 +156,7 @@ class NetCDFDataset(object):
                 yield None
 
     def close(self):
-        try:
-            self._dataset.close()
-        except BaseException:
-            pass
-
+        # Dataset handles belong to the pool
         try:
             self._topology.close()
         except BaseException:
@@ -68,6 +166,10 @@ class NetCDFDataset(object):
     def topology_file(self):
         return os.path.join(settings.TOPOLOGY_PATH, '{}.nc'.format(self.safe_filename))
 
+    @property
+    def topology_arrays_root(self):
+        return os.path.join(settings.TOPOLOGY_PATH, '{}.topology'.format(self.safe_filename))
+
     @property
     def time_cache_file(self):
         return os.path.join(settings.TOPOLOGY_PATH, '{}.npy'.format(self.safe_filename))
@@ -103,12 +205,42 @@ class NetCDFDataset(object):
     def setup_getfeatureinfo(self, layer, request, location=None):
 
         location = location or 'face'
-        tree = None
+        latitude = request.GET['latitude']
+        longitude = request.GET['longitude']
+
+        locator = self.point_locator(layer, location)
+        if locator is not None:
+            nearest = locator.nearest(longitude, latitude)
+            if nearest is None:
+                raise ValueError("No cells in the {} index for point {}, {}".format(location, longitude, latitude))
+            tree_id, closest_x, closest_y = nearest
+        else:
+            tree_id, closest_x, closest_y = self.rtree_nearest(location, longitude, latitude)
+        geo_index = self.tree_index(tree_id, location)
+
+        all_times = self.times(layer)
+
+        start_nc_index = np.searchsorted(all_times, request.GET['starting'], side='left')
+        start_nc_index = min(start_nc_index, len(all_times) - 1)
 
+        end_nc_index = np.searchsorted(all_times, request.GET['ending'], side='right')
+        end_nc_index = max(end_nc_index, 1)  # Always pull the first index
+
+        return_dates = all_times[start_nc_index:end_nc_index]
+
+        return geo_index, closest_x, closest_y, start_nc_index, end_nc_index, return_dates
+
+    def point_locator(self, layer, location):
+        """
+        An in-memory nearest neighbour index (wms.topology.PointLocator) for the
+        location, or None to search the RTree on disk.
+        """
+        return None
+
+    def rtree_nearest(self, location, longitude, latitude):
+        tree = None
         try:
-            latitude = request.GET['latitude']
-            longitude = request.GET['longitude']
-            # Find closest cell or node (only node for now)
+            # Find closest cell or node
             if location == 'face':
                 tree = rtree.index.Index(self.face_tree_root)
             elif location == 'node':
@@ -121,24 +253,16 @@ class NetCDFDataset(object):
             except IndexError:
                 raise ValueError("No cells in the {} tree for point {}, {}".format(location, longitude, latitude))
             closest_x, closest_y = tuple(nindex.bbox[2:])
-            geo_index = nindex.object
-        except BaseException:
-            raise
+            return nindex.id, closest_x, closest_y
         finally:
             if tree is not None:
                 tree.close()
 
-        all_times = self.times(layer)
-
-        start_nc_index = np.searchsorted(all_times, request.GET['starting'], side='left')
-        start_nc_index = min(start_nc_index, len(all_times) - 1)
-
-        end_nc_index = np.searchsorted(all_times, request.GET['ending'], side='right')
-        end_nc_index = max(end_nc_index, 1)  # Always pull the first index
-
-        return_dates = all_times[start_nc_index:end_nc_index]
-
-        return geo_index, closest_x, closest_y, start_nc_index, end_nc_index, return_dates
+    def tree_index(self, tree_id, location=None):
+        """
+        Convert the id of an RTree entry into an index into the data variables
+        """
+        return tree_id
 
     def __del__(self):
         self.close()
@@ -241,10 +365,43 @@ class NetCDFDataset(object):
 
         self.analyze_virtual_layers()
 
+    def time_axis(self, layer):
+        """
+        The numeric time axis of a layer from the time cache, kept in memory
+        until the time cache is rebuilt. None if the time cache has no axis
+        for the layer.
+        """
+        return timeaxis.registry.get(self.time_cache_file,
+                                     layer.access_name,
+                                     getattr(self, 'cache_last_updated', None),
+                                     lambda: self.load_time_axis(layer))
+
+    def load_time_axis(self, layer):
+        time_cache = caches['time'].get(self.time_cache_file)
+        if not time_cache or 'axes' not in time_cache:
+            # Missing or built before the numeric axes were cached
+            return None
+
+        axes = time_cache['axes']
+        if not axes:
+            return timeaxis.TimeAxis(None)
+
+        name = time_cache['layers'].get(layer.access_name)
+        if name is None and len(axes) == 1:
+            # The only time variable is used, like nearest_time does
+            name = list(axes.keys())[0]
+        if name not in axes:
+            return None
+        return timeaxis.TimeAxis(**axes[name])
+
     def nearest_time(self, layer, time):
         """
         Return the time index and time value that is closest
         """
+        axis = self.time_axis(layer)
+        if axis is not None:
+            return axis.nearest(time)
+
         with self.dataset() as nc:
             time_vars = nc.get_variables_by_attributes(standard_name='time')
 
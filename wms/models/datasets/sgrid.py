@@ -4,7 +4,6 @@ import time
 import shutil
 import bisect
 import tempfile
-from math import sqrt
 
 import numpy as np
 import netCDF4 as nc4
@@ -15,14 +14,20 @@ from pysgrid.processing_2d import avg_to_cell_center, rotate_vectors
 
 import pandas as pd
 
-from rtree import index
-
 from django.core.cache import caches
 
-from wms import mpl_handler
 from wms import gfi_handler
 from wms import data_handler
 from wms import gmd_handler
+from wms import raster
+from wms import contours
+from wms import vectors
+from wms import topology
+from wms import timeaxis
+from wms import handles
+from wms import blockcache
+from wms import aggregation
+from wms import slabs
 
 from wms.models import Dataset, Layer, VirtualLayer, NetCDFDataset
 from wms.utils import DotDict, calc_lon_lat_padding, calc_safety_factor, find_appropriate_time
@@ -32,6 +37,9 @@ from wms import logger
 
 class SGridDataset(Dataset, NetCDFDataset):
 
+    # Rows and columns
+    horizontal_ndim = 2
+
     @classmethod
     def is_valid(cls, uri):
         try:
@@ -72,42 +80,36 @@ class SGridDataset(Dataset, NetCDFDataset):
 
     def clear_cache(self):
         super().clear_cache()
+        topology.registry.invalidate(self.topology_file)
+        timeaxis.registry.invalidate(self.time_cache_file)
+        aggregation.registry.invalidate(self.time_cache_file)
+        slabs.cache.delete_matching(lambda k: k[0] == self.path())
+        slabs.store.clear(self.slug)
+        handles.pool.invalidate(self.path())
         return caches['time'].delete(self.time_cache_file)
 
+    def cached_sgrid(self):
+        """
+        The grid from the topology cache, shared by all requests in this process
+        """
+        return topology.registry.sgrid(self.topology_file, arrays_root=self.topology_arrays_root)
+
     def make_rtree(self):
 
-        with self.dataset() as nc:
+        with self.dataset(direct=True) as nc:
             sg = load_grid(nc)
 
-            def rtree_generator_function():
-                c = 0
-                centers = np.dstack((sg.center_lon, sg.center_lat))
-                for i, axis in enumerate(centers):
-                    for j, (x, y) in enumerate(axis):
-                        c += 1
-                        yield (c, (x, y, x, y), (i, j))
-
             logger.info("Building Faces (centers) Rtree Topology Cache for {0}".format(self.name))
-            _, temp_file = tempfile.mkstemp(suffix='.face')
             start = time.time()
-            p = index.Property()
-            p.filename = str(temp_file)
-            p.overwrite = True
-            p.storage   = index.RT_Disk
-            p.dimension = 2
-            idx = index.Index(p.filename,
-                              rtree_generator_function(),
-                              properties=p,
-                              overwrite=True,
-                              interleaved=True)
-            idx.close()
-
+            bounds = topology.point_bounds(np.ma.filled(sg.center_lon, np.nan), np.ma.filled(sg.center_lat, np.nan))
+            # ids are the 1-based, flattened (C order) cell index
+            topology.write_rtree(self.face_tree_root, bounds, ids=np.arange(1, bounds.shape[0] + 1))
             logger.info("Built Faces (centers) Rtree Topology Cache in {0} seconds.".format(time.time() - start))
-            shutil.move('{}.dat'.format(temp_file), self.face_tree_data_file)
-            shutil.move('{}.idx'.format(temp_file), self.face_tree_index_file)
 
     def update_time_cache(self):
-        with self.dataset() as nc:
+        # Read the time variables from a fresh handle, the dataset may have grown
+        handles.pool.invalidate(self.path())
+        with self.dataset(direct=True) as nc:
             if nc is None:
                 logger.error("Failed update_time_cache, could not load dataset "
                              "as a netCDF4 object")
@@ -129,13 +131,21 @@ class SGridDataset(Dataset, NetCDFDataset):
                 except ValueError:
                     layer_cache[ly.access_name] = None
 
-            full_cache = {'times': time_cache, 'layers': layer_cache}
+            full_cache = {'times': time_cache, 'layers': layer_cache, 'axes': timeaxis.time_axes(time_vars),
+                          'files': aggregation.file_index(nc)}
             logger.info("Built time cache for {0}".format(self.name))
+            previous = caches['time'].get(self.time_cache_file)
+            if previous is None or not timeaxis.same_axes(previous.get('axes'), full_cache['axes']):
+                # New times, the data at a time index may not be what it was
+                blockcache.cache.clear(self.slug)
+                slabs.store.clear(self.slug)
             caches['time'].set(self.time_cache_file, full_cache, None)
+            timeaxis.registry.invalidate(self.time_cache_file)
+            aggregation.registry.invalidate(self.time_cache_file)
             return full_cache
 
     def update_grid_cache(self, force=False):
-        with self.dataset() as nc:
+        with self.dataset(direct=True) as nc:
             if nc is None:
                 logger.error("Failed update_grid_cache, could not load dataset "
                              "as a netCDF4 object")
@@ -154,6 +164,9 @@ class SGridDataset(Dataset, NetCDFDataset):
                     logger.error("Failed to create topology_file cache for Dataset '{}'".format(self.dataset.name))
                     return
 
+            # Flat arrays that the web workers memory map (and share)
+            topology.save_sgrid_arrays(self.topology_arrays_root, sg)
+
         # Now do the RTree index
         self.make_rtree()
 
@@ -162,40 +175,27 @@ class SGridDataset(Dataset, NetCDFDataset):
         wgs84_bbox = request.GET['wgs84_bbox']
 
         with self.dataset() as nc:
-            cached_sg = load_grid(self.topology_file)
+            cached_sg = self.cached_sgrid()
             lon_name, lat_name = cached_sg.face_coordinates
             lon_obj = getattr(cached_sg, lon_name)
-            lat_obj = getattr(cached_sg, lat_name)
-            lon = cached_sg.center_lon[lon_obj.center_slicing]
-            lat = cached_sg.center_lat[lat_obj.center_slicing]
-            spatial_idx = data_handler.lat_lon_subset_idx(lon, lat,
-                                                          lonmin=wgs84_bbox.minx,
-                                                          latmin=wgs84_bbox.miny,
-                                                          lonmax=wgs84_bbox.maxx,
-                                                          latmax=wgs84_bbox.maxy)
-            subset_lon = np.unique(spatial_idx[0])
-            subset_lat = np.unique(spatial_idx[1])
+            # A single read of the window of the cells in the bbox
+            window = self.bbox_window(cached_sg, lon_obj.center_slicing, wgs84_bbox)
             grid_variables = cached_sg.grid_variables
 
             vmin = None
             vmax = None
-            raw_data = None
+            if window is None:
+                return gmd_handler.from_dict(dict(min=vmin, max=vmax))
+
             if isinstance(layer, Layer):
                 data_obj = getattr(cached_sg, layer.access_name)
                 raw_var = nc.variables[layer.access_name]
+                z_index = None
                 if len(raw_var.shape) == 4:
                     z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                    raw_data = raw_var[time_index, z_index, subset_lon, subset_lat]
-                elif len(raw_var.shape) == 3:
-                    raw_data = raw_var[time_index, subset_lon, subset_lat]
-                elif len(raw_var.shape) == 2:
-                    raw_data = raw_var[subset_lon, subset_lat]
-                else:
-                    raise BaseException('Unable to trim variable {0} data.'.format(layer.access_name))
-
                 # handle grid variables
-                if set([layer.access_name]).issubset(grid_variables):
-                    raw_data = avg_to_cell_center(raw_data, data_obj.center_axis)
+                raw_data = self.read_window(raw_var, data_obj, window, time_index, z_index,
+                                            average=set([layer.access_name]).issubset(grid_variables))
 
                 vmin = np.nanmin(raw_data).item()
                 vmax = np.nanmax(raw_data).item()
@@ -203,20 +203,14 @@ class SGridDataset(Dataset, NetCDFDataset):
             elif isinstance(layer, VirtualLayer):
                 x_var = None
                 y_var = None
-                raw_vars = []
                 for l in layer.layers:
                     data_obj = getattr(cached_sg, l.access_name)
                     raw_var = nc.variables[l.access_name]
-                    raw_vars.append(raw_var)
+                    z_index = None
                     if len(raw_var.shape) == 4:
                         z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                        raw_data = raw_var[time_index, z_index, subset_lon, subset_lat]
-                    elif len(raw_var.shape) == 3:
-                        raw_data = raw_var[time_index, subset_lon, subset_lat]
-                    elif len(raw_var.shape) == 2:
-                        raw_data = raw_var[subset_lon, subset_lat]
-                    else:
-                        raise BaseException('Unable to trim variable {0} data.'.format(l.access_name))
+                    # Vector components are averaged to the cell centers, like getmap draws them
+                    raw_data = self.read_window(raw_var, data_obj, window, time_index, z_index, average=True)
 
                     if x_var is None:
                         if data_obj.vector_axis and data_obj.vector_axis.lower() == 'x':
@@ -230,14 +224,11 @@ class SGridDataset(Dataset, NetCDFDataset):
                         elif data_obj.center_axis == 0:
                             y_var = raw_data
 
-                if ',' in layer.var_name and raw_data is not None:
+                if ',' in layer.var_name and x_var is not None and y_var is not None:
                     # Vectors, so return magnitude
-                    data = [
-                        sqrt((u * u) + (v * v)) for (u, v,) in
-                        zip(x_var.flatten(), y_var.flatten()) if u != np.nan and v != np.nan
-                    ]
-                    vmin = min(data)
-                    vmax = max(data)
+                    data = np.ma.filled(np.ma.sqrt((x_var * x_var) + (y_var * y_var)).astype(np.float64), np.nan)
+                    vmin = np.nanmin(data).item()
+                    vmax = np.nanmax(data).item()
 
             return gmd_handler.from_dict(dict(min=vmin, max=vmax))
 
@@ -246,37 +237,70 @@ class SGridDataset(Dataset, NetCDFDataset):
         wgs84_bbox = request.GET['wgs84_bbox']
 
         with self.dataset() as nc:
-            cached_sg = load_grid(self.topology_file)
+            cached_sg = self.cached_sgrid()
             lon_name, lat_name = cached_sg.face_coordinates
             lon_obj = getattr(cached_sg, lon_name)
             lat_obj = getattr(cached_sg, lat_name)
             lon = cached_sg.center_lon[lon_obj.center_slicing]
             lat = cached_sg.center_lat[lat_obj.center_slicing]
+            x, y = cached_sg.projected('face', request.GET['crs'])
+            x = x[lon_obj.center_slicing]
+            y = y[lat_obj.center_slicing]
 
             if isinstance(layer, Layer):
                 data_obj = getattr(cached_sg, layer.access_name)
                 raw_var = nc.variables[layer.access_name]
+                z_index = None
                 if len(raw_var.shape) == 4:
                     z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                    raw_data = raw_var[time_index, z_index, data_obj.center_slicing[-2], data_obj.center_slicing[-1]]
-                elif len(raw_var.shape) == 3:
-                    raw_data = raw_var[time_index, data_obj.center_slicing[-2], data_obj.center_slicing[-1]]
-                elif len(raw_var.shape) == 2:
-                    raw_data = raw_var[data_obj.center_slicing]
-                else:
-                    raise BaseException('Unable to trim variable {0} data.'.format(layer.access_name))
-                # handle edge variables
-                if data_obj.location is not None and 'edge' in data_obj.location:
-                    raw_data = avg_to_cell_center(raw_data, data_obj.center_axis)
+
+                def read():
+                    center = (data_obj.center_slicing[-2], data_obj.center_slicing[-1])
+                    if len(raw_var.shape) == 4:
+                        raw_data = self.read_slab(raw_var, (time_index, z_index), center)
+                    elif len(raw_var.shape) == 3:
+                        raw_data = self.read_slab(raw_var, (time_index,), center)
+                    elif len(raw_var.shape) == 2:
+                        raw_data = self.read_slab(raw_var, (), center)
+                    else:
+                        raise BaseException('Unable to trim variable {0} data.'.format(layer.access_name))
+                    # handle edge variables
+                    if data_obj.location is not None and 'edge' in data_obj.location:
+                        raw_data = avg_to_cell_center(raw_data, data_obj.center_axis)
+                    return raw_data
 
                 if request.GET['image_type'] == 'pcolor':
-                    return mpl_handler.pcolormesh_response(lon, lat, data=raw_data, request=request)
+                    lookup = self.pixel_lookup(cached_sg, lon_obj.center_slicing, request)
+                    colorscalerange = request.GET['colorscalerange']
+                    if colorscalerange.min is None or colorscalerange.max is None:
+                        # The colors are scaled to the whole field
+                        return raster.pcolor_response(lookup, read(), request)
+                    # Only the window of the cells under the tile, in a single read
+                    window = lookup.window(lon.shape)
+                    if window is None:
+                        return raster.pcolor_response(lookup, np.array([]), request, cells=True)
+                    raw_data = self.read_window(raw_var, data_obj, window, time_index, z_index,
+                                                average=data_obj.location is not None and 'edge' in data_obj.location)
+                    rows, columns = np.unravel_index(lookup.cells, lon.shape)
+                    return raster.pcolor_response(lookup,
+                                                  raw_data[rows - window[0].start, columns - window[1].start],
+                                                  request,
+                                                  cells=True)
                 elif request.GET['image_type'] in ['filledhatches', 'hatches', 'filledcontours', 'contours']:
-                    return mpl_handler.contouring_response(lon, lat, data=raw_data, request=request)
+                    # The contours of the whole grid, traced once and drawn by every tile
+                    key = (layer.access_name, time_index, z_index, self.cache_last_updated) + contours.request_key(request)
+                    cs = contours.cached(cached_sg, key, lambda: contours.contour_set(x, y, read(), request))
+                    return contours.contour_response(cs, request)
                 else:
                     raise NotImplementedError('Image type "{}" is not supported.'.format(request.GET['image_type']))
 
             elif isinstance(layer, VirtualLayer):
+                # The window of the cells near the tile, padded by how far a vector can reach into it
+                padding_factor = calc_safety_factor(request.GET['vectorscale'])
+                # figure out the average distance between lat/lon points
+                padding = calc_lon_lat_padding(lon, lat, padding_factor)
+                window = self.bbox_window(cached_sg, lon_obj.center_slicing, wgs84_bbox, padding=padding)
+
                 x_var = None
                 y_var = None
                 raw_vars = []
@@ -284,17 +308,12 @@ class SGridDataset(Dataset, NetCDFDataset):
                     data_obj = getattr(cached_sg, l.access_name)
                     raw_var = nc.variables[l.access_name]
                     raw_vars.append(raw_var)
+                    z_index = None
                     if len(raw_var.shape) == 4:
                         z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                        raw_data = raw_var[time_index, z_index, data_obj.center_slicing[-2], data_obj.center_slicing[-1]]
-                    elif len(raw_var.shape) == 3:
-                        raw_data = raw_var[time_index, data_obj.center_slicing[-2], data_obj.center_slicing[-1]]
-                    elif len(raw_var.shape) == 2:
-                        raw_data = raw_var[data_obj.center_slicing]
-                    else:
-                        raise BaseException('Unable to trim variable {0} data.'.format(l.access_name))
-
-                    raw_data = avg_to_cell_center(raw_data, data_obj.center_axis)
+                    if window is None:
+                        continue
+                    raw_data = self.read_window(raw_var, data_obj, window, time_index, z_index, average=True)
                     if x_var is None:
                         if data_obj.vector_axis and data_obj.vector_axis.lower() == 'x':
                             x_var = raw_data
@@ -307,7 +326,7 @@ class SGridDataset(Dataset, NetCDFDataset):
                         elif data_obj.center_axis == 0:
                             y_var = raw_data
 
-                if x_var is None or y_var is None:
+                if window is not None and (x_var is None or y_var is None):
                     raise BaseException('Unable to determine x and y variables.')
 
                 dim_lengths = [ len(v.dimensions) for v in raw_vars ]
@@ -315,43 +334,36 @@ class SGridDataset(Dataset, NetCDFDataset):
                     raise AttributeError('One or both of the specified variables has incorrect dimensions.')
 
                 if request.GET['image_type'] == 'vectors':
-                    angles = cached_sg.angles[lon_obj.center_slicing]
-                    vectorstep = request.GET['vectorstep']
-                    # don't do this if the vectorstep is 1; let's save a microsecond or two
-                    # it's identical to getting all the data
-                    if vectorstep > 1:
-                        data_dim = len(lon.shape)
-                        step_slice = (np.s_[::vectorstep],) * data_dim  # make sure the vector step is used for all applicable dimensions
-                        lon = lon[step_slice]
-                        lat = lat[step_slice]
-                        x_var = x_var[step_slice]
-                        y_var = y_var[step_slice]
-                        angles = angles[step_slice]
-                    vectorscale = request.GET['vectorscale']
-                    padding_factor = calc_safety_factor(vectorscale)
-                    # figure out the average distance between lat/lon points
-                    # do the math after taking into the vectorstep if specified
-                    spatial_idx_padding = calc_lon_lat_padding(lon, lat, padding_factor)
-                    spatial_idx = data_handler.lat_lon_subset_idx(lon, lat,
+                    if window is None:
+                        return vectors.arrows_response([], [], [], [], request)
+                    spatial_idx = data_handler.lat_lon_subset_idx(lon[window], lat[window],
                                                                   lonmin=wgs84_bbox.minx,
                                                                   latmin=wgs84_bbox.miny,
                                                                   lonmax=wgs84_bbox.maxx,
                                                                   latmax=wgs84_bbox.maxy,
-                                                                  padding=spatial_idx_padding
+                                                                  padding=padding
                                                                   )
-                    subset_lon = self._spatial_data_subset(lon, spatial_idx)
-                    subset_lat = self._spatial_data_subset(lat, spatial_idx)
+                    spatial_idx = spatial_idx.reshape(2, -1)
+                    subset_x = self._spatial_data_subset(x[window], spatial_idx)
+                    subset_y = self._spatial_data_subset(y[window], spatial_idx)
+                    # Only the vectors that are drawn, at most one per few pixels. The ids
+                    # are the indexes in the whole grid so every tile thins them alike.
+                    ids = np.ravel_multi_index((spatial_idx[0] + window[0].start, spatial_idx[1] + window[1].start),
+                                               lon.shape)
+                    keep = vectors.thin(subset_x, subset_y, ids,
+                                        request.GET['bbox'], request.GET['width'], request.GET['height'],
+                                        vectors.spacing(request))
+                    spatial_idx = spatial_idx[:, keep]
                     # rotate vectors
-                    x_rot, y_rot = rotate_vectors(x_var, y_var, angles)
-                    spatial_subset_x_rot = self._spatial_data_subset(x_rot, spatial_idx)
-                    spatial_subset_y_rot = self._spatial_data_subset(y_rot, spatial_idx)
-                    return mpl_handler.quiver_response(subset_lon,
-                                                       subset_lat,
-                                                       spatial_subset_x_rot,
-                                                       spatial_subset_y_rot,
-                                                       request,
-                                                       vectorscale
-                                                       )
+                    angles = cached_sg.angles[lon_obj.center_slicing][window]
+                    x_rot, y_rot = rotate_vectors(self._spatial_data_subset(x_var, spatial_idx),
+                                                  self._spatial_data_subset(y_var, spatial_idx),
+                                                  self._spatial_data_subset(angles, spatial_idx))
+                    return vectors.arrows_response(subset_x[keep],
+                                                   subset_y[keep],
+                                                   x_rot,
+                                                   y_rot,
+                                                   request)
                 else:
                     raise NotImplementedError('Image type "{}" is not supported.'.format(request.GET['image_type']))
 
@@ -366,9 +378,9 @@ class SGridDataset(Dataset, NetCDFDataset):
             if isinstance(layer, Layer):
                 if len(data_obj.shape) == 4:
                     z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                    data = data_obj[start_time_index:end_time_index, z_index, geo_index[0], geo_index[1]]
+                    data = self.read_series(data_obj, start_time_index, end_time_index, (z_index,), (geo_index[0], geo_index[1]))
                 elif len(data_obj.shape) == 3:
-                    data = data_obj[start_time_index:end_time_index, geo_index[0], geo_index[1]]
+                    data = self.read_series(data_obj, start_time_index, end_time_index, (), (geo_index[0], geo_index[1]))
                 elif len(data_obj.shape) == 2:
                     data = data_obj[geo_index[0], geo_index[1]]
                 else:
@@ -382,9 +394,9 @@ class SGridDataset(Dataset, NetCDFDataset):
                 for l in layer.layers:
                     if len(data_obj.shape) == 4:
                         z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                        data = data_obj[start_time_index:end_time_index, z_index, geo_index[0], geo_index[1]]
+                        data = self.read_series(data_obj, start_time_index, end_time_index, (z_index,), (geo_index[0], geo_index[1]))
                     elif len(data_obj.shape) == 3:
-                        data = data_obj[start_time_index:end_time_index, geo_index[0], geo_index[1]]
+                        data = self.read_series(data_obj, start_time_index, end_time_index, (), (geo_index[0], geo_index[1]))
                     elif len(data_obj.shape) == 2:
                         data = data_obj[geo_index[0], geo_index[1]]
                     else:
@@ -414,9 +426,17 @@ class SGridDataset(Dataset, NetCDFDataset):
 
             return gfi_handler.from_dataframe(request, df)
 
+    def point_locator(self, layer, location):
+        return self.cached_sgrid().locator(location)
+
+    def tree_index(self, tree_id, location=None):
+        # Cell ids are 1-based and flattened, return the (i, j) of the cell
+        shape = self.cached_sgrid().center_lon.shape
+        return tuple(int(x) for x in np.unravel_index(tree_id - 1, shape))
+
     def wgs84_bounds(self, layer):
         try:
-            cached_sg = load_grid(self.topology_file)
+            cached_sg = self.cached_sgrid()
         except BaseException:
             pass
         else:
@@ -482,6 +502,60 @@ class SGridDataset(Dataset, NetCDFDataset):
             except AttributeError:
                 pass
 
+    def pixel_lookup(self, cached_sg, slicing, request):
+        """
+        The grid cell under each pixel of the requested view, reused by every
+        request for the same view (e.g. the frames of a time animation)
+        """
+        crs = request.GET['crs']
+
+        def build():
+            locator = cached_sg.quad_locator(crs, slicing)
+            return raster.quad_lookup(locator, request.GET['bbox'], request.GET['width'], request.GET['height'])
+
+        key = ('quads', topology.slicing_key(slicing)) + raster.view_key(request)
+        return raster.cached_lookup(cached_sg, key, build)
+
+    def bbox_window(self, cached_sg, slicing, wgs84_bbox, padding=0):
+        """
+        The window of the cell centers in a (padded) lon/lat bbox, chosen like
+        data_handler.lat_lon_subset_idx does
+        """
+        lonmin = wgs84_bbox.minx
+        if lonmin > wgs84_bbox.maxx:
+            lonmin = lonmin * -1.0
+        return cached_sg.window((lonmin - padding, wgs84_bbox.miny - padding,
+                                 wgs84_bbox.maxx + padding, wgs84_bbox.maxy + padding), slicing)
+
+    def read_window(self, raw_var, data_obj, window, time_index=None, z_index=None, average=False):
+        """
+        The values of a variable in a ``window`` (row and column slices of the
+        cell centers), from the cached slab or in a single rectangular read. With ``average`` they are
+        averaged to the cell centers along the center_axis of the variable,
+        which takes one more value along that axis.
+        """
+        if len(raw_var.shape) == 4:
+            prefix = (time_index, z_index)
+        elif len(raw_var.shape) == 3:
+            prefix = (time_index,)
+        elif len(raw_var.shape) == 2:
+            prefix = ()
+        else:
+            raise BaseException('Unable to trim variable {0} data.'.format(raw_var.name))
+
+        slicing = []
+        for axis, cells in enumerate(window):
+            # The window is relative to the center slicing of the variable
+            start = data_obj.center_slicing[axis - 2].indices(raw_var.shape[axis - 2])[0]
+            extra = 1 if average and axis == data_obj.center_axis else 0
+            slicing.append(slice(int(start + cells.start), int(start + cells.stop + extra)))
+
+        raw_data = self.read_slab(raw_var, prefix, tuple(slicing),
+                                  partial=lambda: raw_var[prefix + tuple(slicing)])
+        if average:
+            raw_data = avg_to_cell_center(raw_data, data_obj.center_axis)
+        return raw_data
+
     def _spatial_data_subset(self, data, spatial_index):
         rows = spatial_index[0, :]
         columns = spatial_index[1, :]
@@ -15,14 +15,21 @@ import pandas as pd
 
 import matplotlib.tri as Tri
 
-from rtree import index
-
 from django.core.cache import caches
 
 from wms import data_handler
 from wms import mpl_handler
 from wms import gfi_handler
 from wms import gmd_handler
+from wms import raster
+from wms import contours
+from wms import vectors
+from wms import topology
+from wms import timeaxis
+from wms import handles
+from wms import blockcache
+from wms import aggregation
+from wms import slabs
 
 from wms.models import Dataset, Layer, VirtualLayer, NetCDFDataset
 from wms.utils import DotDict, calc_lon_lat_padding, calc_safety_factor, find_appropriate_time
@@ -32,6 +39,9 @@ from wms import logger
 
 class UGridDataset(Dataset, NetCDFDataset):
 
+    # Nodes or faces
+    horizontal_ndim = 1
+
     @classmethod
     def is_valid(cls, uri):
         try:
@@ -54,61 +64,44 @@ class UGridDataset(Dataset, NetCDFDataset):
 
     def clear_cache(self):
         super().clear_cache()
+        topology.registry.invalidate(self.topology_file)
+        timeaxis.registry.invalidate(self.time_cache_file)
+        aggregation.registry.invalidate(self.time_cache_file)
+        slabs.cache.delete_matching(lambda k: k[0] == self.path())
+        slabs.store.clear(self.slug)
+        handles.pool.invalidate(self.path())
         return caches['time'].delete(self.time_cache_file)
 
-    def make_rtree(self):
+    def cached_ugrid(self, mesh_name=None):
+        """
+        The parsed topology cache for a mesh, shared by all requests in this process
+        """
+        return topology.registry.ugrid(self.topology_file, mesh_name=mesh_name, arrays_root=self.topology_arrays_root)
 
+    def point_locator(self, layer, location):
         with self.dataset() as nc:
-            ug = UGrid.from_nc_dataset(nc=nc)
+            mesh_name = nc.variables[layer.access_name].mesh
+        return self.cached_ugrid(mesh_name).locator(location)
 
-            def rtree_faces_generator_function():
-                for face_idx, node_list in enumerate(ug.faces):
-                    nodes = ug.nodes[node_list]
-                    xmin, ymin = np.min(nodes, 0)
-                    xmax, ymax = np.max(nodes, 0)
-                    yield (face_idx, (xmin, ymin, xmax, ymax), face_idx)
+    def make_rtree(self):
+
+        with self.dataset(direct=True) as nc:
+            ug = UGrid.from_nc_dataset(nc=nc)
 
             logger.info("Building Faces Rtree Topology Cache for {0}".format(self.name))
             start = time.time()
-            _, face_temp_file = tempfile.mkstemp(suffix='.face')
-            pf = index.Property()
-            pf.filename = str(face_temp_file)
-            pf.overwrite = True
-            pf.storage   = index.RT_Disk
-            pf.dimension = 2
-            idx = index.Index(pf.filename,
-                              rtree_faces_generator_function(),
-                              properties=pf,
-                              interleaved=True,
-                              overwrite=True)
-            idx.close()
+            topology.write_rtree(self.face_tree_root, topology.face_bounds(ug.nodes, ug.faces))
             logger.info("Built Faces Rtree Topology Cache in {0} seconds.".format(time.time() - start))
-            shutil.move('{}.dat'.format(face_temp_file), self.face_tree_data_file)
-            shutil.move('{}.idx'.format(face_temp_file), self.face_tree_index_file)
 
-            def rtree_nodes_generator_function():
-                for node_index, (x, y) in enumerate(ug.nodes):
-                    yield (node_index, (x, y, x, y), node_index)
             logger.info("Building Nodes Rtree Topology Cache for {0}".format(self.name))
             start = time.time()
-            _, node_temp_file = tempfile.mkstemp(suffix='.node')
-            pn = index.Property()
-            pn.filename = str(node_temp_file)
-            pn.overwrite = True
-            pn.storage   = index.RT_Disk
-            pn.dimension = 2
-            idx = index.Index(pn.filename,
-                              rtree_nodes_generator_function(),
-                              properties=pn,
-                              interleaved=True,
-                              overwrite=True)
-            idx.close()
+            topology.write_rtree(self.node_tree_root, topology.point_bounds(ug.nodes[:, 0], ug.nodes[:, 1]))
             logger.info("Built Nodes Rtree Topology Cache in {0} seconds.".format(time.time() - start))
-            shutil.move('{}.dat'.format(node_temp_file), self.node_tree_data_file)
-            shutil.move('{}.idx'.format(node_temp_file), self.node_tree_index_file)
 
     def update_time_cache(self):
-        with self.dataset() as nc:
+        # Read the time variables from a fresh handle, the dataset may have grown
+        handles.pool.invalidate(self.path())
+        with self.dataset(direct=True) as nc:
             if nc is None:
                 logger.error("Failed update_time_cache, could not load dataset "
                              "as a netCDF4 object")
@@ -130,13 +123,21 @@ class UGridDataset(Dataset, NetCDFDataset):
                 except ValueError:
                     layer_cache[ly.access_name] = None
 
-            full_cache = {'times': time_cache, 'layers': layer_cache}
+            full_cache = {'times': time_cache, 'layers': layer_cache, 'axes': timeaxis.time_axes(time_vars),
+                          'files': aggregation.file_index(nc)}
             logger.info("Built time cache for {0}".format(self.name))
+            previous = caches['time'].get(self.time_cache_file)
+            if previous is None or not timeaxis.same_axes(previous.get('axes'), full_cache['axes']):
+                # New times, the data at a time index may not be what it was
+                blockcache.cache.clear(self.slug)
+                slabs.store.clear(self.slug)
             caches['time'].set(self.time_cache_file, full_cache, None)
+            timeaxis.registry.invalidate(self.time_cache_file)
+            aggregation.registry.invalidate(self.time_cache_file)
             return full_cache
 
     def update_grid_cache(self, force=False):
-        with self.dataset() as nc:
+        with self.dataset(direct=True) as nc:
             if nc is None:
                 logger.error("Failed update_grid_cache, could not load dataset "
                              "as a netCDF4 object")
@@ -156,6 +157,9 @@ class UGridDataset(Dataset, NetCDFDataset):
                     logger.error("Failed to create topology_file cache for Dataset '{}'".format(self.dataset.name))
                     return
 
+            # Flat arrays that the web workers memory map (and share)
+            topology.UGridTopology.from_ugrid(ug).save_arrays(self.topology_arrays_root)
+
         # Now do the RTree index
         self.make_rtree()
 
@@ -168,18 +172,14 @@ class UGridDataset(Dataset, NetCDFDataset):
             data_location = data_obj.location
             mesh_name = data_obj.mesh
 
-            ug = UGrid.from_ncfile(self.topology_file, mesh_name=mesh_name)
-            coords = np.empty(0)
-            if data_location == 'node':
-                coords = ug.nodes
-            elif data_location == 'face':
-                coords = ug.face_coordinates
-            elif data_location == 'edge':
-                coords = ug.edge_coordinates
+            ug = self.cached_ugrid(mesh_name)
+            coords = ug.coordinates(data_location)
 
             lon = coords[:, 0]
             lat = coords[:, 1]
-            spatial_idx = data_handler.ugrid_lat_lon_subset_idx(lon, lat, bbox=wgs84_bbox.bbox)
+            spatial_idx = data_handler.ugrid_lat_lon_subset_idx(lon, lat,
+                                                                bbox=wgs84_bbox.bbox,
+                                                                index=ug.bucket_index(data_location))
 
             vmin = None
             vmax = None
@@ -187,11 +187,11 @@ class UGridDataset(Dataset, NetCDFDataset):
             if isinstance(layer, Layer):
                 if (len(data_obj.shape) == 3):
                     z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                    data = data_obj[time_index, z_index, spatial_idx]
+                    data = self.read_slab(data_obj, (time_index, z_index), spatial_idx)
                 elif (len(data_obj.shape) == 2):
-                    data = data_obj[time_index, spatial_idx]
+                    data = self.read_slab(data_obj, (time_index,), spatial_idx)
                 elif len(data_obj.shape) == 1:
-                    data = data_obj[spatial_idx]
+                    data = self.read_slab(data_obj, (), spatial_idx)
                 else:
                     logger.debug("Dimension Mismatch: data_obj.shape == {0} and time = {1}".format(data_obj.shape, time_value))
 
@@ -206,11 +206,11 @@ class UGridDataset(Dataset, NetCDFDataset):
                     data_obj = nc.variables[l.var_name]
                     if (len(data_obj.shape) == 3):
                         z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                        data.append(data_obj[time_index, z_index, spatial_idx])
+                        data.append(self.read_slab(data_obj, (time_index, z_index), spatial_idx))
                     elif (len(data_obj.shape) == 2):
-                        data.append(data_obj[time_index, spatial_idx])
+                        data.append(self.read_slab(data_obj, (time_index,), spatial_idx))
                     elif len(data_obj.shape) == 1:
-                        data.append(data_obj[spatial_idx])
+                        data.append(self.read_slab(data_obj, (), spatial_idx))
                     else:
                         logger.debug("Dimension Mismatch: data_obj.shape == {0} and time = {1}".format(data_obj.shape, time_value))
 
@@ -234,14 +234,8 @@ class UGridDataset(Dataset, NetCDFDataset):
             data_location = data_obj.location
             mesh_name = data_obj.mesh
 
-            ug = UGrid.from_ncfile(self.topology_file, mesh_name=mesh_name)
-            coords = np.empty(0)
-            if data_location == 'node':
-                coords = ug.nodes
-            elif data_location == 'face':
-                coords = ug.face_coordinates
-            elif data_location == 'edge':
-                coords = ug.edge_coordinates
+            ug = self.cached_ugrid(mesh_name)
+            coords = ug.coordinates(data_location)
 
             lon = coords[:, 0]
             lat = coords[:, 1]
@@ -256,13 +250,13 @@ class UGridDataset(Dataset, NetCDFDataset):
             # Calculate the boolean spatial mask to slice with
             bool_spatial_idx = data_handler.ugrid_lat_lon_subset_idx(lon, lat,
                                                                      bbox=wgs84_bbox.bbox,
-                                                                     padding=padding)
+                                                                     padding=padding,
+                                                                     index=ug.bucket_index(data_location))
 
-            # Randomize vectors to subset if we need to
-            if request.GET['image_type'] == 'vectors' and vector_step > 1:
-                num_vec = int(bool_spatial_idx.size / vector_step)
-                step = int(bool_spatial_idx.size / num_vec)
-                bool_spatial_idx[np.where(bool_spatial_idx==True)][0::step] = False  # noqa: E225
+            # Only read the vectors that are drawn, at most one per few pixels
+            if request.GET['image_type'] == 'vectors':
+                x, y = ug.projected(data_location, request.GET['crs'])
+                bool_spatial_idx = vectors.thin_mask(x, y, bool_spatial_idx, request)
 
             # If no triangles intersect the field of view, return a transparent tile
             if not np.any(bool_spatial_idx):
@@ -270,31 +264,52 @@ class UGridDataset(Dataset, NetCDFDataset):
                 return self.empty_response(layer, request)
 
             if isinstance(layer, Layer):
+                if request.GET['image_type'] in ['contours', 'filledcontours'] and data_location == 'node':
+                    return self.contours_response(ug, data_obj, layer, time_index, request)
+
                 if (len(data_obj.shape) == 3):
                     z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                    data = data_obj[time_index, z_index, :]
+                    prefix = (time_index, z_index)
                 elif (len(data_obj.shape) == 2):
-                    data = data_obj[time_index, :]
+                    prefix = (time_index,)
                 elif len(data_obj.shape) == 1:
-                    data = data_obj[:]
+                    prefix = ()
                 else:
                     logger.debug("Dimension Mismatch: data_obj.shape == {0} and time = {1}".format(data_obj.shape, time_value))
                     return self.empty_response(layer, request)
 
+                colorscalerange = request.GET['colorscalerange']
+                if request.GET['image_type'] == 'pcolor' and data_location in ['node', 'face']:
+                    lookup = self.pixel_lookup(ug, data_location, request)
+                    if colorscalerange.min is not None and colorscalerange.max is not None:
+                        # Only the values under the tile, the colors don't depend on the rest of the mesh
+                        data = self.read_slab(data_obj, prefix, lookup.cells,
+                                              partial=lambda: data_handler.read_indexes(data_obj, prefix, lookup.cells))
+                        return raster.pcolor_response(lookup, data, request, cells=True)
+                    return raster.pcolor_response(lookup, self.read_slab(data_obj, prefix), request)
+
+                data = self.read_slab(data_obj, prefix)
+
                 if request.GET['image_type'] in ['pcolor', 'contours', 'filledcontours']:
                     # Avoid triangles with nan values
                     bool_spatial_idx[np.isnan(data)] = False
 
                     # Get the faces to plot
-                    faces = ug.faces[:]
-                    face_idx = data_handler.face_idx_from_node_idx(faces, bool_spatial_idx)
+                    faces = ug.faces
+                    candidates = None
+                    if data_location == 'node':
+                        # Only faces whose first node is in the padded bbox can qualify
+                        bbox = data_handler.padded_bbox(wgs84_bbox.bbox, padding)
+                        candidates = ug.face_bucket_index().query(bbox)
+                    face_idx = data_handler.face_idx_from_node_idx(faces, bool_spatial_idx, candidates=candidates)
                     faces_subset = faces[face_idx]
                     tri_subset = Tri.Triangulation(lon, lat, triangles=faces_subset)
+                    projected = ug.projected(data_location, request.GET['crs'])
 
                     if request.GET['image_type'] == 'pcolor':
-                        return mpl_handler.tripcolor_response(tri_subset, data, request, data_location=data_location)
+                        return mpl_handler.tripcolor_response(tri_subset, data, request, data_location=data_location, projected=projected)
                     else:
-                        return mpl_handler.tricontouring_response(tri_subset, data, request)
+                        return mpl_handler.tricontouring_response(tri_subset, data, request, projected=projected)
                 elif request.GET['image_type'] in ['filledhatches', 'hatches']:
                     raise NotImplementedError('matplotlib does not support hatching on triangular grids... sorry!')
                 else:
@@ -303,28 +318,71 @@ class UGridDataset(Dataset, NetCDFDataset):
             elif isinstance(layer, VirtualLayer):
                 # Data needs to be [var1,var2] where var are 1D (nodes only, elevation and time already handled)
                 data = []
+                spatial_idx = np.flatnonzero(bool_spatial_idx)
                 for l in layer.layers:
                     data_obj = nc.variables[l.var_name]
                     if (len(data_obj.shape) == 3):
                         z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                        data.append(data_obj[time_index, z_index, bool_spatial_idx])
+                        prefix = (time_index, z_index)
                     elif (len(data_obj.shape) == 2):
-                        data.append(data_obj[time_index, bool_spatial_idx])
+                        prefix = (time_index,)
                     elif len(data_obj.shape) == 1:
-                        data.append(data_obj[bool_spatial_idx])
+                        prefix = ()
                     else:
                         logger.debug("Dimension Mismatch: data_obj.shape == {0} and time = {1}".format(data_obj.shape, time_value))
                         return self.empty_response(layer, request)
+                    # u and v are separate variables, each is a slab of its own
+                    data.append(self.read_slab(data_obj, prefix, spatial_idx,
+                                               partial=lambda: data_handler.read_indexes(data_obj, prefix, spatial_idx)))
 
                 if request.GET['image_type'] == 'vectors':
-                    return mpl_handler.quiver_response(lon[bool_spatial_idx],
-                                                       lat[bool_spatial_idx],
-                                                       data[0],
-                                                       data[1],
-                                                       request)
+                    return vectors.arrows_response(x[bool_spatial_idx],
+                                                   y[bool_spatial_idx],
+                                                   data[0],
+                                                   data[1],
+                                                   request)
                 else:
                     raise NotImplementedError('Image type "{}" is not supported.'.format(request.GET['image_type']))
 
+    def pixel_lookup(self, ug, data_location, request):
+        """
+        The face under each pixel of the requested view, reused by every request
+        for the same view (e.g. the frames of a time animation)
+        """
+        def build():
+            locator = ug.triangle_locator(request.GET['crs'])
+            return raster.triangle_lookup(locator,
+                                          request.GET['bbox'],
+                                          request.GET['width'],
+                                          request.GET['height'],
+                                          location=data_location)
+
+        key = (data_location,) + raster.view_key(request)
+        return raster.cached_lookup(ug, key, build)
+
+    def contours_response(self, ug, data_obj, layer, time_index, request):
+        """
+        The contours of the whole mesh, traced once and drawn by every tile
+        (and style) of the same time step
+        """
+        z_index = None
+        if len(data_obj.shape) == 3:
+            z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
+
+        def build():
+            if z_index is not None:
+                data = self.read_slab(data_obj, (time_index, z_index))
+            elif len(data_obj.shape) == 2:
+                data = self.read_slab(data_obj, (time_index,))
+            else:
+                data = self.read_slab(data_obj, ())
+            x, y = ug.projected('node', request.GET['crs'])
+            return contours.contour_set(x, y, data, request, triangles=ug.faces)
+
+        key = (layer.access_name, time_index, z_index, self.cache_last_updated) + contours.request_key(request)
+        cs = contours.cached(ug, key, build)
+        return contours.contour_response(cs, request)
+
     def getfeatureinfo(self, layer, request):
         with self.dataset() as nc:
             data_obj = nc.variables[layer.access_name]
@@ -341,9 +399,9 @@ class UGridDataset(Dataset, NetCDFDataset):
             if isinstance(layer, Layer):
                 if len(data_obj.shape) == 3:
                     z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                    data = data_obj[start_time_index:end_time_index, z_index, geo_index]
+                    data = self.read_series(data_obj, start_time_index, end_time_index, (z_index,), geo_index)
                 elif len(data_obj.shape) == 2:
-                    data = data_obj[start_time_index:end_time_index, geo_index]
+                    data = self.read_series(data_obj, start_time_index, end_time_index, (), geo_index)
                 elif len(data_obj.shape) == 1:
                     data = data_obj[geo_index]
                 else:
@@ -358,9 +416,9 @@ class UGridDataset(Dataset, NetCDFDataset):
                     data_obj = nc.variables[l.var_name]
                     if len(data_obj.shape) == 3:
                         z_index, z_value = self.nearest_z(layer, request.GET['elevation'])
-                        data = data_obj[start_time_index:end_time_index, z_index, geo_index]
+                        data = self.read_series(data_obj, start_time_index, end_time_index, (z_index,), geo_index)
                     elif len(data_obj.shape) == 2:
-                        data = data_obj[start_time_index:end_time_index, geo_index]
+                        data = self.read_series(data_obj, start_time_index, end_time_index, (), geo_index)
                     elif len(data_obj.shape) == 1:
                         data = data_obj[geo_index]
                     else:
@@ -397,14 +455,8 @@ class UGridDataset(Dataset, NetCDFDataset):
                 data_location = nc.variables[layer.access_name].location
                 mesh_name = nc.variables[layer.access_name].mesh
                 # Use local topology for pulling bounds data
-                ug = UGrid.from_ncfile(self.topology_file, mesh_name=mesh_name)
-                coords = np.empty(0)
-                if data_location == 'node':
-                    coords = ug.nodes
-                elif data_location == 'face':
-                    coords = ug.face_coordinates
-                elif data_location == 'edge':
-                    coords = ug.edge_coordinates
+                ug = self.cached_ugrid(mesh_name)
+                coords = ug.coordinates(data_location)
 
                 minx = np.nanmin(coords[:, 0])
                 miny = np.nanmin(coords[:, 1])
@@ -17,8 +17,9 @@ from wms.models import UGridDataset, VirtualLayer
 from wms.utils import calc_lon_lat_padding, calc_safety_factor, DotDict
 
 from wms import data_handler
-from wms import mpl_handler
+from wms import vectors
 from wms import gmd_handler
+from wms import topology
 
 from wms import logger
 
@@ -43,7 +44,7 @@ class UGridTideDataset(UGridDataset):
         return {}
 
     def update_grid_cache(self, force=False):
-        with self.dataset() as nc:
+        with self.dataset(direct=True) as nc:
             if nc is None:
                 logger.error("Failed update_grid_cache, could not load dataset "
                              "as a netCDF4 object")
@@ -126,6 +127,9 @@ class UGridTideDataset(UGridDataset):
                     logger.error("Failed to create topology_file cache for Dataset '{}'".format(self.dataset.name))
                     return
 
+            # Flat arrays that the web workers memory map (and share)
+            topology.UGridTopology.from_ugrid(ug).save_arrays(self.topology_arrays_root)
+
         # Now do the RTree index
         self.make_rtree()
 
@@ -140,7 +144,12 @@ class UGridTideDataset(UGridDataset):
         magnitude = np.sqrt((us * us) + (vs * vs))
         return gmd_handler.from_dict(dict(min=np.min(magnitude), max=np.max(magnitude)))
 
-    def get_tidal_vectors(self, layer, time, bbox, vector_scale=None, vector_step=None):
+    def get_tidal_vectors(self, layer, time, bbox, vector_scale=None, vector_step=None, crs=None, tile=None):
+        """
+        Returns the U and V tidal vectors at ``time`` and the lon/lat of each
+        vector, or their projected x/y when a ``crs`` is given. With the
+        ``tile`` of a GetMap request only the vectors drawn on it are computed.
+        """
 
         vector_scale = vector_scale or 1
         vector_step = vector_step or 1
@@ -150,14 +159,8 @@ class UGridTideDataset(UGridDataset):
             data_location = getattr(data_obj, 'location', 'node')
             mesh_name = data_obj.mesh
 
-            ug = UGrid.from_nc_dataset(nc, mesh_name=mesh_name)
-            coords = np.empty(0)
-            if data_location == 'node':
-                coords = ug.nodes
-            elif data_location == 'face':
-                coords = ug.face_coordinates
-            elif data_location == 'edge':
-                coords = ug.edge_coordinates
+            ug = self.cached_ugrid(mesh_name)
+            coords = ug.coordinates(data_location)
 
             lon = coords[:, 0]
             lat = coords[:, 1]
@@ -166,7 +169,11 @@ class UGridTideDataset(UGridDataset):
             padding = calc_lon_lat_padding(lon, lat, padding_factor) * vector_step
             spatial_idx = data_handler.ugrid_lat_lon_subset_idx(lon, lat,
                                                                 bbox=bbox,
-                                                                padding=padding)
+                                                                padding=padding,
+                                                                index=ug.bucket_index(data_location))
+            if tile is not None:
+                x, y = ug.projected(data_location, tile.GET['crs'])
+                spatial_idx = vectors.thin_mask(x, y, spatial_idx, tile)
 
             tnames = nc.get_variables_by_attributes(standard_name='tide_constituent')[0]
             tfreqs = nc.get_variables_by_attributes(standard_name='tide_frequency')[0]
@@ -217,6 +224,8 @@ class UGridTideDataset(UGridDataset):
             U = (f * ua.T * np.cos(v + s * omega + u - up.T * np.pi / 180)).sum(axis=1)
             V = (f * va.T * np.cos(v + s * omega + u - vp.T * np.pi / 180)).sum(axis=1)
 
+            if crs is not None:
+                lon, lat = ug.projected(data_location, crs)
             return U, V, lon[spatial_idx], lat[spatial_idx]
 
     def getmap(self, layer, request):
@@ -229,17 +238,19 @@ class UGridTideDataset(UGridDataset):
             vector_scale = request.GET['vectorscale']
             vector_step = request.GET['vectorstep']
 
-        us, vs, lons, lats = self.get_tidal_vectors(layer,
-                                                    time=time_value,
-                                                    bbox=request.GET['wgs84_bbox'].bbox,
-                                                    vector_scale=vector_scale,
-                                                    vector_step=vector_step)
+        us, vs, xs, ys = self.get_tidal_vectors(layer,
+                                                time=time_value,
+                                                bbox=request.GET['wgs84_bbox'].bbox,
+                                                vector_scale=vector_scale,
+                                                vector_step=vector_step,
+                                                crs=request.GET['crs'],
+                                                tile=request if request.GET['image_type'] == 'vectors' else None)
 
-        if not lons.any() or not lats.any():
+        if not xs.size or not ys.size:
             return self.empty_response(layer, request)
 
         if request.GET['image_type'] == 'vectors':
-            return mpl_handler.quiver_response(lons, lats, us, vs, request)
+            return vectors.arrows_response(xs, ys, us, vs, request)
         else:
             raise NotImplementedError('Image type "{}" is not supported.'.format(request.GET['image_type']))
 
@@ -264,6 +275,10 @@ class UGridTideDataset(UGridDataset):
     def nearest_time(self, layer, time):
         return None, time
 
+    def time_axis(self, layer):
+        # Tides are predicted for any time, there are no time steps
+        return None
+
     def times(self, layer):
         return datetime.utcnow().replace(tzinfo=pytz.utc)
 
@@ -273,14 +288,8 @@ class UGridTideDataset(UGridDataset):
                 data_location = nc.variables['u'].location
                 mesh_name = nc.variables['u'].mesh
                 # Use local topology for pulling bounds data
-                ug = UGrid.from_ncfile(self.topology_file, mesh_name=mesh_name)
-                coords = np.empty(0)
-                if data_location == 'node':
-                    coords = ug.nodes
-                elif data_location == 'face':
-                    coords = ug.face_coordinates
-                elif data_location == 'edge':
-                    coords = ug.edge_coordinates
+                ug = self.cached_ugrid(mesh_name)
+                coords = ug.coordinates(data_location)
 
                 minx = np.nanmin(coords[:, 0])
                 miny = np.nanmin(coords[:, 1])
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Reading ahead the time steps a client is likely to ask for next. After a
+GetMap is served the time steps that follow it (in the direction the client
+is stepping through time, for animations) are queued and a thread of the
+worker reads their slabs into the slab cache, and optionally renders the
+same tile into the tile cache.
+
+Prefetching never competes with requests: it only runs while the worker is
+not rendering one, a request arriving during a prefetch waits for that one
+read to finish (NetCDF handles can't be read from two threads at once), at
+most ``PREFETCH_RATE`` prefetches run per second and queued time steps that
+were not reached after ``MAX_AGE`` seconds are dropped.
+"""
+import time
+import threading
+from copy import copy
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import netCDF4 as nc4
+from django import db
+from django.conf import settings
+
+from wms import tilecache
+from wms import logger
+
+# Time steps a client may skip between requests and still be animating
+MAX_STRIDE = 4
+MAX_QUEUE = 16
+# Seconds a queued prefetch stays useful
+MAX_AGE = 10
+# Layers and time steps remembered
+MAX_HISTORY = 1024
+
+
+class Prefetcher(object):
+    """
+    Per-worker queue of prefetches and the thread running them. ``history``
+    holds the last time index requested for each layer and elevation.
+    """
+
+    def __init__(self, steps=2, rate=4, tiles=False):
+        self.steps = steps
+        self.rate = rate
+        self.tiles = tiles
+        self.history = OrderedDict()
+        self.queued = OrderedDict()
+        self.pending = deque()
+        self.active = 0
+        self.running = False
+        self.done = 0
+        self.dropped = 0
+        self.failed = 0
+        self._next_run = 0
+        self._thread = None
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return bool(self.steps) and bool(self.rate)
+
+    @contextmanager
+    def foreground(self):
+        """ A request is being rendered, prefetches wait until it is done """
+        with self._cond:
+            self.active += 1
+            while self.running:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def targets(self, stream, time_index, size):
+        """ The time indexes likely requested after ``time_index`` on a layer and elevation """
+        previous = self.history.pop(stream, None)
+        self.history[stream] = time_index
+        while len(self.history) > MAX_HISTORY:
+            self.history.popitem(last=False)
+
+        if previous is not None and 0 < abs(time_index - previous) <= MAX_STRIDE:
+            # Animating, keep going the same way
+            stride, steps = time_index - previous, self.steps
+        else:
+            # The next time step is the usual next request
+            stride, steps = 1, 1
+        targets = [ time_index + stride * k for k in range(1, steps + 1) ]
+        return [ t for t in targets if 0 <= t < size ]
+
+    def watch(self, dataset, layer, request):
+        """ Queue the prefetches following a GetMap request that was served """
+        if not self.enabled or not hasattr(dataset, 'prefetch') or dataset.horizontal_ndim is None:
+            return
+        axis = dataset.time_axis(layer)
+        if axis is None or axis.values is None or not axis.values.size:
+            return
+
+        time_index, _ = axis.nearest(request.GET['time'])
+        elevation = request.GET['elevation']
+        stream = (dataset.pk, layer.__class__.__name__, layer.pk, elevation)
+        with self._cond:
+            targets = self.targets(stream, int(time_index), axis.values.size)
+        if not targets:
+            return
+
+        # Everything needing the database is looked up here, jobs only read data
+        names = dataset.layer_variables(layer)
+        # The job's own instance, the request's instance holds its open dataset
+        dataset = copy(dataset)
+        dataset._dataset = None
+
+        for target in targets:
+            key = stream + (target, request.GET['image_type'], repr(tilecache.canonical(request.GET['bbox'])))
+            self.submit(key, lambda t=target: self.prefetch(dataset, layer, names, t, axis, request))
+
+    def submit(self, key, job):
+        with self._cond:
+            now = time.monotonic()
+            if now - self.queued.get(key, -MAX_AGE) < MAX_AGE:
+                # Queued a moment ago for another request on the same time step
+                return
+            self.queued.pop(key, None)
+            self.queued[key] = now
+            while len(self.queued) > MAX_HISTORY:
+                self.queued.popitem(last=False)
+            if len(self.pending) >= MAX_QUEUE:
+                # The oldest is the least likely to still be wanted
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append((now, job))
+            self._start()
+            self._cond.notify_all()
+
+    def prefetch(self, dataset, layer, names, time_index, axis, request):
+        dataset.prefetch(layer, names, time_index, request.GET['elevation'])
+        if self.tiles and tilecache.cache.enabled:
+            try:
+                value = nc4.num2date(axis.values[time_index], axis.units, axis.calendar,
+                                     only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+            except ValueError:
+                # Not a calendar requests can ask for
+                return
+            view = copy(request)
+            view.GET = request.GET.copy()
+            view.GET.update(dict(time=value, starting=value, ending=value))
+            tilecache.cached_response(dataset, layer, 'getmap', view, lambda r: dataset.getmap(layer, r))
+
+    def next_job(self, block=True):
+        """ The next prefetch to run once no request is rendering and the rate allows it, None if there is none """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self.pending and now - self.pending[0][0] > MAX_AGE:
+                    self.pending.popleft()
+                    self.dropped += 1
+                if self.pending and not self.active and now >= self._next_run:
+                    self._next_run = now + 1. / self.rate
+                    self.running = True
+                    return self.pending.popleft()[1]
+                if not block:
+                    return None
+                timeout = max(self._next_run - now, 0.01) if self.pending else None
+                self._cond.wait(timeout)
+
+    def run(self, job):
+        try:
+            job()
+            self.done += 1
+        except BaseException:
+            logger.exception("Prefetch failed")
+            self.failed += 1
+        finally:
+            with self._cond:
+                self.running = False
+                self._cond.notify_all()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='prefetch', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self.run(self.next_job())
+            # The thread's own database connection, if a tile was rendered
+            db.connection.close()
+
+    @property
+    def stats(self):
+        with self._cond:
+            return dict(pending=len(self.pending), done=self.done, dropped=self.dropped, failed=self.failed)
+
+
+prefetcher = Prefetcher(steps=settings.PREFETCH_STEPS, rate=settings.PREFETCH_RATE, tiles=settings.PREFETCH_TILES)
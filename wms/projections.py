@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pyproj
+
+EPSG4326 = 'EPSG:4326'
+
+
+def normalize(projstr):
+    """ 'epsg:3857 ' -> 'EPSG:3857' so equivalent requests share transformers """
+    return projstr.strip().upper()
+
+
+class TransformerRegistry(object):
+    """
+    Reusable pyproj Transformers keyed by the (source, target) CRS strings.
+    Creating a Transformer parses both CRS definitions, which costs far more
+    than transforming a bbox with it, so they are built once per process.
+
+    Transformers are not safe to share between threads, so each thread
+    keeps its own.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, source, target):
+        transformers = getattr(self._local, 'transformers', None)
+        if transformers is None:
+            transformers = self._local.transformers = {}
+
+        key = (source, target)
+        try:
+            return transformers[key]
+        except KeyError:
+            # Always x/y (lon/lat) order, like the old pyproj.transform
+            transformer = pyproj.Transformer.from_crs(source, target, always_xy=True)
+            transformers[key] = transformer
+            return transformer
+
+    def transform(self, source, target, x, y):
+        if source == target:
+            return x, y
+        return self.get(source, target).transform(x, y)
+
+    def clear(self):
+        self._local.transformers = {}
+
+
+registry = TransformerRegistry()
+
+
+def transform(source, target, x, y):
+    return registry.transform(source, target, x, y)
+
+
+def from_wgs84(crs, lon, lat):
+    return registry.transform(EPSG4326, crs, lon, lat)
+
+
+def to_wgs84(crs, x, y):
+    return registry.transform(crs, EPSG4326, x, y)
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Renders tiles straight into a numpy RGBA array: every output pixel is mapped
+to the grid cell under its center and colored through a 256 entry lookup
+table, then encoded as a PNG. No matplotlib Figure is drawn.
+
+The pixel to cell mapping only depends on the grid and the map view, so it is
+kept between requests and the frames of a time animation only gather data.
+"""
+from functools import lru_cache
+
+import numpy as np
+import matplotlib as mpl
+from scipy.spatial import cKDTree
+from django.conf import settings
+from django.http import HttpResponse
+
+from wms import png
+from wms.lru import LRUCache
+
+from wms import logger  # noqa
+
+
+def pixel_centers(bbox, width, height):
+    """ Projected x/y of the center of every pixel of a (height, width) image, top row first """
+    dx = (bbox.maxx - bbox.minx) / width
+    dy = (bbox.maxy - bbox.miny) / height
+    x = bbox.minx + dx * (np.arange(width) + 0.5)
+    y = bbox.maxy - dy * (np.arange(height) + 0.5)
+    return np.meshgrid(x, y)
+
+
+def in_triangles(x0, y0, x1, y1, x2, y2, px, py):
+    """ Whether each point is inside of (or on the edge of) each triangle, from its barycentric coordinates """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+        l0 = ((y1 - y2) * (px - x2) + (x2 - x1) * (py - y2)) / det
+        l1 = ((y2 - y0) * (px - x2) + (x0 - x2) * (py - y2)) / det
+    eps = -1e-9
+    return (l0 >= eps) & (l1 >= eps) & (1 - l0 - l1 >= eps)
+
+
+class CellLocator(object):
+    """
+    Finds the cell under a point from KD-trees of the cell centers: the
+    nearest centers are candidates and the first cell containing the point
+    wins. A point is only compared with the centers closer to it than the
+    radius of their cell (the farthest its corners are from the center), so
+    cells are split into size classes (radii within 4x of each other) with a
+    tree each, searched up to the largest radius of the class. Subclasses call
+    ``index`` and set ``contains``.
+    """
+
+    candidates = 8
+    # Most centers of a size class compared with a point
+    max_candidates = 512
+
+    def index(self, mid_x, mid_y, radius):
+        """ The trees of the cell centers, ``classes`` holding (cells, tree, largest radius) for each size """
+        self.count = radius.size
+        self.classes = []
+        if not self.count:
+            return
+        largest = radius.max()
+        with np.errstate(divide='ignore'):
+            size = np.floor(np.log(np.maximum(radius, largest * 1e-12) / largest) / np.log(4))
+        for s in np.unique(size):
+            cells = np.flatnonzero(size == s)
+            self.classes.append((cells, cKDTree(np.column_stack((mid_x[cells], mid_y[cells]))), radius[cells].max()))
+        # Most points are in the class with the most cells
+        self.classes.sort(key=lambda c: -c[0].size)
+
+    def contains(self, near, px, py):
+        """ Whether each point is inside of each of its candidate cells """
+        raise NotImplementedError
+
+    def find(self, px, py):
+        """ Index (into the cells given to ``index``) of the cell under each point, -1 outside of the grid """
+        px = px.ravel()
+        py = py.ravel()
+        found = np.full(px.size, -1, dtype=np.int64)
+
+        todo = np.arange(px.size)
+        for cells, tree, max_radius in self.classes:
+            rest = todo
+            # The cell of the nearest center first, it is the one under most points
+            k = 1
+            while rest.size:
+                dist, near = tree.query(np.column_stack((px[rest], py[rest])), k=k, distance_upper_bound=max_radius)
+                dist = dist.reshape(rest.size, -1)
+                near = near.reshape(rest.size, -1)
+                # Missing neighbours (farther than the bound) are reported as the tree size
+                close = near < cells.size
+                near = cells[np.minimum(near, cells.size - 1)]
+                inside = self.contains(near, px[rest, None], py[rest, None]) & close
+
+                first = np.argmax(inside, axis=1)
+                rows = np.arange(rest.size)
+                hit = inside[rows, first]
+                found[rest[hit]] = near[rows[hit], first[hit]]
+
+                if k >= min(cells.size, self.max_candidates):
+                    break
+                rest = rest[~hit & np.isfinite(dist[:, -1])]
+                k = min(max(k * 4, self.candidates), cells.size, self.max_candidates)
+            todo = todo[found[todo] < 0]
+            if not todo.size:
+                break
+        return found
+
+    @property
+    def tree_nbytes(self):
+        return sum(tree.data.nbytes + tree.indices.nbytes for _, tree, _ in self.classes) + \
+            sum(cells.nbytes for cells, _, _ in self.classes)
+
+
+class QuadLocator(CellLocator):
+    """
+    Finds the cell of a curvilinear grid under a point. Cells are drawn the way
+    pcolormesh draws them from cell center coordinates: cell (i, j) is the
+    quadrilateral between centers [i:i+2, j:j+2] and takes the value at (i, j).
+    Each quadrilateral is tested as the two triangles either side of the
+    diagonal from its corner (i, j).
+    """
+
+    def __init__(self, x, y, candidates=8):
+        x = np.ma.filled(np.ma.asarray(x, dtype=np.float64), np.nan)
+        y = np.ma.filled(np.ma.asarray(y, dtype=np.float64), np.nan)
+        self.shape = x.shape
+        self.x = x.ravel()
+        self.y = y.ravel()
+        self.candidates = candidates
+
+        corners_x = np.stack((x[:-1, :-1], x[1:, :-1], x[1:, 1:], x[:-1, 1:]))
+        corners_y = np.stack((y[:-1, :-1], y[1:, :-1], y[1:, 1:], y[:-1, 1:]))
+        mid_x = corners_x.mean(axis=0)
+        mid_y = corners_y.mean(axis=0)
+        # Distance from the middle of each cell to its farthest corner
+        radius = np.sqrt(np.max((corners_x - mid_x) ** 2 + (corners_y - mid_y) ** 2, axis=0)).ravel()
+        mid_x = mid_x.ravel()
+        mid_y = mid_y.ravel()
+
+        valid = np.isfinite(mid_x) & np.isfinite(mid_y) & np.isfinite(radius)
+        self.ids = np.flatnonzero(valid)
+        self.index(mid_x[valid], mid_y[valid], radius[valid])
+
+    def corners(self, near):
+        """ Flat indexes into the cell center arrays of the corners (i, j), (i+1, j), (i+1, j+1), (i, j+1) of cells """
+        columns = self.shape[1]
+        row, col = np.divmod(self.ids[near], columns - 1)
+        first = row * columns + col
+        return first, first + columns, first + columns + 1, first + 1
+
+    def contains(self, near, px, py):
+        c0, c1, c2, c3 = self.corners(near)
+        x, y = self.x, self.y
+        return (in_triangles(x[c0], y[c0], x[c1], y[c1], x[c2], y[c2], px, py) |
+                in_triangles(x[c0], y[c0], x[c2], y[c2], x[c3], y[c3], px, py))
+
+    def locate(self, px, py):
+        """
+        Flat index into the cell center arrays of the cell under each point,
+        -1 for points outside of the grid.
+        """
+        found = self.find(px, py)
+        hit = found >= 0
+        cells = np.full(found.size, -1, dtype=np.int64)
+        cells[hit] = self.corners(found[hit])[0]
+        return cells.reshape(px.shape)
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + self.ids.nbytes + self.tree_nbytes
+
+
+class TriangleLocator(CellLocator):
+    """
+    Finds the triangle of a mesh under a point. Faces with more than three
+    nodes are split into a fan of triangles.
+    """
+
+    def __init__(self, x, y, faces, candidates=8):
+        faces = np.ma.asarray(faces)
+        filled = np.ma.filled(faces, -1)
+        triangles = []
+        face_ids = []
+        for i in range(1, faces.shape[1] - 1):
+            fan = filled[:, [0, i, i + 1]]
+            ok = np.all(fan >= 0, axis=1)
+            triangles.append(fan[ok])
+            face_ids.append(np.flatnonzero(ok))
+        triangles = np.concatenate(triangles).astype(np.int32)
+        face_ids = np.concatenate(face_ids).astype(np.int32)
+
+        tx = np.asarray(x, dtype=np.float64)[triangles]
+        ty = np.asarray(y, dtype=np.float64)[triangles]
+        valid = np.all(np.isfinite(tx) & np.isfinite(ty), axis=1)
+        self.triangles = triangles[valid]
+        self.face_ids = face_ids[valid]
+        self.tx = tx[valid]
+        self.ty = ty[valid]
+        self.candidates = candidates
+        mid_x = self.tx.mean(axis=1)
+        mid_y = self.ty.mean(axis=1)
+        radius = np.sqrt(np.max((self.tx - mid_x[:, None]) ** 2 + (self.ty - mid_y[:, None]) ** 2, axis=1))
+        self.index(mid_x, mid_y, radius)
+
+    def contains(self, near, px, py):
+        return in_triangles(self.tx[near, 0], self.ty[near, 0],
+                            self.tx[near, 1], self.ty[near, 1],
+                            self.tx[near, 2], self.ty[near, 2], px, py)
+
+    def locate(self, px, py):
+        """ Index (into ``triangles``) of the triangle under each point, -1 outside of the mesh """
+        return self.find(px, py)
+
+    @property
+    def nbytes(self):
+        return self.triangles.nbytes + self.face_ids.nbytes + self.tx.nbytes + self.ty.nbytes + self.tree_nbytes
+
+
+@lru_cache(maxsize=64)
+def colormap_lut(colormap):
+    """ The (256, 4) uint8 RGBA lookup table of a named matplotlib colormap """
+    lut = mpl.cm.get_cmap(colormap, 256)(np.arange(256), bytes=True)
+    lut.setflags(write=False)
+    return lut
+
+
+def get_norm(request, data):
+    """ The same normalization the matplotlib renderers use """
+    colorscalerange = request.GET['colorscalerange']
+    cmin = colorscalerange.min
+    cmax = colorscalerange.max
+
+    if request.GET['logscale'] is True:
+        norm_func = mpl.colors.LogNorm
+    else:
+        norm_func = mpl.colors.Normalize
+
+    if cmin is not None and cmax is not None:
+        return norm_func(vmin=cmin, vmax=cmax)
+
+    # Autoscale on all of the data, like pcolormesh does
+    norm = norm_func()
+    norm.autoscale_None(np.ma.masked_invalid(data))
+    return norm
+
+
+def color_indexes(values, norm, cmin=None, cmax=None):
+    """ Index into a 256 entry colormap of each value, and where values are missing (NaN or masked) """
+    values = np.ma.masked_invalid(values)
+    if cmin is not None and cmax is not None:
+        values = np.ma.clip(values, cmin, cmax)
+    normed = norm(values)
+    # Same binning as matplotlib's Colormap.__call__
+    idx = np.clip((np.ma.filled(normed, 0) * 256).astype(np.intp), 0, 255)
+    return idx, np.ma.getmaskarray(normed)
+
+
+def colors(idx, missing, colormap):
+    """ RGBA uint8 colors of color indexes, transparent where values are missing """
+    rgba = colormap_lut(colormap)[idx]
+    rgba[missing] = 0
+    return rgba
+
+
+def colorize(values, norm, colormap, cmin=None, cmax=None):
+    """ RGBA uint8 colors of the values, NaN and masked values are transparent """
+    idx, missing = color_indexes(values, norm, cmin, cmax)
+    return colors(idx, missing, colormap)
+
+
+class PixelLookup(object):
+    """
+    For every pixel of a (height, width) image, the flat indexes of the data
+    values it is colored from (-1 for no data) and the weight of each. Without
+    weights every pixel takes a single value.
+    """
+
+    def __init__(self, shape, indexes, weights=None):
+        self.shape = shape
+        self.indexes = indexes
+        self.weights = weights
+        # The values any pixel uses, so only those have to be read
+        self.cells = np.unique(indexes[indexes >= 0])
+
+    def gather(self, data, cells=False):
+        """
+        The (height, width) values of the pixels, NaN where there is no data.
+        With ``cells`` the data is only the values at ``self.cells``.
+        """
+        if cells and not self.cells.size:
+            return np.full(self.shape, np.nan)
+        outside = self.indexes < 0
+        indexes = np.where(outside, 0, self.indexes)
+        if cells:
+            indexes = np.minimum(np.searchsorted(self.cells, indexes), self.cells.size - 1)
+        values = np.ma.asarray(data).ravel()[indexes]
+        values = np.ma.filled(values.astype(np.float64), np.nan)
+        values[outside] = np.nan
+        if self.weights is not None:
+            # NaN in any of the values of a pixel leaves it empty
+            values = (values * self.weights).sum(axis=1)
+        return values.reshape(self.shape)
+
+    def window(self, shape):
+        """
+        The (rows, columns) slices of the smallest window of a 2D grid of
+        ``shape`` holding all of the cells, None if there are none
+        """
+        if not self.cells.size:
+            return None
+        rows, columns = np.unravel_index(self.cells, shape)
+        return slice(int(rows.min()), int(rows.max()) + 1), slice(int(columns.min()), int(columns.max()) + 1)
+
+    @property
+    def nbytes(self):
+        return self.indexes.nbytes + self.cells.nbytes + (0 if self.weights is None else self.weights.nbytes)
+
+
+def quad_lookup(locator, bbox, width, height):
+    """ Pixel lookup of a curvilinear grid (the QuadLocator of its cell centers) """
+    px, py = pixel_centers(bbox, width, height)
+    cells = locator.locate(px, py).ravel().astype(np.int32)
+    return PixelLookup((height, width), cells)
+
+
+def triangle_lookup(locator, bbox, width, height, location='node'):
+    """
+    Pixel lookup of a triangular mesh (the TriangleLocator of its nodes). For
+    node data each pixel takes the mean of the values at the nodes of its
+    triangle, like the flat shading of tripcolor. Face data is used as is.
+    """
+    px, py = pixel_centers(bbox, width, height)
+    found = locator.locate(px, py)
+    inside = found >= 0
+    found = np.where(inside, found, 0)
+
+    if location == 'face':
+        indexes = np.where(inside, locator.face_ids[found], -1).astype(np.int32)
+        return PixelLookup((height, width), indexes)
+
+    indexes = np.where(inside[:, None], locator.triangles[found], -1).astype(np.int32)
+    weights = np.full(indexes.shape, 1. / 3, dtype=np.float32)
+    return PixelLookup((height, width), indexes, weights)
+
+
+def view_key(request):
+    """ What a pixel lookup depends on besides the grid """
+    bbox = request.GET['bbox']
+    return (request.GET['crs'], (bbox.minx, bbox.miny, bbox.maxx, bbox.maxy), request.GET['width'], request.GET['height'])
+
+
+lookups = LRUCache(max_bytes=settings.PIXEL_LOOKUP_MAX_BYTES)
+
+
+def cached_lookup(topo, key, build):
+    """
+    The pixel lookup of a view of a topology (wms.topology), built on first use.
+    The topology version is part of the key so rebuilt grids never reuse one.
+    """
+    key = (topo.key, topo.version) + tuple(key)
+    lookup = lookups.get(key)
+    if lookup is None:
+        lookup = lookups.set(key, build())
+    return lookup
+
+
+def render(lookup, data, request):
+    """ Gather the data of each pixel and color it """
+    colorscalerange = request.GET['colorscalerange']
+    norm = get_norm(request, data)
+    return colorize(lookup.gather(data), norm, request.GET['colormap'], colorscalerange.min, colorscalerange.max)
+
+
+def encode_colors(idx, missing, colormap):
+    """
+    PNG of the colormap colors at ``idx``, transparent where values are
+    missing. The colormap is the palette, so no quantizing is needed.
+    """
+    lut = colormap_lut(colormap)
+    if settings.PNG_PALETTE:
+        # A color that no pixel uses stands in for transparent
+        unused = np.flatnonzero(np.bincount(idx[~missing], minlength=lut.shape[0]) == 0)
+        if unused.size or not missing.any():
+            palette = lut
+            if missing.any():
+                palette = lut.copy()
+                palette[unused[0]] = 0
+                idx = np.where(missing, unused[0], idx)
+            return png.encode_indexed(idx, palette, level=settings.PNG_COMPRESSION_LEVEL)
+
+    return png.encode_rgba(colors(idx, missing, colormap), level=settings.PNG_COMPRESSION_LEVEL)
+
+
+def pcolor_response(lookup, data, request, cells=False):
+    """
+    A pcolor tile of data, ``lookup`` is the PixelLookup of the requested view.
+    With ``cells`` the data is only the values at ``lookup.cells``.
+    """
+    colorscalerange = request.GET['colorscalerange']
+    norm = get_norm(request, data)
+    idx, missing = color_indexes(lookup.gather(data, cells=cells), norm, colorscalerange.min, colorscalerange.max)
+    response = HttpResponse(encode_colors(idx, missing, request.GET['colormap']), content_type='image/png')
+    # Like data_handler.png_response
+    response.pixels = lambda: colors(idx, missing, request.GET['colormap'])
+    return response
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Decoded horizontal slabs of the variables of a dataset (the whole grid at a
+time step, and depth) kept in memory by each worker, so the GetMetadata
+minmax and the GetMap tiles that follow it for the same layer, time and
+elevation read the slab from disk once.
+
+Slabs are keyed by the dataset, the variable and the time (and depth) index,
+read whole on first use and indexed in memory afterwards. Slabs larger than
+a fraction of ``SLAB_CACHE_MAX_BYTES`` are never read whole, reads of them
+only read what they ask for.
+
+With ``SLAB_STORE_MAX_BYTES`` set the slabs are shared by every worker on
+the host instead: the first worker to read a slab writes it to a file under
+``SLAB_STORE_PATH`` (best a tmpfs, like ``/dev/shm``) and every worker maps
+that file read only, so the memory used does not grow with the number of
+workers. The store is bounded like the tile cache, least recently used files
+are removed first. A removed file stays mapped (and in memory) until the
+last request using it is done: the kernel counts the references.
+"""
+import os
+import hashlib
+
+import numpy as np
+from django.conf import settings
+
+from wms.lru import LRUCache
+from wms.tilecache import TileCache
+
+from wms import logger  # noqa
+
+# A slab is read whole only when the cache holds at least this many of its size
+SLABS_PER_CACHE = 8
+
+
+def slab_nbytes(variable, prefix):
+    """ The decoded size of ``variable[prefix]`` """
+    if not isinstance(variable.dtype, np.dtype):
+        # Variable length strings, ...
+        return None
+    return int(np.prod(variable.shape[len(prefix):], dtype=np.int64)) * variable.dtype.itemsize
+
+
+def fits(variable, prefix, max_bytes):
+    nbytes = slab_nbytes(variable, prefix)
+    if nbytes is None:
+        return False
+    return max_bytes is None or nbytes * SLABS_PER_CACHE <= max_bytes
+
+
+def freeze(slab):
+    """ Cached slabs are shared by every request, make writing to one fail loudly """
+    if isinstance(slab, np.ndarray):
+        slab.flags.writeable = False
+        mask = np.ma.getmask(slab)
+        if mask is not np.ma.nomask:
+            mask.flags.writeable = False
+    return slab
+
+
+def read(key, variable, prefix=(), index=Ellipsis, partial=None, slabs=None):
+    """
+    ``variable[prefix + index]``, where ``prefix`` is the time (and depth) index
+    of a slab and ``index`` the index of the values in it. From the cached slab
+    at ``key`` or else read whole and cached. Slabs too large to cache are read
+    with ``partial()`` when given (a read of just the values asked for).
+
+    The result belongs to the caller, slabs are never handed out.
+    """
+    slabs = cache if slabs is None else slabs
+    prefix = tuple(prefix)
+    index = index if isinstance(index, tuple) else (index,)
+
+    slab = slabs.get(key)
+    if slab is None:
+        if not fits(variable, prefix, slabs.max_bytes):
+            return partial() if partial is not None else variable[prefix + index]
+        slab = slabs.set(key, freeze(variable[prefix + (Ellipsis,)]))
+
+    data = slab[index]
+    if isinstance(data, np.ndarray) and np.may_share_memory(data, slab):
+        data = data.copy()
+    return data
+
+
+def preload(key, variable, prefix=(), slabs=None):
+    """ Read a slab into the cache ahead of its use. False if it is too large to cache """
+    slabs = cache if slabs is None else slabs
+    if slabs.get(key) is not None:
+        return True
+    if not fits(variable, tuple(prefix), slabs.max_bytes):
+        return False
+    slabs.set(key, freeze(variable[tuple(prefix) + (Ellipsis,)]))
+    return True
+
+
+def get(key, slabs=None):
+    """ The cached slab at ``key``, read only, or None """
+    slabs = cache if slabs is None else slabs
+    return slabs.get(key)
+
+
+def dump(f, slab):
+    """ Write a slab as its data and, when it has one, its mask in the .npy format """
+    np.lib.format.write_array(f, np.ma.getdata(slab), version=(1, 0))
+    mask = np.ma.getmask(slab)
+    if mask is not np.ma.nomask:
+        np.lib.format.write_array(f, mask, version=(1, 0))
+
+
+def load(filename):
+    """ The slab in a file written by dump(), memory mapped read only """
+    arrays = []
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        while f.tell() < size:
+            version = np.lib.format.read_magic(f)
+            if version != (1, 0):
+                raise ValueError('Unexpected .npy version {}'.format(version))
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            offset = f.tell()
+            count = int(np.prod(shape, dtype=np.int64))
+            if count:
+                arrays.append(np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=shape,
+                                        order='F' if fortran else 'C'))
+            else:
+                arrays.append(freeze(np.empty(shape, dtype=dtype)))
+            f.seek(offset + count * dtype.itemsize)
+
+    if len(arrays) == 1:
+        return arrays[0]
+    data, mask = arrays
+    return np.ma.masked_array(data, mask=mask, copy=False)
+
+
+class SlabStore(TileCache):
+    """ Slabs stored as memory mapped files, one directory per dataset, evicted like the tile cache """
+
+    def get_slab(self, dataset, key):
+        filename = self.filename(dataset, key)
+        try:
+            slab = load(filename)
+            # The modification time is the last use, for eviction
+            os.utime(filename)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return slab
+
+    def set_slab(self, dataset, key, slab):
+        self.write(dataset, key, lambda f: dump(f, slab))
+
+
+class SharedSlabs(object):
+    """ The slabs of a dataset in the store, looked up like the per-worker cache """
+
+    def __init__(self, store, dataset):
+        self.store = store
+        self.dataset = dataset
+
+    @property
+    def max_bytes(self):
+        return self.store.max_bytes
+
+    def digest(self, key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self.store.get_slab(self.dataset, self.digest(key))
+
+    def set(self, key, slab):
+        self.store.set_slab(self.dataset, self.digest(key), slab)
+        # The mapped copy, so the one read here is not kept
+        shared = self.get(key)
+        return slab if shared is None else shared
+
+
+def dataset_slabs(dataset):
+    """ The slabs of a dataset, in the store when it is enabled or else in the worker's cache """
+    if store.enabled:
+        return SharedSlabs(store, dataset)
+    return cache
+
+
+cache = LRUCache(max_bytes=settings.SLAB_CACHE_MAX_BYTES)
+
+store = SlabStore(settings.SLAB_STORE_PATH, settings.SLAB_STORE_MAX_BYTES)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+import netCDF4
+
+from ..aggregation import LazyAggregation, file_index, registry
+from ..handles import HandlePool, open_dataset
+
+
+def write(path, times):
+    tmp = '{}.tmp'.format(path)
+    with netCDF4.Dataset(tmp, 'w', format='NETCDF4_CLASSIC') as nc:
+        nc.title = 'aggregation'
+        nc.createDimension('time', None)
+        nc.createDimension('node', 4)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = 'hours since 2018-01-01'
+        time.standard_name = 'time'
+        time[:] = times
+        temp = nc.createVariable('temp', 'f4', ('time', 'node'))
+        temp.standard_name = 'sea_water_temperature'
+        temp[:] = np.asarray(times)[:, None] * 10 + np.arange(4)
+        depth = nc.createVariable('depth', 'f4', ('node',))
+        depth[:] = np.arange(4) * 2
+    os.replace(tmp, path)
+
+
+class TestLazyAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        # Files of 2, 3 and 1 times
+        for i, times in enumerate([(0, 1), (2, 3, 4), (5,)]):
+            write(os.path.join(self.path, 'agg_{}.nc'.format(i)), times)
+
+        self.opened = []
+
+        def opener(path):
+            self.opened.append(path)
+            return open_dataset(path)
+        self.pool = HandlePool(opener=opener)
+
+        full = open_dataset(os.path.join(self.path, 'agg_*.nc'))
+        try:
+            self.files = file_index(full)
+            self.expected = full.variables['temp'][:]
+        finally:
+            full.close()
+
+    def tearDown(self):
+        self.pool.clear()
+        shutil.rmtree(self.path)
+
+    def aggregation(self):
+        return LazyAggregation(self.files, pool=self.pool)
+
+    def test_file_index(self):
+        assert [ os.path.basename(f) for f, _ in self.files ] == ['agg_0.nc', 'agg_1.nc', 'agg_2.nc']
+        assert [ n for _, n in self.files ] == [2, 3, 1]
+
+    def test_not_an_aggregation(self):
+        single = open_dataset(os.path.join(self.path, 'agg_0.nc'))
+        try:
+            assert file_index(single) is None
+        finally:
+            single.close()
+
+    def test_opens_one_file(self):
+        with self.aggregation() as nc:
+            npt.assert_array_equal(nc.variables['temp'][3, :], self.expected[3, :])
+            npt.assert_array_equal(nc.variables['temp'][-1, 1:3], self.expected[-1, 1:3])
+        # The first file and the files holding time 3 and the last time
+        assert len(self.opened) == 3
+        assert self.pool.stats['idle'] == 3
+
+    def test_metadata(self):
+        with self.aggregation() as nc:
+            assert self.opened == [self.files[0][0]]
+            assert nc.title == 'aggregation'
+            assert nc.variables['temp'].shape == (6, 4)
+            assert len(nc.variables['time']) == 6
+            npt.assert_array_equal(nc.variables['depth'][:], np.arange(4) * 2)
+            names = [ v.name for v in nc.get_variables_by_attributes(standard_name='time') ]
+            assert names == ['time']
+            assert len(nc.get_variables_by_attributes(standard_name='time')[0]) == 6
+        assert len(self.opened) == 1
+
+    def test_spans(self):
+        with self.aggregation() as nc:
+            temp = nc.variables['temp']
+            npt.assert_array_equal(temp[:], self.expected)
+            npt.assert_array_equal(temp[1:5, 2], self.expected[1:5, 2])
+            npt.assert_array_equal(temp[::2, ...], self.expected[::2, ...])
+            npt.assert_array_equal(temp[[0, 4, 5], 0], self.expected[[0, 4, 5], 0])
+            npt.assert_array_equal(nc.variables['time'][:], np.arange(6))
+            assert temp[4:2].shape == (0, 4)
+
+    def test_out_of_bounds(self):
+        with self.aggregation() as nc:
+            with self.assertRaises(IndexError):
+                nc.variables['temp'][6]
+
+    def test_reuses_handles(self):
+        with self.aggregation() as nc:
+            nc.variables['temp'][3]
+        with self.aggregation() as nc:
+            nc.variables['temp'][4]
+        assert len(self.opened) == 2
+        assert self.pool.stats['hits'] == 2
+
+    def test_missing_first_file(self):
+        os.remove(self.files[0][0])
+        with self.aggregation() as nc:
+            assert nc.master is None
+
+    def test_changed_file(self):
+        write(self.files[1][0], (2, 3))
+        with self.aggregation() as nc:
+            with self.assertRaises(ValueError):
+                nc.variables['temp'][2]
+
+    def test_grown_file(self):
+        # The last file of a forecast grew since the index was built
+        write(self.files[2][0], (5, 6))
+        whole = []
+
+        def fallback():
+            whole.append(1)
+            return self.pool.checkout(os.path.join(self.path, 'agg_*.nc'))
+
+        with LazyAggregation(self.files, pool=self.pool, fallback=fallback) as nc:
+            temp = nc.variables['temp']
+            npt.assert_array_equal(temp[1], self.expected[1])
+            npt.assert_array_equal(temp[5], self.expected[5])
+            assert nc.stale
+            # Later reads go to the whole aggregation too
+            npt.assert_array_equal(temp[0:2, 1], self.expected[0:2, 1])
+            npt.assert_array_equal(nc.variables['time'][:], np.arange(7))
+        assert whole == [1]
+
+
+    def test_removed_file(self):
+        # The middle file was removed from the glob since the index was built
+        os.remove(self.files[1][0])
+        glob_path = os.path.join(self.path, 'agg_*.nc')
+        with LazyAggregation(self.files, pool=self.pool, fallback=lambda: self.pool.checkout(glob_path)) as nc:
+            temp = nc.variables['temp']
+            npt.assert_array_equal(temp[1], self.expected[1])
+            # Read from what is left of the glob
+            npt.assert_array_equal(temp[2], self.expected[5])
+            assert nc.stale
+        with self.aggregation() as nc:
+            with self.assertRaises(ValueError):
+                nc.variables['temp'][3]
+
+
+class TestFileIndexRegistry(unittest.TestCase):
+
+    def tearDown(self):
+        registry.clear()
+
+    def test_versioned(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return [('agg_0.nc', 2)]
+        assert registry.get('a.npy', 1, load) == [('agg_0.nc', 2)]
+        registry.get('a.npy', 1, load)
+        assert len(loads) == 1
+        registry.get('a.npy', 2, load)
+        assert len(loads) == 2
+        registry.invalidate('a.npy')
+        registry.get('a.npy', 2, load)
+        assert len(loads) == 3
+
+    def test_discard(self):
+        registry.get('a.npy', 1, lambda: [('agg_0.nc', 2)])
+        registry.discard('a.npy', 1)
+        # No index until the time cache changes
+        assert registry.get('a.npy', 1, lambda: [('agg_0.nc', 2)]) is None
+        assert registry.get('a.npy', 2, lambda: [('agg_0.nc', 3)]) == [('agg_0.nc', 3)]
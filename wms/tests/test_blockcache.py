@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import netCDF4
+
+from .. import blockcache
+from ..blockcache import BlockCache, CachedDataset, block_shape, basic_bounds
+
+
+class Variable(object):
+    """ An array that counts the reads, like a remote variable would cost them """
+
+    def __init__(self, data, name='temp'):
+        self.data = data
+        self.name = name
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return np.ma.asarray(self.data[key])
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """ Serves the files of ``root`` with HTTP range requests, like a remote server (``#mode=bytes``) """
+
+    root = None
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def content(self):
+        with open(os.path.join(self.root, self.path.lstrip('/')), 'rb') as f:
+            return f.read()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.content())))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+    def do_GET(self):
+        self.requests.append(self.headers.get('Range'))
+        content = self.content()
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            stop = int(match.group(2) or len(content) - 1) + 1
+            body = content[start:stop]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, start + len(body) - 1, len(content)))
+        else:
+            body = content
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestBlocks(unittest.TestCase):
+
+    def test_block_shape(self):
+        # The trailing axes are split first, one time step per block
+        assert block_shape((24, 1000000), 4, nbytes=1024 * 1024) == (1, 262144)
+        assert block_shape((24, 1000, 1000), 4, nbytes=1024 * 1024) == (1, 262, 1000)
+        assert block_shape((10,), 8, nbytes=1024 * 1024) == (10,)
+
+    def test_basic_bounds(self):
+        shape = (4, 10, 20)
+        assert basic_bounds((1, slice(2, 5)), shape) == ([(1, 2), (2, 5), (0, 20)], [0])
+        assert basic_bounds((-1, Ellipsis, 3), shape) == ([(3, 4), (0, 10), (3, 4)], [0, 2])
+        assert basic_bounds(slice(None), shape) == ([(0, 4), (0, 10), (0, 20)], [])
+        # Fancy, strided and empty reads are not cached
+        assert basic_bounds((1, [2, 3]), shape) is None
+        assert basic_bounds((1, slice(0, 10, 2)), shape) is None
+        assert basic_bounds((1, slice(5, 5)), shape) is None
+
+
+class TestCachedVariable(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = BlockCache(self.path, max_bytes=10 ** 8)
+        self.data = np.ma.masked_greater(np.arange(100 * 300.).reshape(100, 300), 1190)
+        self.variable = Variable(self.data)
+        self.nc = CachedDataset(self, 'ds', 'http://example.com/dodsC/model', block_cache=self.cache)
+        self.default = blockcache.BLOCK_BYTES
+        blockcache.BLOCK_BYTES = 100 * 8
+
+    def tearDown(self):
+        blockcache.BLOCK_BYTES = self.default
+        shutil.rmtree(self.path)
+
+    @property
+    def variables(self):
+        return dict(temp=self.variable)
+
+    def test_read_through(self):
+        var = self.nc.variables['temp']
+        for key in [(1, slice(20, 150)), (3, slice(None)), (slice(1, 3), slice(95, 105)), (2, 7)]:
+            np.testing.assert_array_equal(var[key], self.data[key])
+        values = var[3, slice(150, 300)]
+        np.testing.assert_array_equal(np.ma.getmaskarray(values), np.ma.getmaskarray(self.data[3, 150:300]))
+
+    def test_cached(self):
+        var = self.nc.variables['temp']
+        var[1, 20:150]
+        assert len(self.variable.reads) == 1
+        # Covered by the blocks read before
+        np.testing.assert_array_equal(var[1, 0:200], self.data[1, 0:200])
+        np.testing.assert_array_equal(var[1, 110:120], self.data[1, 110:120])
+        assert len(self.variable.reads) == 1
+        # Only the missing block is read
+        var[1, 150:250]
+        assert self.variable.reads[-1] == (slice(1, 2), slice(200, 300))
+
+    def test_not_cached(self):
+        var = self.nc.variables['temp']
+        # A time series at a point (a block per time step), fancy indexes
+        var[:, 5]
+        var[1, [3, 4]]
+        assert self.variable.reads == [(slice(None), 5), (1, [3, 4])]
+        assert not list(self.cache.files())
+
+    def test_clear(self):
+        var = self.nc.variables['temp']
+        var[1, :]
+        self.cache.clear('ds')
+        var[1, :]
+        assert len(self.variable.reads) == 2
+
+
+class TestRemoteDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with netCDF4.Dataset(os.path.join(self.path, 'model.nc'), 'w', format='NETCDF3_CLASSIC') as nc:
+            nc.createDimension('time', 2)
+            nc.createDimension('node', 5000)
+            temp = nc.createVariable('temp', 'f4', ('time', 'node'))
+            temp[:] = np.arange(10000.).reshape(2, 5000)
+
+        RangeHandler.root = self.path
+        RangeHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.uri = 'http://127.0.0.1:{}/model.nc#mode=bytes'.format(self.server.server_address[1])
+        self.cache = BlockCache(os.path.join(self.path, 'blocks'), max_bytes=10 ** 8)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def test_remote(self):
+        try:
+            remote = netCDF4.Dataset(self.uri)
+        except OSError:
+            self.skipTest('netCDF4 is built without byte range support')
+
+        with remote:
+            nc = CachedDataset(remote, 'model', self.uri, block_cache=self.cache)
+            np.testing.assert_array_equal(nc.variables['temp'][1, 1000:4000], np.arange(6000., 9000.))
+            downloads = len(RangeHandler.requests)
+            np.testing.assert_array_equal(nc.variables['temp'][1, 1500:2500], np.arange(6500., 7500.))
+            assert len(RangeHandler.requests) == downloads
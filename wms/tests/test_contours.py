@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+import matplotlib.tri as Tri
+
+from ..contours import contour_set, contour_response, cached, contour_sets, request_key
+from ..mpl_handler import contouring_response
+from .test_png import decode
+from ..utils import DotDict
+
+
+def request(image_type='filledcontours', bbox=(0, 0, 10, 10), cmin=0, cmax=2, numcontours=5):
+    return DotDict(GET={
+        'bbox': DotDict(minx=bbox[0], miny=bbox[1], maxx=bbox[2], maxy=bbox[3]),
+        'width': 64,
+        'height': 64,
+        'crs': 'EPSG:3857',
+        'colormap': 'jet',
+        'colorscalerange': DotDict(min=cmin, max=cmax),
+        'image_type': image_type,
+        'numcontours': numcontours,
+        'logscale': False,
+    })
+
+
+class TestContourSet(unittest.TestCase):
+
+    def setUp(self):
+        self.x, self.y = np.meshgrid(np.linspace(0, 10, 41), np.linspace(0, 10, 41))
+        # Two bumps, far apart
+        self.data = np.exp(-((self.x - 2) ** 2 + (self.y - 2) ** 2)) + np.exp(-((self.x - 8) ** 2 + (self.y - 8) ** 2))
+
+    def test_levels(self):
+        cs = contour_set(self.x, self.y, self.data, request())
+        np.testing.assert_allclose(cs.levels, np.linspace(0, 2, 5))
+        assert cs.filled
+        assert len(cs.paths) == len(cs.values) == 4
+        assert cs.nbytes > 0
+
+        lines = contour_set(self.x, self.y, self.data, request('contours'))
+        assert not lines.filled
+        assert len(lines.paths) == 5
+
+    def test_visible(self):
+        cs = contour_set(self.x, self.y, self.data, request('contours'))
+        everything = sum(len(paths) for paths in cs.visible(DotDict(minx=0, miny=0, maxx=10, maxy=10)))
+        corner = sum(len(paths) for paths in cs.visible(DotDict(minx=0, miny=0, maxx=4, maxy=4)))
+        nothing = sum(len(paths) for paths in cs.visible(DotDict(minx=20, miny=20, maxx=30, maxy=30)))
+        assert everything > corner > 0
+        assert nothing == 0
+
+    def test_matches_matplotlib(self):
+        for image_type in ('filledcontours', 'contours', 'filledhatches', 'hatches'):
+            for bbox in ((0, 0, 10, 10), (1, 1, 4, 4)):
+                r = request(image_type, bbox=bbox)
+                old = decode(contouring_response(self.x, self.y, self.data.copy(), r, projected=(self.x, self.y)).content)[0]
+                new = decode(contour_response(contour_set(self.x, self.y, self.data, r), r).content)[0]
+                np.testing.assert_array_equal(new, old)
+
+    def test_triangles_with_nan(self):
+        tri = Tri.Triangulation(self.x.ravel(), self.y.ravel())
+        data = self.data.ravel().copy()
+        data[:50] = np.nan
+        cs = contour_set(self.x.ravel(), self.y.ravel(), data, request(), triangles=tri.triangles)
+        assert sum(len(paths) for paths in cs.paths) > 0
+
+    def test_cached(self):
+        topo = DotDict(key='mesh', version=1)
+        built = []
+
+        def build():
+            built.append(1)
+            return contour_set(self.x, self.y, self.data, request())
+
+        key = ('temp', 0, None) + request_key(request())
+        first = cached(topo, key, build)
+        assert cached(topo, key, build) is first
+        assert len(built) == 1
+        # Filled styles share the geometry, lines don't
+        assert request_key(request('filledhatches')) == request_key(request())
+        assert request_key(request('contours')) != request_key(request())
+        contour_sets.clear()
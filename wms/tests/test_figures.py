@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import io
+import threading
+import unittest
+
+import numpy as np
+
+from ..figures import FigurePool
+
+
+def draw(pool, data, size=(64, 32)):
+    with pool.figure(size[0], size[1], 80.) as (fig, ax):
+        ax.pcolormesh(data)
+        ax.set_xlim(0, data.shape[1])
+        ax.set_ylim(0, data.shape[0])
+        buf = io.BytesIO()
+        fig.canvas.print_png(buf)
+        return fig, buf.getvalue()
+
+
+class TestFigurePool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FigurePool(max_figures=2)
+        self.data = np.arange(12.).reshape(3, 4)
+
+    def test_reused(self):
+        fig, _ = draw(self.pool, self.data)
+        again, _ = draw(self.pool, self.data)
+        assert again is fig
+        other, _ = draw(self.pool, self.data, size=(32, 32))
+        assert other is not fig
+        w, h = other.canvas.get_width_height()
+        assert (w, h) == (32, 32)
+
+    def test_cleared(self):
+        fig, first = draw(self.pool, self.data)
+        with self.pool.figure(64, 32, 80.) as (again, ax):
+            assert again is fig
+            assert not ax.collections
+        # The same image as on a new figure
+        _, second = draw(self.pool, self.data)
+        _, fresh = draw(FigurePool(), self.data)
+        assert first == second == fresh
+
+    def test_failed_not_reused(self):
+        with self.assertRaises(ValueError):
+            with self.pool.figure(64, 32, 80.) as (fig, ax):
+                raise ValueError()
+        with self.pool.figure(64, 32, 80.) as (again, ax):
+            assert again is not fig
+
+    def test_bounded(self):
+        figs = [draw(self.pool, self.data, size=(s, s))[0] for s in (8, 16, 32)]
+        # The least recently used size was dropped
+        assert draw(self.pool, self.data, size=(8, 8))[0] is not figs[0]
+        assert draw(self.pool, self.data, size=(32, 32))[0] is figs[2]
+
+    def test_per_thread(self):
+        fig, _ = draw(self.pool, self.data)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(draw(self.pool, self.data)[0]))
+        thread.start()
+        thread.join()
+        assert other[0] is not fig
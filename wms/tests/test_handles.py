@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import netCDF4
+
+from ..handles import HandlePool, open_dataset, open_files, path_version
+
+
+def write(path, times=(0, 1)):
+    # Written aside and moved into place, like a model run replacing its output
+    tmp = '{}.tmp'.format(path)
+    with netCDF4.Dataset(tmp, 'w', format='NETCDF4_CLASSIC') as nc:
+        nc.createDimension('time', None)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = 'hours since 2018-01-01'
+        time[:] = times
+        temp = nc.createVariable('temp', 'f4', ('time',))
+        temp[:] = np.arange(len(times))
+    os.replace(tmp, path)
+
+
+class TestHandlePool(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.single = os.path.join(self.path, 'single.nc')
+        write(self.single)
+        for i in range(3):
+            write(os.path.join(self.path, 'agg_{}.nc'.format(i)), times=(2 * i, 2 * i + 1))
+        self.aggregation = os.path.join(self.path, 'agg_*.nc')
+
+        self.opened = []
+
+        def opener(path):
+            nc = open_dataset(path)
+            self.opened.append(nc)
+            return nc
+        self.pool = HandlePool(max_files=4, opener=opener)
+
+    def tearDown(self):
+        self.pool.clear()
+        shutil.rmtree(self.path)
+
+    def test_reused(self):
+        with self.pool.checkout(self.single) as nc:
+            first = nc
+        with self.pool.checkout(self.single) as nc:
+            assert nc is first
+            assert nc.variables['temp'][1] == 1
+        assert len(self.opened) == 1
+        assert self.pool.stats['hits'] == 1
+
+    def test_one_request_at_a_time(self):
+        with self.pool.checkout(self.single) as first:
+            with self.pool.checkout(self.single) as second:
+                assert second is not first
+        assert len(self.opened) == 2
+        assert self.pool.stats['idle'] == 2
+
+    def test_aggregation(self):
+        with self.pool.checkout(self.aggregation) as nc:
+            np.testing.assert_array_equal(nc.variables['time'][:], np.arange(6))
+            assert open_files(nc) == 3
+        assert self.pool.files == 3
+
+    def test_max_files(self):
+        with self.pool.checkout(self.aggregation):
+            pass
+        with self.pool.checkout(self.single) as nc:
+            single = nc
+        # 4 files are open, another file closes the least recently used handle
+        other = os.path.join(self.path, 'other.nc')
+        write(other)
+        with self.pool.checkout(other):
+            pass
+        assert self.pool.files == 2
+        with self.pool.checkout(self.single) as nc:
+            assert nc is single
+        assert len(self.opened) == 3
+
+    def test_reopened_when_changed(self):
+        with self.pool.checkout(self.single, path_version(self.single)) as nc:
+            first = nc
+        write(self.single, times=(0, 1, 2))
+        os.utime(self.single, ns=(0, 0))
+        with self.pool.checkout(self.single, path_version(self.single)) as nc:
+            assert nc is not first
+            assert len(nc.variables['time']) == 3
+        assert not first.isopen()
+        assert self.pool.files == 1
+
+    def test_invalidate(self):
+        with self.pool.checkout(self.single) as nc:
+            first = nc
+        self.pool.invalidate(self.single)
+        assert not first.isopen()
+        with self.pool.checkout(self.single) as nc:
+            assert nc is not first
+
+    def test_missing(self):
+        with self.pool.checkout(os.path.join(self.path, 'missing.nc')) as nc:
+            assert nc is None
+        assert self.pool.files == 0
+
+    def test_failed_reads_close(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.checkout(self.single) as nc:
+                first = nc
+                raise RuntimeError('NetCDF: DAP failure')
+        assert not first.isopen()
+        assert self.pool.files == 0
+
+    def test_unsupported_keeps_handle(self):
+        with self.assertRaises(NotImplementedError):
+            with self.pool.checkout(self.single) as nc:
+                first = nc
+                raise NotImplementedError('No vectors for this dataset')
+        assert first.isopen()
+        with self.pool.checkout(self.single) as nc:
+            assert nc is first
+
+    def test_version_interval(self):
+        self.pool.version_interval = 3600
+        before = self.pool.path_version(self.aggregation)
+        write(os.path.join(self.path, 'agg_3.nc'))
+        # The files are not looked at again until the interval is over or the path is invalidated
+        assert self.pool.path_version(self.aggregation) == before
+        self.pool.invalidate(self.aggregation)
+        assert len(self.pool.path_version(self.aggregation)) == 4
+
+
+class TestPathVersion(unittest.TestCase):
+
+    def test_remote(self):
+        assert path_version('http://example.com/thredds/dodsC/model.nc') is None
+
+    def test_files(self):
+        path = tempfile.mkdtemp()
+        try:
+            write(os.path.join(path, 'agg_0.nc'))
+            pattern = os.path.join(path, 'agg_*.nc')
+            before = path_version(pattern)
+            assert len(before) == 1
+            # A new file in the aggregation
+            write(os.path.join(path, 'agg_1.nc'))
+            assert path_version(pattern) != before
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+
+from ..lru import LRUCache, sizeof
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        # Room for two 80 byte arrays
+        self.cache = LRUCache(max_bytes=200)
+
+    def test_get_set(self):
+        a = np.zeros(10)
+        self.cache.set('a', a)
+        self.assertIs(self.cache.get('a'), a)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+
+    def test_evicts_by_bytes(self):
+        self.cache.set('a', np.zeros(10))
+        self.cache.set('b', np.zeros(10))
+        self.cache.get('a')  # 'b' is now the least recently used
+        self.cache.set('c', np.zeros(10))
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+        self.assertEqual(self.cache.nbytes, 160)
+
+    def test_too_large(self):
+        self.cache.set('a', np.zeros(100))
+        self.assertNotIn('a', self.cache)
+        self.assertEqual(self.cache.nbytes, 0)
+
+    def test_replace_and_delete(self):
+        self.cache.set('a', np.zeros(10))
+        self.cache.set('a', np.zeros(5))
+        self.assertEqual(self.cache.nbytes, 40)
+        self.cache.delete_matching(lambda k: k == 'a')
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.nbytes, 0)
+
+    def test_sizeof(self):
+        self.assertEqual(sizeof((np.zeros(2), np.zeros(3))), 40)
+        self.assertEqual(sizeof({'x': np.zeros(4, dtype=np.int8)}), 4)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from .. import tilecache
+from ..tilecache import TileCache
+from ..metatile import tile_index, tile_bbox, metatile, render
+from ..data_handler import png_response, figure_response, blank_figure
+from ..raster import pixel_centers
+from ..utils import DotDict
+
+
+def tile_request(zoom, x, y, image_type='pcolor', size=256):
+    request = RequestFactory().get('/wms/datasets/ds/')
+    request.GET = dict(layers='temp', crs='EPSG:3857', bbox=tile_bbox(zoom, x, y), width=size, height=size,
+                       image_type=image_type, time=datetime(2018, 1, 1))
+    return request
+
+
+def draw(request):
+    """ An image that only depends on where each pixel is """
+    px, py = pixel_centers(request.GET['bbox'], request.GET['width'], request.GET['height'])
+    rgba = np.zeros(px.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = (px // 10000) % 256
+    rgba[..., 1] = (py // 10000) % 256
+    rgba[..., 3] = 255
+    return png_response(rgba)
+
+
+class TestTileIndex(unittest.TestCase):
+
+    def test_tile_index(self):
+        assert tile_index('EPSG:3857', tile_bbox(0, 0, 0), 256, 256) == (0, 0, 0)
+        assert tile_index('EPSG:3857', tile_bbox(12, 1205, 1539), 512, 512) == (12, 1205, 1539)
+
+    def test_not_a_tile(self):
+        bbox = tile_bbox(12, 1205, 1539)
+        assert tile_index('EPSG:4326', bbox, 256, 256) is None
+        assert tile_index('EPSG:3857', bbox, 256, 128) is None
+        assert tile_index('EPSG:3857', tile_bbox(12, 1205, 1539, nx=2), 256, 256) is None
+        shifted = DotDict(minx=bbox.minx + 100, miny=bbox.miny, maxx=bbox.maxx + 100, maxy=bbox.maxy)
+        assert tile_index('EPSG:3857', shifted, 256, 256) is None
+
+    def test_metatile(self):
+        assert metatile(tile_request(12, 1205, 1539), size=4) == (12, 1204, 1536, 4, 4)
+        # Smaller at the edge of the world
+        assert metatile(tile_request(1, 1, 0), size=4) == (1, 0, 0, 2, 2)
+        assert metatile(tile_request(0, 0, 0), size=4) is None
+        assert metatile(tile_request(12, 1205, 1539, image_type='vectors'), size=4) is None
+        assert metatile(tile_request(12, 1205, 1539), size=1) is None
+
+
+class TestRender(unittest.TestCase):
+
+    def test_render(self):
+        request = tile_request(12, 1205, 1539)
+        drawn = []
+
+        def render_view(view):
+            drawn.append(view)
+            return draw(view)
+
+        response, siblings = render(request, render_view, size=2)
+        assert len(drawn) == 1
+        assert drawn[0].GET['width'] == drawn[0].GET['height'] == 512
+        np.testing.assert_array_equal(response.pixels(), draw(request).pixels())
+
+        assert sorted(tile_index('EPSG:3857', r.GET['bbox'], 256, 256) for r, _ in siblings) == \
+            [(12, 1204, 1538), (12, 1204, 1539), (12, 1205, 1538)]
+        for sibling_request, sibling in siblings:
+            np.testing.assert_array_equal(sibling.pixels(), draw(sibling_request).pixels())
+            assert sibling_request.GET['wgs84_bbox'].minx < sibling_request.GET['wgs84_bbox'].maxx
+
+    def test_figure_pixels(self):
+        # The pixels of a figure are its own, not the buffer of the next figure drawn
+        fig = blank_figure(16, 16, dpi=8)
+        fig.set_facecolor('red')
+        red = figure_response(fig, None, tight=False)
+        fig.set_facecolor('blue')
+        blue = figure_response(fig, None, tight=False)
+        assert red.pixels()[0, 0, 0] > 200 and red.pixels()[0, 0, 2] == 0
+        assert blue.pixels()[0, 0, 2] > 200
+
+    def test_error(self):
+        request = tile_request(12, 1205, 1539)
+        error = DotDict(status_code=500)
+        assert render(request, lambda view: error, size=2) == (error, [])
+
+    def test_no_pixels(self):
+        # A PNG without pixels is decoded
+        request = tile_request(12, 1205, 1539)
+        response, siblings = render(request, lambda view: HttpResponse(draw(view).content, content_type='image/png'), size=2)
+        np.testing.assert_array_equal(response.pixels(), draw(request).pixels())
+        assert len(siblings) == 3
+        text = HttpResponse('text', content_type='text/plain')
+        assert render(request, lambda view: text, size=2) is None
+
+
+class TestCachedMetatile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.default = tilecache.cache
+        tilecache.cache = TileCache(self.path, max_bytes=10 ** 7)
+        self.dataset = DotDict(pk=1, slug='ds', cache_last_updated=None, update_task='',
+                               keep_up_to_date=False, update_every=3600)
+        self.drawn = []
+
+    def tearDown(self):
+        tilecache.cache = self.default
+        shutil.rmtree(self.path)
+
+    def respond(self, request):
+        def render_view(view):
+            self.drawn.append(view)
+            return draw(view)
+        return tilecache.cached_response(self.dataset, DotDict(pk=2), 'getmap', request, render_view)
+
+    def test_error_drawn_once(self):
+        def render_view(view):
+            self.drawn.append(view)
+            return HttpResponse('error', status=500)
+        response = tilecache.cached_response(self.dataset, DotDict(pk=2), 'getmap', tile_request(12, 1205, 1539), render_view)
+        assert response.status_code == 500
+        assert len(self.drawn) == 1
+
+    def test_siblings_cached(self):
+        first = self.respond(tile_request(12, 1205, 1539))
+        sibling = self.respond(tile_request(12, 1204, 1538))
+        assert len(self.drawn) == 1
+        assert first.status_code == sibling.status_code == 200
+        assert sibling.content == draw(tile_request(12, 1204, 1538)).content
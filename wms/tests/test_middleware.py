@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.test import SimpleTestCase, RequestFactory
+from django.http import HttpResponse
+
+from ..middleware import GZipMiddleware
+
+
+class TestGZipMiddleware(SimpleTestCase):
+
+    def process(self, content_type):
+        request = RequestFactory().get('/wms/', HTTP_ACCEPT_ENCODING='gzip')
+        response = HttpResponse(b'x' * 1000, content_type=content_type)
+        return GZipMiddleware().process_response(request, response)
+
+    def test_text_gzipped(self):
+        assert self.process('application/json')['Content-Encoding'] == 'gzip'
+
+    def test_images_untouched(self):
+        response = self.process('image/png')
+        assert not response.has_header('Content-Encoding')
+        assert response.content == b'x' * 1000
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import io
+import zlib
+import struct
+import unittest
+
+import numpy as np
+
+from ..png import encode, encode_rgba, encode_indexed, quantize
+
+
+def decode(data):
+    """
+    Just enough of a PNG reader for the unfiltered RGBA and indexed images
+    wms.png writes. Returns the (height, width, 4) RGBA pixels and the color type.
+    """
+    buf = io.BytesIO(data)
+    assert buf.read(8) == b'\x89PNG\r\n\x1a\n'
+    idat = b''
+    trns = b''
+    while True:
+        length, tag = struct.unpack('>I4s', buf.read(8))
+        chunk = buf.read(length)
+        buf.read(4)
+        if tag == b'IHDR':
+            width, height, _, color_type = struct.unpack('>IIBB', chunk[:10])
+        elif tag == b'PLTE':
+            plte = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, 3)
+        elif tag == b'tRNS':
+            trns = chunk
+        elif tag == b'IDAT':
+            idat += chunk
+        elif tag == b'IEND':
+            break
+
+    channels = 4 if color_type == 6 else 1
+    raw = np.frombuffer(zlib.decompress(idat), dtype=np.uint8).reshape(height, width * channels + 1)
+    assert not raw[:, 0].any()
+    if color_type == 6:
+        return raw[:, 1:].reshape(height, width, 4), color_type
+
+    palette = np.full((len(plte), 4), 255, dtype=np.uint8)
+    palette[:, :3] = plte
+    palette[:len(trns), 3] = np.frombuffer(trns, dtype=np.uint8)
+    return palette[raw[:, 1:]], color_type
+
+
+def image(colors, shape=(6, 5)):
+    rs = np.random.RandomState(0)
+    lut = rs.randint(0, 256, (colors, 4)).astype(np.uint8)
+    lut[:, 3] = 255
+    lut[0] = 0
+    return lut[rs.randint(0, colors, shape)]
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_rgba(self):
+        rgba = image(300, (20, 30))
+        np.testing.assert_array_equal(decode(encode_rgba(rgba))[0], rgba)
+
+    def test_quantize(self):
+        rgba = image(10)
+        indexes, palette = quantize(rgba)
+        np.testing.assert_array_equal(palette[indexes], rgba)
+        # Transparent first
+        np.testing.assert_array_equal(palette[0], 0)
+        assert (palette[1:, 3] == 255).all()
+        assert quantize(image(300, (20, 30))) is None
+
+    def test_indexed(self):
+        rgba = image(10)
+        decoded, color_type = decode(encode_indexed(*quantize(rgba)))
+        assert color_type == 3
+        np.testing.assert_array_equal(decoded, rgba)
+
+    def test_opaque_indexed(self):
+        rgba = image(10)
+        rgba[..., 3] = 255
+        data = encode_indexed(*quantize(rgba))
+        assert b'tRNS' not in data
+        np.testing.assert_array_equal(decode(data)[0], rgba)
+
+    def test_encode(self):
+        few = image(10)
+        many = image(300, (20, 30))
+        assert decode(encode(few))[1] == 3
+        assert decode(encode(few, palette=False))[1] == 6
+        assert decode(encode(many))[1] == 6
+        np.testing.assert_array_equal(decode(encode(many))[0], many)
+        assert len(encode(few, level=9)) <= len(encode(few, level=0))
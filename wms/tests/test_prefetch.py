@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from .. import prefetch
+from ..prefetch import Prefetcher
+from ..utils import DotDict
+from .test_tilecache import getmap
+
+
+class Axis(object):
+
+    def __init__(self, size=10):
+        self.values = np.arange(size, dtype=np.float64)
+        self.units = 'hours since 2018-01-01'
+        self.calendar = 'standard'
+
+    def nearest(self, time):
+        # The hour of the day is the index
+        return time.hour, time
+
+
+class Dataset(object):
+
+    pk = 1
+    horizontal_ndim = 1
+
+    def __init__(self):
+        self.axis = Axis()
+        self.prefetched = []
+
+    def time_axis(self, layer):
+        return self.axis
+
+    def layer_variables(self, layer):
+        return [ layer.access_name ]
+
+    def prefetch(self, layer, names, time_index, elevation):
+        self.prefetched.append((names, time_index, elevation))
+
+
+class TestPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.prefetcher = Prefetcher(steps=3, rate=float('inf'))
+        # Jobs are run by the tests, not a thread
+        self.prefetcher._start = lambda: None
+        self.dataset = Dataset()
+        self.layer = DotDict(pk=2, access_name='temp')
+
+    def request(self, hour, **params):
+        return getmap(time=datetime(2018, 1, 1, hour), elevation=0, image_type='filledcontours', **params)
+
+    def run_all(self):
+        while True:
+            job = self.prefetcher.next_job(block=False)
+            if job is None:
+                break
+            self.prefetcher.run(job)
+
+    def test_targets(self):
+        targets = self.prefetcher.targets
+        # A single request, the next time step
+        assert targets('s', 4, 10) == [5]
+        # Stepping forward, then backward by two
+        assert targets('s', 5, 10) == [6, 7, 8]
+        assert targets('s', 3, 10) == [1]
+        assert targets('s', 1, 10) == []
+        # A jump is not an animation
+        assert targets('s', 9, 10) == []
+        # Each stream has its own history
+        assert targets('t', 2, 10) == [3]
+
+    def test_watch(self):
+        self.prefetcher.watch(self.dataset, self.layer, self.request(2))
+        self.prefetcher.watch(self.dataset, self.layer, self.request(3))
+        self.run_all()
+        assert self.dataset.prefetched == [(['temp'], 3, 0), (['temp'], 4, 0), (['temp'], 5, 0), (['temp'], 6, 0)]
+        assert self.prefetcher.stats['done'] == 4
+
+    def test_queued_once(self):
+        # Tiles of the same view queue each time step once
+        for _ in range(4):
+            self.prefetcher.watch(self.dataset, self.layer, self.request(2))
+        self.run_all()
+        assert self.dataset.prefetched == [(['temp'], 3, 0)]
+
+    def test_queue_bounded(self):
+        for k in range(prefetch.MAX_QUEUE + 3):
+            self.prefetcher.submit(k, lambda: None)
+        assert self.prefetcher.stats['pending'] == prefetch.MAX_QUEUE
+        assert self.prefetcher.stats['dropped'] == 3
+
+    def test_waits_for_requests(self):
+        self.prefetcher.submit('a', lambda: None)
+        with self.prefetcher.foreground():
+            assert self.prefetcher.next_job(block=False) is None
+        job = self.prefetcher.next_job(block=False)
+        assert job is not None
+        assert self.prefetcher.running
+        self.prefetcher.run(job)
+        assert not self.prefetcher.running
+
+    def test_rate(self):
+        self.prefetcher.rate = 1
+        self.prefetcher.submit('a', lambda: None)
+        self.prefetcher.submit('b', lambda: None)
+        self.prefetcher.run(self.prefetcher.next_job(block=False))
+        # One a second
+        assert self.prefetcher.next_job(block=False) is None
+
+    def test_stale(self):
+        self.prefetcher.submit('a', lambda: None)
+        self.prefetcher.pending[0] = (time.monotonic() - prefetch.MAX_AGE - 1, self.prefetcher.pending[0][1])
+        assert self.prefetcher.next_job(block=False) is None
+        assert self.prefetcher.stats['dropped'] == 1
+
+    def test_failure(self):
+        self.prefetcher.submit('a', lambda: 1 / 0)
+        self.run_all()
+        assert self.prefetcher.stats['failed'] == 1
+        assert not self.prefetcher.running
+
+    def test_disabled(self):
+        self.prefetcher.steps = 0
+        self.prefetcher.watch(self.dataset, self.layer, self.request(2))
+        assert self.prefetcher.stats['pending'] == 0
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.tri  # noqa
+import matplotlib.figure  # noqa
+
+from ..raster import (QuadLocator, TriangleLocator, pixel_centers, colorize, colormap_lut, render,
+                      quad_lookup, triangle_lookup, cached_lookup, lookups, color_indexes, encode_colors)
+from ..png import encode_rgba
+from .test_png import decode
+from ..utils import DotDict
+
+
+def request(cmin=None, cmax=None, logscale=False, colormap='jet', width=4, height=4):
+    return DotDict(GET={
+        'bbox': DotDict(minx=0, miny=0, maxx=4, maxy=4),
+        'width': width,
+        'height': height,
+        'colormap': colormap,
+        'colorscalerange': DotDict(min=cmin, max=cmax),
+        'logscale': logscale,
+    })
+
+
+class TestQuadLocator(unittest.TestCase):
+
+    def setUp(self):
+        # Cell centers on integer coordinates, so cell (i, j) covers [j, j+1] x [i, i+1]
+        self.x, self.y = np.meshgrid(np.arange(5.), np.arange(5.))
+        self.locator = QuadLocator(self.x, self.y)
+
+    def test_pixel_centers(self):
+        px, py = pixel_centers(DotDict(minx=0, miny=0, maxx=4, maxy=2), 4, 2)
+        np.testing.assert_array_equal(px[0], [0.5, 1.5, 2.5, 3.5])
+        np.testing.assert_array_equal(py[:, 0], [1.5, 0.5])
+
+    def test_locate(self):
+        cells = self.locator.locate(np.array([0.5, 3.2, 1.9]), np.array([0.5, 2.7, 3.1]))
+        np.testing.assert_array_equal(cells, [0, 2 * 5 + 3, 3 * 5 + 1])
+
+    def test_window(self):
+        lookup = quad_lookup(self.locator, DotDict(minx=1.6, miny=0.6, maxx=3.4, maxy=2.4), 4, 4)
+        window = lookup.window(self.x.shape)
+        assert window == (slice(0, 3), slice(1, 4))
+        # The values of the cells read from the window only
+        data = np.arange(25.).reshape(5, 5)
+        rows, columns = np.unravel_index(lookup.cells, self.x.shape)
+        np.testing.assert_array_equal(lookup.gather(data[window][rows, columns - 1], cells=True),
+                                      lookup.gather(data))
+        assert quad_lookup(self.locator, DotDict(minx=10, miny=10, maxx=11, maxy=11), 4, 4).window(self.x.shape) is None
+
+    def test_outside(self):
+        cells = self.locator.locate(np.array([-1., 4.5, 2.]), np.array([2., 2., 10.]))
+        np.testing.assert_array_equal(cells, [-1, -1, -1])
+
+    def test_masked_coordinates(self):
+        x = np.ma.masked_where(self.x > 3, self.x)
+        cells = QuadLocator(x, self.y).locate(np.array([3.5, 2.5]), np.array([0.5, 0.5]))
+        np.testing.assert_array_equal(cells, [-1, 2])
+
+    def test_stretched_grid(self):
+        # Cell sizes growing 1.6x a step and sheared, so most points are nearer
+        # to the center of a smaller neighbour than to that of their own cell
+        spacing = np.cumsum(1.6 ** np.arange(10))
+        x, y = np.meshgrid(spacing, spacing / 3)
+        x = x + 0.4 * y
+        px, py = pixel_centers(DotDict(minx=-5, miny=-5, maxx=130, maxy=45), 160, 100)
+        cells = QuadLocator(x, y).locate(px, py)
+
+        # The cells pcolormesh draws for the same coordinates
+        figure = mpl.figure.Figure()
+        mesh = figure.add_subplot(111).pcolormesh(x, y, np.zeros((9, 9)), shading='flat')
+        expected = np.full(px.size, -1)
+        points = np.column_stack((px.ravel(), py.ravel()))
+        for i, path in enumerate(mesh.get_paths()):
+            row, col = np.divmod(i, 9)
+            expected[path.contains_points(points) & (expected < 0)] = row * 10 + col
+        np.testing.assert_array_equal(cells.ravel(), expected)
+        assert (expected >= 0).any() and (expected < 0).any()
+
+
+class TestColorize(unittest.TestCase):
+
+    def test_matches_colormap(self):
+        values = np.linspace(0, 10, 50)
+        norm = mpl.colors.Normalize(vmin=0, vmax=10)
+        expected = mpl.cm.get_cmap('jet', 256)(norm(values), bytes=True)
+        np.testing.assert_array_equal(colorize(values, norm, 'jet'), expected)
+
+    def test_transparent(self):
+        norm = mpl.colors.Normalize(vmin=0, vmax=1)
+        rgba = colorize(np.ma.masked_array([0.5, np.nan, 0.5], mask=[0, 0, 1]), norm, 'jet')
+        assert rgba[0, 3] == 255
+        np.testing.assert_array_equal(rgba[1:], 0)
+
+    def test_clipped(self):
+        norm = mpl.colors.LogNorm(vmin=1, vmax=10)
+        rgba = colorize(np.array([-5., 100.]), norm, 'jet', 1, 10)
+        np.testing.assert_array_equal(rgba, colormap_lut('jet')[[0, 255]])
+
+
+class TestRender(unittest.TestCase):
+
+    def test_render_png(self):
+        data = np.arange(25.).reshape(5, 5)
+        locator = QuadLocator(*np.meshgrid(np.arange(5.), np.arange(5.)))
+        lookup = quad_lookup(locator, DotDict(minx=0, miny=0, maxx=5, maxy=4), 5, 4)
+        rgba = render(lookup, data, request(cmin=0, cmax=24))
+
+        # Top row of the image is the last row of cells, the last column is outside of the grid
+        norm = mpl.colors.Normalize(vmin=0, vmax=24)
+        np.testing.assert_array_equal(rgba[0, :4], colorize(data[3, :4], norm, 'jet'))
+        np.testing.assert_array_equal(rgba[:, 4], 0)
+
+        np.testing.assert_array_equal(decode(encode_rgba(rgba))[0], rgba)
+
+    def test_encode_colors(self):
+        norm = mpl.colors.Normalize(vmin=0, vmax=1)
+        values = np.array([[0., 0.5, np.nan], [1., 0.25, 0.]])
+        idx, missing = color_indexes(values, norm)
+        rgba, color_type = decode(encode_colors(idx, missing, 'jet'))
+        assert color_type == 3
+        np.testing.assert_array_equal(rgba, colorize(values, norm, 'jet'))
+
+    def test_encode_all_colors(self):
+        # Every color of the colormap is used, none is left for transparent
+        values = np.append(np.linspace(0, 1, 256), np.nan).reshape(1, -1)
+        norm = mpl.colors.Normalize(vmin=0, vmax=1)
+        rgba, color_type = decode(encode_colors(*color_indexes(values, norm), colormap='jet'))
+        assert color_type == 6
+        np.testing.assert_array_equal(rgba, colorize(values, norm, 'jet'))
+
+
+class TestPixelLookup(unittest.TestCase):
+
+    def setUp(self):
+        # Two triangles splitting the square [0, 2] x [0, 2] along the y = x diagonal
+        self.x = np.array([0., 2., 2., 0., np.nan])
+        self.y = np.array([0., 0., 2., 2., np.nan])
+        self.locator = TriangleLocator(self.x, self.y, np.array([(0, 1, 2), (0, 2, 3)]))
+        self.bbox = DotDict(minx=0, miny=0, maxx=4, maxy=2)
+
+    def test_node_values(self):
+        lookup = triangle_lookup(self.locator, self.bbox, 4, 2)
+        values = lookup.gather(np.array([0., 3., 6., 9., 100.]))
+        # Pixel centers (0.5, 1.5) and (1.5, 0.5) are above and below the diagonal
+        np.testing.assert_allclose(values[0, 0], 5)
+        np.testing.assert_allclose(values[1, 1], 3)
+        assert np.isnan(values[:, 2:]).all()
+
+    def test_face_values(self):
+        # Pixel centers at x = 0.25, 0.75, ... none of them on the diagonal
+        lookup = triangle_lookup(self.locator, self.bbox, 8, 2, location='face')
+        values = lookup.gather(np.array([7., 3.]))
+        np.testing.assert_array_equal(values[:, :4], [(3, 3, 3, 7), (3, 7, 7, 7)])
+        assert np.isnan(values[:, 4:]).all()
+
+    def test_quad_faces(self):
+        # A masked fourth node makes the second face a triangle
+        faces = np.ma.masked_equal([(0, 1, 2, 3), (1, 5, 2, -1)], -1)
+        x = np.array([0., 2., 2., 0., np.nan, 4.])
+        y = np.array([0., 0., 2., 2., np.nan, 0.])
+        lookup = triangle_lookup(TriangleLocator(x, y, faces), self.bbox, 8, 2, location='face')
+        values = lookup.gather(np.array([1., 2.]))
+        np.testing.assert_array_equal(values[:, :4], 1)
+        np.testing.assert_array_equal(values[:, 4:6], [(2, np.nan), (2, 2)])
+
+    def test_matches_trifinder(self):
+        x, y = np.meshgrid(np.linspace(0, 10, 21), np.linspace(0, 10, 21))
+        rs = np.random.RandomState(0)
+        x = (x + rs.uniform(-0.2, 0.2, x.shape)).ravel()
+        y = (y + rs.uniform(-0.2, 0.2, y.shape)).ravel()
+        tri = mpl.tri.Triangulation(x, y)
+        px, py = rs.uniform(-1, 11, (2, 5000))
+        found = TriangleLocator(x, y, tri.triangles).locate(px, py)
+        np.testing.assert_array_equal(found, tri.get_trifinder()(px, py))
+
+    def test_bounded_search(self):
+        # A large triangle next to 20000 small ones: the points around the fine
+        # part are nearer than the large radius to thousands of small centers
+        x, y = [ a.ravel() for a in np.meshgrid(np.linspace(0, 1, 101), np.linspace(0, 1, 101)) ]
+        faces = mpl.tri.Triangulation(x, y).triangles
+        big = (100, 10200, x.size)
+        x = np.append(x, 40.)
+        y = np.append(y, 0.5)
+        locator = TriangleLocator(x, y, np.vstack((faces, big)))
+
+        ks = []
+
+        class Tree(object):
+            def __init__(self, tree):
+                self.tree = tree
+
+            def query(self, points, k, **kwargs):
+                ks.append(k)
+                return self.tree.query(points, k=k, **kwargs)
+        locator.classes = [ (cells, Tree(tree), r) for cells, tree, r in locator.classes ]
+
+        px, py = pixel_centers(DotDict(minx=-2, miny=-2, maxx=42, maxy=3), 220, 50)
+        found = locator.locate(px, py).reshape(px.shape)
+        assert max(ks) <= locator.candidates
+        # Inside of the large triangle, of a small one and outside of the mesh
+        assert found[25, 100] == len(faces)
+        assert 0 <= found[25, 11] < len(faces)
+        assert found[0, 10] == found[12, 5] == found[40, 100] == -1
+
+    def test_cells(self):
+        lookup = triangle_lookup(self.locator, self.bbox, 8, 2, location='face')
+        np.testing.assert_array_equal(lookup.cells, [0, 1])
+        lookup = triangle_lookup(self.locator, self.bbox, 4, 2)
+        np.testing.assert_array_equal(lookup.cells, [0, 1, 2, 3])
+        # Gathered from the values of the cells only
+        data = np.array([0., 3., 6., 9., 100.])
+        np.testing.assert_array_equal(lookup.gather(data[lookup.cells], cells=True), lookup.gather(data))
+
+        outside = triangle_lookup(self.locator, DotDict(minx=5, miny=5, maxx=6, maxy=6), 4, 2)
+        assert outside.cells.size == 0
+        assert np.isnan(outside.gather(np.array([]), cells=True)).all()
+
+    def test_nan_data(self):
+        lookup = triangle_lookup(self.locator, self.bbox, 4, 2)
+        values = lookup.gather(np.ma.masked_array([0., 3., 6., 9., 0.], mask=[0, 0, 0, 1, 0]))
+        assert np.isnan(values[0, 0])
+        np.testing.assert_allclose(values[1, 1], 3)
+
+    def test_cached(self):
+        topo = DotDict(key=('ugrid', 'test.nc', None), version=1)
+        built = []
+
+        def build():
+            built.append(1)
+            return triangle_lookup(self.locator, self.bbox, 4, 2)
+
+        first = cached_lookup(topo, ('node', 'EPSG:3857'), build)
+        assert cached_lookup(topo, ('node', 'EPSG:3857'), build) is first
+        topo.version = 2
+        assert cached_lookup(topo, ('node', 'EPSG:3857'), build) is not first
+        assert len(built) == 2
+        lookups.clear()
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 from copy import copy
+from unittest import mock
 
 import pandas as pd
 
 from django.test import TestCase
 from wms.tests import add_server, add_group, add_user, add_dataset, image_path
 from wms.models import Dataset, SGridDataset
+from wms.utils import DotDict
 
 from wms import logger  # noqa
 
@@ -209,3 +211,16 @@ class TestSgrid(TestCase):
         self.assertTrue(d.has_cache())
         d.clear_cache()
         self.assertFalse(d.has_cache())
+
+    def test_gfi_locator(self):
+        # The in-memory KD-tree finds the same cell as the RTree on disk
+        d = Dataset.objects.get(name=self.dataset_slug)
+        layer = d.layer_set.get(var_name='u')
+        times = d.times(layer)
+        request = DotDict(GET=dict(longitude=-72.4252, latitude=40.4118, starting=times[0], ending=times[0]))
+        resident = d.setup_getfeatureinfo(layer, request)
+        with mock.patch.object(SGridDataset, 'point_locator', return_value=None):
+            on_disk = d.setup_getfeatureinfo(layer, request)
+        assert resident[:3] == on_disk[:3]
+        # The (i, j) of the cell
+        assert len(resident[0]) == 2
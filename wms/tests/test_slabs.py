@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from .. import slabs
+from ..lru import LRUCache
+from ..slabs import SharedSlabs, SlabStore, dump, load
+from .test_blockcache import Variable
+
+
+class TestSlabs(unittest.TestCase):
+
+    def setUp(self):
+        # (time, z, node)
+        self.data = np.ma.masked_greater(np.arange(2 * 3 * 100, dtype=np.float32).reshape(2, 3, 100), 550)
+        self.variable = Variable(self.data)
+        self.cache = LRUCache(max_bytes=10 * 1024 * 1024)
+
+    def read(self, prefix, index=Ellipsis, **kwargs):
+        key = ('model.nc', self.variable.name) + tuple(prefix)
+        return slabs.read(key, self.variable, prefix, index, slabs=self.cache, **kwargs)
+
+    def test_read_once(self):
+        cells = np.array([3, 50, 99])
+        npt.assert_array_equal(self.read((1, 2), cells), self.data[1, 2, cells])
+        mask = np.zeros(100, dtype=bool)
+        mask[10:20] = True
+        npt.assert_array_equal(self.read((1, 2), mask), self.data[1, 2, mask])
+        npt.assert_array_equal(self.read((1, 2)), self.data[1, 2])
+        # The slab was read whole once, then indexed in memory
+        assert self.variable.reads == [(1, 2, Ellipsis)]
+        assert self.cache.stats['hits'] == 2
+
+    def test_keyed_by_time_and_z(self):
+        self.read((0, 0), np.array([1]))
+        self.read((0, 1), np.array([1]))
+        self.read((1, 1), np.array([1]))
+        assert len(self.variable.reads) == 3
+        assert len(self.cache) == 3
+
+    def test_mask(self):
+        data = self.read((1, 2), np.array([0, 99]))
+        assert data.mask.tolist() == [False, True]
+
+    def test_caller_owns_results(self):
+        data = self.read((0, 0))
+        data[:] = -1
+        npt.assert_array_equal(self.read((0, 0)), self.data[0, 0])
+        slab = slabs.get(('model.nc', 'temp', 0, 0), slabs=self.cache)
+        with self.assertRaises(ValueError):
+            slab[0] = -1
+
+    def test_too_large(self):
+        # 400 bytes a slab, the cache would hold fewer than SLABS_PER_CACHE of them
+        self.cache = LRUCache(max_bytes=400 * (slabs.SLABS_PER_CACHE - 1))
+        cells = np.array([3, 4])
+        npt.assert_array_equal(self.read((0, 0), cells), self.data[0, 0, cells])
+        assert self.variable.reads == [(0, 0, cells)]
+
+        partial = []
+        npt.assert_array_equal(self.read((0, 0), cells, partial=lambda: partial.append(1) or self.data[0, 0, cells]),
+                               self.data[0, 0, cells])
+        assert partial == [1]
+        assert len(self.cache) == 0
+
+    def test_disabled(self):
+        self.cache = LRUCache(max_bytes=0)
+        self.read((0, 0), np.array([1]))
+        self.read((0, 0), np.array([1]))
+        assert len(self.variable.reads) == 2
+
+    def test_windows(self):
+        # (time, row, column), read like SGRID windows
+        data = np.arange(2 * 10 * 20, dtype=np.float64).reshape(2, 10, 20)
+        self.variable = Variable(data)
+        window = (slice(2, 5), slice(10, 15))
+        npt.assert_array_equal(self.read((1,), window), data[1, 2:5, 10:15])
+        npt.assert_array_equal(self.read((1,), (slice(0, 3), slice(0, 2))), data[1, 0:3, 0:2])
+        assert len(self.variable.reads) == 1
+
+    def test_sizeof_counts_mask(self):
+        self.read((0, 0))
+        assert self.cache.nbytes == self.data[0, 0].nbytes + 100
+
+
+class TestSlabStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.data = np.ma.masked_greater(np.arange(2 * 100, dtype=np.float32).reshape(2, 100), 150)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def worker(self, max_bytes=10 * 1024 * 1024):
+        # Each worker process has a store of its own on the same directory
+        return SharedSlabs(SlabStore(self.path, max_bytes), 'model')
+
+    def test_dump_load(self):
+        filename = os.path.join(self.path, 'slab')
+        for slab in (self.data[1], np.arange(10, dtype=np.int16), np.ma.masked_all((3, 0))):
+            with open(filename, 'wb') as f:
+                dump(f, slab)
+            loaded = load(filename)
+            npt.assert_array_equal(np.ma.getmaskarray(loaded), np.ma.getmaskarray(slab))
+            npt.assert_array_equal(np.ma.filled(loaded, 0), np.ma.filled(slab, 0))
+            assert loaded.dtype == slab.dtype
+
+    def test_mapped_read_only(self):
+        filename = os.path.join(self.path, 'slab')
+        with open(filename, 'wb') as f:
+            dump(f, self.data[1])
+        loaded = load(filename)
+        assert isinstance(loaded.data, np.memmap)
+        with self.assertRaises(ValueError):
+            loaded[0] = 1
+
+    def test_shared_by_workers(self):
+        variable = Variable(self.data)
+        first, second = self.worker(), self.worker()
+        key = ('model.nc', 'temp', 1)
+        npt.assert_array_equal(slabs.read(key, variable, (1,), np.array([0, 60]), slabs=first), [100, 160])
+        # The second worker maps the slab the first one read
+        data = slabs.read(key, variable, (1,), np.array([10, 99]), slabs=second)
+        npt.assert_array_equal(data, [110, 199])
+        assert data.mask.tolist() == [False, True]
+        assert len(variable.reads) == 1
+
+    def test_removed_while_mapped(self):
+        worker = self.worker()
+        key = ('model.nc', 'temp', 1)
+        worker.set(key, self.data[1])
+        slab = worker.get(key)
+        worker.store.clear('model')
+        assert worker.get(key) is None
+        # Still readable until the last reference is gone
+        npt.assert_array_equal(slab[:10], np.arange(100, 110))
+
+    def test_evicted(self):
+        # Room for about two slabs
+        worker = self.worker(max_bytes=1000)
+        for t in range(5):
+            worker.set(('model.nc', 'temp', t), np.arange(100, dtype=np.float32))
+        files = list(worker.store.files())
+        assert sum(size for _, size, _ in files) <= 1000
+        assert worker.get(('model.nc', 'temp', 4)) is not None
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from .. import tilecache
+from ..tilecache import TileCache, request_key
+from ..utils import DotDict
+
+
+def getmap(headers=None, **params):
+    GET = dict(layers='temp', crs='EPSG:3857', width=256, height=256,
+               bbox=DotDict(minx=0., miny=0., maxx=1., maxy=1.),
+               time=datetime(2018, 1, 1), colorscalerange=DotDict(min=0, max=10))
+    GET.update(params)
+    request = RequestFactory().get('/wms/datasets/ds/', **(headers or {}))
+    request.GET = GET
+    return request
+
+
+def dataset(**kwargs):
+    defaults = dict(pk=1, slug='ds', cache_last_updated=datetime(2018, 1, 1, tzinfo=timezone.utc),
+                    update_task='', keep_up_to_date=True, update_every=3600)
+    defaults.update(kwargs)
+    return DotDict(**defaults)
+
+
+class Axis(object):
+
+    def nearest(self, time):
+        return 4, datetime(2018, 1, 1, 6)
+
+
+class TestTileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = TileCache(self.path, max_bytes=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get_set(self):
+        assert self.cache.get('ds', 'abcd') is None
+        self.cache.set('ds', 'abcd', 'image/png', b'\x89PNG\n\x00')
+        assert self.cache.get('ds', 'abcd') == ('image/png', b'\x89PNG\n\x00')
+        assert self.cache.get('other', 'abcd') is None
+        assert self.cache.stats['hits'] == 1
+        assert self.cache.stats['misses'] == 2
+
+    def test_evicts_by_bytes(self):
+        self.cache.max_bytes = 10000
+        for i, key in enumerate(['aa', 'bb', 'cc', 'dd']):
+            self.cache.set('ds', key, 'image/png', b'x' * 250)
+            os.utime(self.cache.filename('ds', key), (i, i))
+        # 'aa' is used again, 'bb' is now the least recently used
+        self.cache.get('ds', 'aa')
+        self.cache.max_bytes = 1000
+        self.cache.evict()
+        assert self.cache.get('ds', 'bb') is None
+        for key in ('aa', 'cc', 'dd'):
+            assert self.cache.get('ds', key) is not None
+
+    def test_clear(self):
+        self.cache.set('ds', 'abcd', 'image/png', b'1')
+        self.cache.set('other', 'abcd', 'image/png', b'2')
+        self.cache.clear('ds')
+        assert self.cache.get('ds', 'abcd') is None
+        assert self.cache.get('other', 'abcd') is not None
+
+
+class TestRequestKey(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = dataset()
+        self.layer = DotDict(pk=2)
+
+    def key(self, request, now=False):
+        return request_key(self.dataset, self.layer, 'getmap', request, now=now)
+
+    def test_normalized(self):
+        # Unparsed parameters don't matter, only what the request is rendered from
+        request = getmap(CRS='epsg:3857', service='WMS')
+        assert self.key(request) == self.key(getmap())
+        assert self.key(getmap(width=512)) != self.key(getmap())
+        assert self.key(getmap(time=datetime(2018, 1, 2))) != self.key(getmap())
+
+    def test_dataset_updated(self):
+        before = self.key(getmap())
+        self.dataset.cache_last_updated = datetime(2018, 1, 2, tzinfo=timezone.utc)
+        assert self.key(getmap()) != before
+
+    def test_updating(self):
+        self.dataset.update_task = 'UPDATING'
+        assert self.key(getmap()) is None
+
+    def test_now(self):
+        # No time axis in memory
+        assert self.key(getmap(), now=True) is None
+        # The key is the one of the nearest time step
+        self.dataset.time_axis = lambda layer: Axis()
+        now = self.key(getmap(time=datetime.utcnow()), now=True)
+        assert now == self.key(getmap(time=datetime(2018, 1, 1, 6)))
+
+
+class TestCachedResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.default = tilecache.cache
+        tilecache.cache = TileCache(self.path, max_bytes=10000)
+        self.dataset = dataset()
+        self.layer = DotDict(pk=2)
+        self.rendered = []
+
+    def tearDown(self):
+        tilecache.cache = self.default
+        shutil.rmtree(self.path)
+
+    def respond(self, request, status=200, now=False):
+        def render(request):
+            self.rendered.append(1)
+            return HttpResponse(b'tile', content_type='image/png', status=status)
+        return tilecache.cached_response(self.dataset, self.layer, 'getmap', request, render, now=now)
+
+    def test_cached(self):
+        first = self.respond(getmap())
+        second = self.respond(getmap())
+        assert second.content == first.content == b'tile'
+        assert second['Content-Type'] == 'image/png'
+        assert len(self.rendered) == 1
+
+    def test_errors_not_cached(self):
+        self.respond(getmap(), status=500)
+        self.respond(getmap(), status=500)
+        assert len(self.rendered) == 2
+
+    def test_validators(self):
+        response = self.respond(getmap())
+        assert response['ETag'] == '"{}"'.format(request_key(self.dataset, self.layer, 'getmap', getmap()))
+        assert response['Last-Modified'] == 'Mon, 01 Jan 2018 00:00:00 GMT'
+        assert 'max-age=3600' in response['Cache-Control']
+
+    def test_not_modified(self):
+        etag = self.respond(getmap())['ETag']
+        tilecache.cache.clear()
+
+        response = self.respond(getmap(headers=dict(HTTP_IF_NONE_MATCH=etag)))
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+        response = self.respond(getmap(headers=dict(HTTP_IF_MODIFIED_SINCE='Tue, 02 Jan 2018 00:00:00 GMT')))
+        assert response.status_code == 304
+        assert len(self.rendered) == 1
+
+        # Changed since
+        self.dataset.cache_last_updated = datetime(2018, 1, 3, tzinfo=timezone.utc)
+        assert self.respond(getmap(headers=dict(HTTP_IF_NONE_MATCH=etag))).status_code == 200
+        response = self.respond(getmap(headers=dict(HTTP_IF_MODIFIED_SINCE='Tue, 02 Jan 2018 00:00:00 GMT')))
+        assert response.status_code == 200
+
+    def test_now(self):
+        self.dataset.time_axis = lambda layer: Axis()
+        response = self.respond(getmap(time=datetime.utcnow()), now=True)
+        assert not response.has_header('Last-Modified')
+        assert 'max-age=60' in response['Cache-Control']
+        response = self.respond(getmap(time=datetime.utcnow(), headers=dict(HTTP_IF_NONE_MATCH=response['ETag'])), now=True)
+        assert response.status_code == 304
+
+    def test_updating(self):
+        self.dataset.update_task = 'UPDATING'
+        self.respond(getmap())
+        response = self.respond(getmap())
+        assert 'no-cache' in response['Cache-Control']
+        assert not response.has_header('ETag')
+        assert len(self.rendered) == 2
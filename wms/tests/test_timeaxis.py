@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+import netCDF4 as nc4
+
+from ..timeaxis import TimeAxis, TimeAxisRegistry, time_axes, same_axes
+
+
+class TestTimeAxis(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.nc = nc4.Dataset(os.path.join(self.tmpdir, 'time.nc'), 'w')
+        self.nc.createDimension('time', 4)
+        time_var = self.nc.createVariable('time', 'i4', ('time',))
+        time_var.units = 'hours since 2015-01-01 00:00:00'
+        time_var.standard_name = 'time'
+        time_var[:] = [0, 6, 12, 18]
+        self.axis = TimeAxis.from_variable(time_var)
+
+    def tearDown(self):
+        self.nc.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_nearest(self):
+        assert self.axis.values.dtype == np.float64
+        assert self.axis.nearest(datetime(2015, 1, 1, 6)) == (1, 6)
+        assert self.axis.nearest(datetime(2015, 1, 1, 7)) == (2, 12)
+        assert self.axis.nearest(datetime(2014, 1, 1)) == (0, 0)
+        # Don't go over the length of time
+        assert self.axis.nearest(datetime(2016, 1, 1)) == (3, 18)
+
+    def test_no_time(self):
+        assert TimeAxis(None).nearest(datetime(2015, 1, 1)) == (None, None)
+
+    def test_time_axes(self):
+        axes = time_axes([self.nc.variables['time']])
+        axis = TimeAxis(**axes['time'])
+        assert axis.units == 'hours since 2015-01-01 00:00:00'
+        assert axis.nearest(datetime(2015, 1, 1, 12)) == (2, 12)
+
+    def test_same_axes(self):
+        axes = time_axes([self.nc.variables['time']])
+        assert same_axes(axes, time_axes([self.nc.variables['time']]))
+        assert not same_axes(None, axes)
+        self.nc.variables['time'][:] = [6, 12, 18, 24]
+        assert not same_axes(axes, time_axes([self.nc.variables['time']]))
+
+
+class TestTimeAxisRegistry(unittest.TestCase):
+
+    def test_versions(self):
+        registry = TimeAxisRegistry()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return TimeAxis(np.arange(3.), 'hours since 2015-01-01')
+
+        first = registry.get('dataset.time', 'temp', 1, load)
+        assert registry.get('dataset.time', 'temp', 1, load) is first
+        assert len(loads) == 1
+
+        # The time cache was rebuilt
+        assert registry.get('dataset.time', 'temp', 2, load) is not first
+        assert len(loads) == 2
+
+        registry.invalidate('dataset.time')
+        registry.get('dataset.time', 'temp', 2, load)
+        assert len(loads) == 3
+
+    def test_missing_is_not_cached(self):
+        registry = TimeAxisRegistry()
+        assert registry.get('dataset.time', 'temp', 1, lambda: None) is None
+        assert len(registry.cache) == 0
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pyproj
+from pyugrid import UGrid
+from rtree import index
+
+from .. import data_handler
+from ..topology import face_bounds, point_bounds, write_rtree, save_arrays, load_arrays, PointLocator, BucketIndex, UGridTopology, SGridTopology, TopologyRegistry
+
+
+class TestFaceBounds(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = np.array([(0, 0), (2, 0), (0, 1), (2, 3)], dtype=np.float64)
+
+    def test_triangles(self):
+        faces = np.array([(0, 1, 2), (1, 3, 2)])
+        expected = np.array([(0, 0, 2, 1), (0, 0, 2, 3)])
+        np.testing.assert_array_equal(face_bounds(self.nodes, faces), expected)
+
+    def test_masked_vertices(self):
+        faces = np.ma.array([(0, 1, 2, 3), (1, 3, 2, -1)], mask=[(0, 0, 0, 0), (0, 0, 0, 1)])
+        expected = np.array([(0, 0, 2, 3), (0, 0, 2, 3)])
+        np.testing.assert_array_equal(face_bounds(self.nodes, faces), expected)
+
+    def test_points(self):
+        expected = np.array([(0, 0, 0, 0), (2, 0, 2, 0), (0, 1, 0, 1), (2, 3, 2, 3)])
+        np.testing.assert_array_equal(point_bounds(self.nodes[:, 0], self.nodes[:, 1]), expected)
+
+
+class TestTopologyFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_rtree(self):
+        bounds = np.array([(0, 0, 1, 1), (5, 5, 6, 6), (np.nan, 0, 1, 1)])
+        write_rtree(self.root, bounds, ids=np.array([10, 20, 30]))
+        tree = index.Index(self.root)
+        try:
+            assert tree.count((-180, -90, 180, 90)) == 2
+            assert list(tree.nearest((5.5, 5.5, 5.5, 5.5), 1)) == [20]
+        finally:
+            tree.close()
+
+    def test_arrays_roundtrip(self):
+        faces = np.ma.array([(0, 1, 2), (1, 2, 3)], mask=[(0, 0, 0), (0, 0, 1)])
+        save_arrays(self.root, mesh_name='mesh', nodes=np.zeros((4, 2)), faces=faces, face_coordinates=None)
+        mesh_name, arrays = load_arrays(self.root)
+        assert mesh_name == 'mesh'
+        assert sorted(arrays.keys()) == ['faces', 'nodes']
+        assert isinstance(arrays['nodes'], np.memmap)
+        np.testing.assert_array_equal(arrays['faces'], [(0, 1, 2), (1, 2, -1)])
+
+    def test_missing_arrays(self):
+        assert load_arrays(self.root) is None
+
+
+class TestPointLocator(unittest.TestCase):
+
+    def test_nearest(self):
+        locator = PointLocator(np.array([0., 1., np.nan, 3.]), np.array([0., 1., 2., 3.]))
+        assert locator.nearest(2.9, 2.5) == (3, 3.0, 3.0)
+        assert locator.nearest(0.2, 0.1) == (0, 0.0, 0.0)
+
+    def test_ids(self):
+        locator = PointLocator(np.array([[0., 1.], [2., 3.]]), np.zeros((2, 2)), ids=np.arange(1, 5))
+        assert locator.nearest(2.1, 0)[0] == 3
+
+    def test_empty(self):
+        assert PointLocator(np.array([np.nan]), np.array([0.])).nearest(0, 0) is None
+
+    def test_ugrid_locations(self):
+        nodes = np.array([(0, 0), (2, 0), (0, 1), (2, 3)], dtype=np.float64)
+        topo = UGridTopology('mesh', nodes, np.array([(0, 1, 2), (1, 3, 2)]))
+        assert topo.locator('node').nearest(1.9, 2.8) == (3, 2.0, 3.0)
+        # Without face coordinates faces are located by the center of their bounds
+        assert topo.locator('face').nearest(1, 1.6) == (1, 1.0, 1.5)
+        assert topo.locator('face') is topo.locator('face')
+        # No edge coordinates, the RTree is searched instead
+        assert topo.locator('edge') is None
+
+    def test_sgrid_cells(self):
+        # ids are the 1-based flattened cell index, like the RTree ids
+        lon, lat = np.meshgrid(np.arange(3.), np.arange(2.))
+        topo = SGridTopology(None, center_lon=lon, center_lat=lat)
+        assert topo.locator().nearest(2, 1) == (6, 2.0, 1.0)
+        assert topo.locator().nearest(0.1, 0) == (1, 0.0, 0.0)
+
+
+class TestTopologyRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.topology_file = os.path.join(self.tmpdir, 'test.nc')
+        self.arrays_root = os.path.join(self.tmpdir, 'test.topology')
+        self.nodes = np.array([(0, 0), (2, 0), (0, 1), (2, 3)], dtype=np.float64)
+        self.faces = np.array([(0, 1, 2), (1, 3, 2)])
+        UGrid(nodes=self.nodes, faces=self.faces, mesh_name='mesh').save_as_netcdf(self.topology_file)
+        self.registry = TopologyRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def ugrid(self):
+        topo = self.registry.ugrid(self.topology_file, mesh_name='mesh', arrays_root=self.arrays_root)
+        np.testing.assert_array_equal(topo.nodes, self.nodes)
+        np.testing.assert_array_equal(topo.faces, self.faces)
+        return topo
+
+    def test_mapped(self):
+        UGridTopology.from_ncfile(self.topology_file, mesh_name='mesh').save_arrays(self.arrays_root)
+        assert isinstance(self.ugrid().nodes, np.memmap)
+
+    def test_missing_manifest(self):
+        # Arrays without a manifest are not a complete set
+        UGridTopology.from_ncfile(self.topology_file, mesh_name='mesh').save_arrays(self.arrays_root)
+        os.remove('{}.json'.format(self.arrays_root))
+        assert not isinstance(self.ugrid().nodes, np.memmap)
+
+    def test_half_written(self):
+        UGridTopology.from_ncfile(self.topology_file, mesh_name='mesh').save_arrays(self.arrays_root)
+        # A manifest listing an array that is not there
+        os.remove('{}.faces.npy'.format(self.arrays_root))
+        assert not isinstance(self.ugrid().nodes, np.memmap)
+
+        # A truncated manifest
+        self.registry.clear()
+        with open('{}.json'.format(self.arrays_root), 'w') as f:
+            f.write('{"mesh_name": "mesh", "arr')
+        assert not isinstance(self.ugrid().nodes, np.memmap)
+
+    def test_locator(self):
+        topo = self.ugrid()
+        nbytes = self.registry.cache.nbytes
+        locator = topo.locator('node')
+        assert locator.nearest(0.1, 0.9)[0] == 2
+        # Kept with the topology and accounted in its budget
+        assert self.ugrid().locator('node') is locator
+        assert self.registry.cache.nbytes > nbytes
+
+        # Rebuilt with the topology
+        UGridTopology.from_ncfile(self.topology_file, mesh_name='mesh').save_arrays(self.arrays_root)
+        assert self.ugrid().locator('node') is not locator
+
+
+class TestBucketIndex(unittest.TestCase):
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.x = rs.uniform(-80, -60, 5000)
+        self.y = rs.uniform(30, 45, 5000)
+        self.x[7] = np.nan
+        self.index = BucketIndex.build(self.x, self.y)
+
+    def test_query_is_superset(self):
+        bbox = (-70, 35, -65, 40)
+        expected = data_handler.ugrid_lat_lon_subset_idx(self.x, self.y, bbox, padding=0.01)
+        candidates = self.index.query(data_handler.padded_bbox(bbox, 0.01))
+        assert set(np.flatnonzero(expected)) <= set(candidates)
+        assert candidates.size < self.x.size / 2
+
+    def test_subset_matches_full_scan(self):
+        for bbox in [(-70, 35, -65, 40), (-100, 0, -79, 31), (0, 0, 10, 10), (-180, -90, 180, 90)]:
+            np.testing.assert_array_equal(
+                data_handler.ugrid_lat_lon_subset_idx(self.x, self.y, bbox, index=self.index),
+                data_handler.ugrid_lat_lon_subset_idx(self.x, self.y, bbox)
+            )
+
+    def test_arrays_roundtrip(self):
+        restored = BucketIndex.from_arrays(self.index.to_arrays('node_buckets'), 'node_buckets')
+        np.testing.assert_array_equal(restored.query((-70, 35, -65, 40)), self.index.query((-70, 35, -65, 40)))
+        assert BucketIndex.from_arrays({}, 'node_buckets') is None
+
+    def test_empty(self):
+        assert BucketIndex.build(np.array([np.nan]), np.array([0.])).query((-1, -1, 1, 1)).size == 0
+
+
+class TestFaceCandidates(unittest.TestCase):
+
+    def test_matches_full_scan(self):
+        # 20x20 grid of nodes split into triangles
+        xx, yy = np.meshgrid(np.arange(20.), np.arange(20.))
+        nodes = np.column_stack((xx.ravel(), yy.ravel()))
+        i = (np.arange(19)[:, None] * 20 + np.arange(19)[None, :]).ravel()
+        faces = np.concatenate([np.column_stack((i, i + 1, i + 20)), np.column_stack((i + 1, i + 21, i + 20))])
+        topo = UGridTopology('mesh', nodes, faces)
+
+        bbox = (3.5, 2.5, 11, 9)
+        spatial_idx = data_handler.ugrid_lat_lon_subset_idx(nodes[:, 0], nodes[:, 1], bbox, padding=0.1,
+                                                            index=topo.bucket_index('node'))
+        candidates = topo.face_bucket_index().query(data_handler.padded_bbox(bbox, 0.1))
+        expected = np.all(spatial_idx[faces], axis=1)
+        assert expected.any()
+        np.testing.assert_array_equal(
+            data_handler.face_idx_from_node_idx(faces, spatial_idx, candidates=candidates),
+            expected
+        )
+
+
+class TestProjectedCoordinates(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = np.array([(-70., 40.), (-71., 41.), (-70.5, 42.)])
+        self.crs = 'EPSG:3857'
+
+    def test_projected(self):
+        topo = UGridTopology('mesh', self.nodes, np.array([(0, 1, 2)]))
+        x, y = topo.projected('node', self.crs)
+        ex, ey = pyproj.Transformer.from_crs('EPSG:4326', self.crs, always_xy=True).transform(self.nodes[:, 0], self.nodes[:, 1])
+        np.testing.assert_allclose(x, ex)
+        np.testing.assert_allclose(y, ey)
+        assert not x.flags.writeable
+        # Computed once per projection
+        assert topo.projected('node', self.crs)[0] is x
+        assert topo.projected('node', 'EPSG:4326')[0] is not x
+
+    def test_registry_accounting(self):
+        registry = TopologyRegistry(max_bytes=None)
+        topo = registry._store(('ugrid', 'test.nc', None), UGridTopology('mesh', self.nodes, np.array([(0, 1, 2)])), None)
+        before = registry.cache.nbytes
+        topo.projected('node', self.crs)
+        assert registry.cache.nbytes == before + 2 * self.nodes.shape[0] * 8
+
+
+class TestSGridWindow(unittest.TestCase):
+
+    def setUp(self):
+        # A curvilinear grid, rotated 30 degrees with a ring of padding cells
+        rows, columns = np.mgrid[0:40, 0:60].astype(np.float64)
+        angle = np.radians(30)
+        lon = -70 + 0.01 * (columns * np.cos(angle) - rows * np.sin(angle))
+        lat = 40 + 0.01 * (columns * np.sin(angle) + rows * np.cos(angle))
+        self.topo = SGridTopology(None, lon, lat)
+        self.slicing = (slice(1, -1), slice(1, -1))
+        self.lon = lon[self.slicing]
+        self.lat = lat[self.slicing]
+
+    def test_matches_full_scan(self):
+        rs = np.random.RandomState(0)
+        for _ in range(50):
+            minx, maxx = np.sort(rs.uniform(-70.3, -69.4, 2))
+            miny, maxy = np.sort(rs.uniform(39.9, 40.6, 2))
+            rows, columns = data_handler.lat_lon_subset_idx(self.lon, self.lat, minx, miny, maxx, maxy, padding=0).reshape(2, -1)
+            window = self.topo.window((minx, miny, maxx, maxy), self.slicing)
+            if not rows.size:
+                assert window is None
+                continue
+            # The smallest window holding every cell in the bbox
+            assert window == (slice(rows.min(), rows.max() + 1), slice(columns.min(), columns.max() + 1))
+
+    def test_outside(self):
+        assert self.topo.window((0, 0, 1, 1), self.slicing) is None
+
+    def test_extents_cached(self):
+        rows, columns = self.topo.extents(self.slicing)
+        assert rows.shape == (38, 4)
+        assert columns.shape == (58, 4)
+        np.testing.assert_allclose(rows[0], [self.lon[0].min(), self.lat[0].min(), self.lon[0].max(), self.lat[0].max()])
+        assert self.topo.extents(self.slicing)[0] is rows
+
+
+class Variable(object):
+    """ An array that counts the reads, like a NetCDF variable would cost them """
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return self.data[key]
+
+
+class TestReadIndexes(unittest.TestCase):
+
+    def test_runs(self):
+        assert data_handler.index_runs([]) == []
+        assert data_handler.index_runs([3, 4, 5, 9], max_gap=0) == [(3, 6), (9, 10)]
+        assert data_handler.index_runs([3, 4, 5, 9], max_gap=3) == [(3, 10)]
+        # The closest runs are joined first
+        assert data_handler.index_runs([0, 10, 12, 40], max_gap=0, max_runs=2) == [(0, 13), (40, 41)]
+        assert data_handler.index_runs([0, 10, 12, 40], max_gap=0, max_runs=1) == [(0, 41)]
+
+    def test_read(self):
+        data = np.arange(3 * 100000).reshape(3, 100000)
+        variable = Variable(data)
+        indexes = np.concatenate([np.arange(10, 20), np.arange(50000, 50010, 3), [99999]])
+        values = data_handler.read_indexes(variable, (1,), indexes)
+        np.testing.assert_array_equal(values, data[1, indexes])
+        # Three hyperslabs, about what is used
+        assert len(variable.reads) == 3
+        assert sum(key[1].stop - key[1].start for key in variable.reads) == 10 + 10 + 1
+
+    def test_masked(self):
+        data = np.ma.masked_greater(np.arange(10.), 6)
+        values = data_handler.read_indexes(Variable(data), (), [1, 7, 8])
+        np.testing.assert_array_equal(np.ma.getmaskarray(values), [False, True, True])
+        assert data_handler.read_indexes(Variable(data), (), []).size == 0
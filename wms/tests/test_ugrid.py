@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from copy import copy
+from unittest import mock
 
 from django.test import TestCase
 
@@ -7,6 +8,7 @@ import pandas as pd
 
 from wms.tests import add_server, add_group, add_user, add_dataset, image_path
 from wms.models import Dataset, UGridDataset
+from wms.utils import DotDict
 
 from wms import logger  # noqa
 
@@ -176,6 +178,17 @@ class TestUgrid(TestCase):
         d.clear_cache()
         self.assertFalse(d.has_cache())
 
+    def test_gfi_locator(self):
+        # The in-memory KD-tree finds the same nodes as the RTree on disk
+        d = Dataset.objects.get(name=self.dataset_slug)
+        layer = d.layer_set.get(var_name='surface_salt')
+        times = d.times(layer)
+        request = DotDict(GET=dict(longitude=-123.4863, latitude=46.256, starting=times[0], ending=times[0]))
+        resident = d.setup_getfeatureinfo(layer, request, location='node')
+        with mock.patch.object(UGridDataset, 'point_locator', return_value=None):
+            on_disk = d.setup_getfeatureinfo(layer, request, location='node')
+        assert resident[:3] == on_disk[:3]
+
 
 class TestFVCOM(TestCase):
 
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+
+from ..vectors import thin, thin_mask, arrows_response
+from ..mpl_handler import quiver_response
+from ..raster import colormap_lut
+from .test_png import decode
+from ..utils import DotDict
+
+
+def bbox(minx, miny, maxx, maxy):
+    return DotDict(minx=minx, miny=miny, maxx=maxx, maxy=maxy)
+
+
+def request(vectorstep=1, cmin=0, cmax=2, width=256, height=256):
+    return DotDict(GET={
+        'bbox': bbox(0, 0, 1, 1),
+        'width': width,
+        'height': height,
+        'crs': 'EPSG:3857',
+        'colormap': 'jet',
+        'colorscalerange': DotDict(min=cmin, max=cmax),
+        'vectorscale': 30,
+        'vectorstep': vectorstep,
+        'logscale': False,
+    })
+
+
+class TestThin(unittest.TestCase):
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.x = rs.uniform(0, 2, 20000)
+        self.y = rs.uniform(0, 1, 20000)
+        self.ids = np.arange(self.x.size)
+
+    def kept(self, tile, cell=16, size=256):
+        keep = thin(self.x, self.y, self.ids, tile, size, size, cell)
+        return set(self.ids[keep])
+
+    def test_one_per_cell(self):
+        keep = thin(self.x, self.y, self.ids, bbox(0, 0, 1, 1), 256, 256, 16)
+        cells = set(zip(np.floor(self.x[keep] * 16), np.floor(self.y[keep] * 16)))
+        assert len(cells) == keep.size
+        # Every cell has a vector, there are plenty
+        assert keep.size == 32 * 16
+
+    def test_neighbouring_tiles(self):
+        # Tiles of the same zoom agree on the vectors both of them see
+        left = self.kept(bbox(0, 0, 1, 1))
+        right = self.kept(bbox(0.5, 0, 1.5, 1))
+        overlap = set(i for i in self.ids if 0.5 <= self.x[i] < 1)
+        assert left & overlap == right & overlap
+
+    def test_zoom_levels(self):
+        # Vectors drawn at one zoom level are still drawn zoomed in
+        out = self.kept(bbox(0, 0, 2, 2))
+        zoomed = self.kept(bbox(0, 0, 1, 1))
+        inside = set(i for i in self.ids if self.x[i] < 1 and self.y[i] < 1)
+        assert out & inside <= zoomed
+
+    def test_all(self):
+        x = self.x.copy()
+        x[0] = np.nan
+        keep = thin(x, self.y, self.ids, bbox(0, 0, 1, 1), 256, 256, 0)
+        np.testing.assert_array_equal(keep, self.ids[1:])
+
+    def test_mask(self):
+        mask = self.x < 1
+        thinned = thin_mask(self.x, self.y, mask, request())
+        assert not np.any(thinned & ~mask)
+        assert thinned.sum() == 16 * 16
+        assert thin_mask(self.x, self.y, mask, request(vectorstep=2)).sum() == 8 * 8
+
+
+class TestArrows(unittest.TestCase):
+
+    def test_colored_by_magnitude(self):
+        x = np.array([0.25, 0.75])
+        y = np.array([0.5, 0.5])
+        u = np.array([1., 0.])
+        v = np.array([0., 2.])
+        rgba = decode(arrows_response(x, y, u, v, request()).content)[0]
+        lut = colormap_lut('jet')
+        for half, color in ((rgba[:, :128], lut[128]), (rgba[:, 128:], lut[255])):
+            drawn = half[half[..., 3] > 0]
+            assert len(drawn)
+            np.testing.assert_array_equal(np.unique(drawn[:, :3], axis=0), [color[:3]])
+        assert rgba[10, 10, 3] == 0
+
+    def test_missing(self):
+        x = np.ma.masked_array([0.5, np.nan], mask=[True, False])
+        rgba = decode(arrows_response(x, [0.5, 0.5], [1, 1], [1, 1], request()).content)[0]
+        assert not rgba[..., 3].any()
+
+    def test_like_quiver(self):
+        rs = np.random.RandomState(1)
+        # As many arrows as fit across the tile, so the shafts are as wide as quiver's
+        x, y = rs.uniform(0.05, 0.95, (2, 256))
+        u, v = rs.normal(size=(2, 256))
+        old = decode(quiver_response(None, None, u, v, request(), projected=(x, y)).content)[0].astype(int)
+        new = decode(arrows_response(x, y, u, v, request()).content)[0].astype(int)
+        assert (np.abs(old - new).max(axis=-1) > 32).mean() < 0.005
@@ -8,7 +8,8 @@ import datetime
 from django.test import TestCase
 from django.test.client import RequestFactory
 
-from ..wms_handler import get_time
+from ..wms_handler import get_time, get_projection, get_wgs84_bbox
+from ..projections import registry
 
 
 class TestGetTime(TestCase):
@@ -39,3 +40,25 @@ class TestGetTime(TestCase):
         expected_dt = datetime.datetime(2015, 1, 1, 17, 0, 0)
         self.assertEqual(result_time, expected_dt)
         self.assertIsNone(result_time_tz)
+
+
+class TestProjection(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_get_projection(self):
+        self.assertEqual(get_projection(self.factory.get('/dataset?srs=epsg:4326')), 'EPSG:4326')
+        self.assertEqual(get_projection(self.factory.get('/dataset?crs=EPSG:3857')), 'EPSG:3857')
+        self.assertEqual(get_projection(self.factory.get('/dataset')), 'EPSG:3857')
+
+    def test_get_wgs84_bbox(self):
+        request = self.factory.get('/dataset?crs=EPSG:3857&bbox=-7792364.355529149,5009377.085697312,-7514065.628545966,5160979.444049783')
+        bbox = get_wgs84_bbox(request)
+        self.assertAlmostEqual(bbox.minx, -70)
+        self.assertAlmostEqual(bbox.miny, 40.9798980696)
+        self.assertAlmostEqual(bbox.maxx, -67.5)
+        self.assertAlmostEqual(bbox.maxy, 42)
+
+    def test_transformers_are_reused(self):
+        self.assertIs(registry.get('EPSG:3857', 'EPSG:4326'), registry.get('EPSG:3857', 'EPSG:4326'))
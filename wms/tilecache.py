@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Rendered responses of GetMap, GetLegendGraphic and GetMetadata requests kept
+on disk, so identical requests (the same tile of the latest forecast asked
+for by many browsers) are rendered once.
+
+Keys are built from the parsed (normalized) request parameters, so requests
+that only differ in spelling share an entry, and from the time the dataset
+was last updated, so new data is never answered from old tiles. Stale
+entries are not looked up again and age out as the cache fills up.
+
+The key is also the ETag of the response, so browsers and proxies can
+revalidate a tile and get a 304 without the dataset being opened.
+"""
+import os
+import shutil
+import calendar
+import hashlib
+import tempfile
+import threading
+from datetime import date
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import http_date
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from wms import metatile
+
+from wms import logger  # noqa
+
+
+# The parameters each request is rendered from, as set by the enhance_*_request functions in wms.views
+PARAMETERS = {
+    'getmap': ('layers', 'starting', 'ending', 'time', 'crs', 'bbox', 'colormap', 'colorscalerange',
+               'elevation', 'width', 'height', 'image_type', 'logscale', 'vectorscale', 'vectorstep',
+               'numcontours'),
+    'getlegendgraphic': ('layers', 'layer', 'colorscalerange', 'width', 'height', 'image_type', 'colormap',
+                         'format', 'showlabel', 'showvalues', 'units', 'logscale', 'horizontal',
+                         'numcontours'),
+    'getmetadata': ('layers', 'time', 'crs', 'bbox', 'wgs84_bbox', 'elevation', 'width', 'height', 'item'),
+}
+
+# Cache-Control max-age (seconds) of responses for a TIME and of the ones without (now)
+MAX_AGE = 86400
+NOW_MAX_AGE = 60
+
+
+def canonical(value):
+    """ A repr-able form of a parsed parameter that is equal for equal values """
+    if isinstance(value, dict):
+        return tuple(sorted((k, canonical(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(canonical(v) for v in value)
+    elif isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def request_key(dataset, layer, reqtype, request, now=False):
+    """
+    The key of the response to a request, None if it can't be cached: the
+    dataset is updating, or the request has no TIME (``now``) and the time
+    step it is drawn from can't be known without opening the dataset.
+    """
+    if dataset.update_task:
+        return None
+
+    params = OrderedDict((name, request.GET.get(name)) for name in PARAMETERS[reqtype])
+    if now and 'time' in params:
+        # The current time changes with every request, the time step nearest to it rarely does
+        axis = dataset.time_axis(layer) if hasattr(dataset, 'time_axis') else None
+        if axis is None:
+            return None
+        _, params['time'] = axis.nearest(params['time'])
+    if reqtype == 'getmap':
+        # Tiles of the web mercator grid by their index, bboxes computed by clients differ in the last digits
+        index = metatile.tile_index(params['crs'], params['bbox'], params['width'], params['height'])
+        if index is not None:
+            params['bbox'] = ('tile',) + index
+
+    updated = canonical(dataset.cache_last_updated)
+    key = repr((dataset.pk, layer.__class__.__name__, layer.pk, updated, reqtype, canonical(list(params.items()))))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class TileCache(object):
+    """
+    Responses stored as files under ``path``, one directory per dataset. The
+    total size is bounded by ``max_bytes``: after every tenth of it written
+    the directory is scanned and the least recently used files are removed
+    until it is back under 90% of the bound. The cache is shared by all of the
+    processes on the host, the hit and miss counters are per process.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes)
+
+    def filename(self, dataset, key):
+        return os.path.join(self.path, dataset, key[:2], key)
+
+    def get(self, dataset, key):
+        """ (content_type, content) of a cached response, None if there is none """
+        filename = self.filename(dataset, key)
+        try:
+            with open(filename, 'rb') as f:
+                content_type, content = f.read().split(b'\n', 1)
+            # The modification time is the last use, for eviction
+            os.utime(filename)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return content_type.decode('utf-8'), content
+
+    def set(self, dataset, key, content_type, content):
+        def write(f):
+            f.write(content_type.encode('utf-8') + b'\n')
+            f.write(content)
+        self.write(dataset, key, write)
+
+    def write(self, dataset, key, write):
+        """ Store the file written by ``write(f)`` """
+        filename = self.filename(dataset, key)
+        directory = os.path.dirname(filename)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Written to a temporary file and renamed so readers never see part of it
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write(f)
+                    nbytes = f.tell()
+                os.replace(tmp, filename)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        except OSError:
+            logger.exception("Could not write {} to the tile cache".format(filename))
+            return
+
+        with self._lock:
+            self._written += nbytes
+            full = self._written > self.max_bytes / 10
+            if full:
+                self._written = 0
+        if full:
+            self.evict()
+
+    def files(self):
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                filename = os.path.join(root, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue  # Removed by another process
+                yield stat.st_mtime, stat.st_size, filename
+
+    def evict(self):
+        """ Remove the least recently used files if the cache is over its size """
+        files = sorted(self.files())
+        nbytes = sum(size for _, size, _ in files)
+        if nbytes <= self.max_bytes:
+            return
+
+        target = self.max_bytes * 0.9
+        for _, size, filename in files:
+            if nbytes <= target:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            nbytes -= size
+
+    def clear(self, dataset=None):
+        """ Remove the responses of one dataset, or all of them """
+        shutil.rmtree(self.path if dataset is None else os.path.join(self.path, dataset), ignore_errors=True)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, max_bytes=self.max_bytes)
+
+
+cache = TileCache(settings.TILE_CACHE_PATH, settings.TILE_CACHE_MAX_BYTES)
+
+
+def last_modified(dataset):
+    """ Seconds since the epoch of the last update of a dataset, None if it never was """
+    if dataset.cache_last_updated is None:
+        return None
+    return calendar.timegm(dataset.cache_last_updated.utctimetuple())
+
+
+def max_age(dataset, now):
+    """ Seconds clients may keep a response without asking again """
+    if now:
+        return NOW_MAX_AGE
+    if dataset.keep_up_to_date:
+        # A new forecast may replace the data of any time step at the next update
+        return min(dataset.update_every, MAX_AGE)
+    return MAX_AGE
+
+
+def add_validators(response, dataset, key, now):
+    """
+    ETag, Last-Modified and Cache-Control of a response. A response without a
+    TIME shows other data as time goes by without the dataset changing, so it
+    only has the ETag.
+    """
+    if key is None:
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    response['ETag'] = '"{}"'.format(key)
+    modified = last_modified(dataset)
+    if modified is not None and not now:
+        response['Last-Modified'] = http_date(modified)
+    patch_cache_control(response, public=True, max_age=max_age(dataset, now))
+    return response
+
+
+def cached_response(dataset, layer, reqtype, request, render, now=False):
+    """
+    The response to a request: 304 Not Modified if the client has it, the
+    cached response, or the response of ``render(request)`` after storing it.
+    Tiles are drawn as part of their metatile and the other tiles are stored
+    too. Only complete, successful responses are stored. Everything before
+    rendering happens without opening the dataset.
+    """
+    if reqtype not in PARAMETERS:
+        return render(request)
+
+    key = request_key(dataset, layer, reqtype, request, now=now)
+    if key is None:
+        return add_validators(render(request), dataset, key, now)
+
+    modified = None if now else last_modified(dataset)
+    response = get_conditional_response(request, etag='"{}"'.format(key), last_modified=modified)
+    if response is not None:
+        return add_validators(response, dataset, key, now)
+
+    if not cache.enabled:
+        return add_validators(render(request), dataset, key, now)
+
+    cached = cache.get(dataset.slug, key)
+    if cached is not None:
+        content_type, content = cached
+        return add_validators(HttpResponse(content, content_type=content_type), dataset, key, now)
+
+    tiles = metatile.render(request, render) if reqtype == 'getmap' else None
+    if tiles is not None:
+        response, siblings = tiles
+        for sibling_request, sibling in siblings:
+            sibling_key = request_key(dataset, layer, reqtype, sibling_request, now=now)
+            cache.set(dataset.slug, sibling_key, sibling['Content-Type'], sibling.content)
+    else:
+        response = render(request)
+
+    if response.status_code != 200:
+        return response
+    if not response.streaming:
+        cache.set(dataset.slug, key, response['Content-Type'], response.content)
+    return add_validators(response, dataset, key, now)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import netCDF4 as nc4
+
+from wms.lru import LRUCache
+
+
+class TimeAxis(object):
+    """
+    The numeric values of a time variable, in the variable's own units, so a
+    requested time can be turned into an index without opening the dataset.
+    ``values`` is None for datasets without a time variable.
+    """
+
+    def __init__(self, values, units=None, calendar=None):
+        self.values = values
+        self.units = units
+        self.calendar = calendar or 'gregorian'
+
+    @classmethod
+    def from_variable(cls, time_var):
+        values = np.ma.filled(np.ma.asarray(time_var[:], dtype=np.float64), np.nan).ravel()
+        return cls(values, units=time_var.units, calendar=getattr(time_var, 'calendar', None))
+
+    def as_dict(self):
+        return dict(values=self.values, units=self.units, calendar=self.calendar)
+
+    def nearest(self, time):
+        """
+        Return the time index and time value that is closest
+        """
+        if self.values is None or not self.values.size:
+            return None, None
+
+        num_date = round(nc4.date2num(time, units=self.units, calendar=self.calendar))
+        time_index = np.searchsorted(self.values, num_date, side='left')
+        time_index = min(time_index, self.values.size - 1)  # Don't do over the length of time
+        return time_index, self.values[time_index]
+
+    @property
+    def nbytes(self):
+        return 0 if self.values is None else self.values.nbytes
+
+
+def time_axes(time_vars):
+    """ The numeric axis of each time variable, stored in the time cache """
+    return { v.name: TimeAxis.from_variable(v).as_dict() for v in time_vars }
+
+
+def same_axes(a, b):
+    """ Whether two sets of time_axes() hold the same times """
+    if a is None or b is None or set(a) != set(b):
+        return False
+    for name, axis in a.items():
+        other = b[name]
+        if axis['units'] != other['units'] or axis['calendar'] != other['calendar']:
+            return False
+        if axis['values'] is None or other['values'] is None:
+            if axis['values'] is not other['values']:
+                return False
+        elif not np.array_equal(axis['values'], other['values'], equal_nan=True):
+            return False
+    return True
+
+
+class TimeAxisRegistry(object):
+    """
+    Per-worker copy of the numeric time axis of each layer, loaded from the
+    time cache. Entries are tagged with the dataset's ``cache_last_updated``
+    so an update_time_cache run in another process is picked up on the next
+    request.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.cache = LRUCache(max_bytes)
+
+    def get(self, time_cache_file, layer_name, version, load):
+        key = (time_cache_file, layer_name)
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        axis = load()
+        if axis is not None:
+            self.cache.set(key, (version, axis))
+        return axis
+
+    def invalidate(self, time_cache_file):
+        self.cache.delete_matching(lambda k: k[0] == time_cache_file)
+
+    def clear(self):
+        self.cache.clear()
+
+
+# A year of hourly float64 values is ~70KB per layer
+registry = TimeAxisRegistry(max_bytes=64 * 1024 * 1024)
@@ -0,0 +1,637 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+from pyugrid import UGrid
+from pysgrid import load_grid
+from rtree import index
+from scipy.spatial import cKDTree
+
+from django.conf import settings
+
+from wms import projections
+from wms.lru import LRUCache, sizeof
+
+from wms import logger
+
+
+def file_version(path):
+    """
+    Identify the version of a cache file on disk. Returns None if the file
+    does not exist. The topology cache is replaced with an atomic move when
+    it is rebuilt, so a new mtime or size means new content.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def save_arrays(root, mesh_name=None, **arrays):
+    """
+    Save arrays as raw ``.npy`` files named ``[root].[name].npy`` alongside a
+    ``[root].json`` manifest. Each file is written to a temporary file and
+    moved into place, and the manifest is written last, so readers never see a
+    partial set. Masked arrays are stored filled with -1 (faces) or NaN.
+    """
+    directory = os.path.dirname(root)
+    names = []
+    for name, arr in arrays.items():
+        if arr is None:
+            continue
+        if isinstance(arr, np.ma.MaskedArray):
+            fill = -1 if np.issubdtype(arr.dtype, np.integer) else np.nan
+            arr = arr.filled(fill)
+        tmphandle, tmpsave = tempfile.mkstemp(dir=directory, suffix='.npy')
+        try:
+            with os.fdopen(tmphandle, 'wb') as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmpsave, '{}.{}.npy'.format(root, name))
+        except BaseException:
+            if os.path.isfile(tmpsave):
+                os.remove(tmpsave)
+            raise
+        names.append(name)
+
+    tmphandle, tmpsave = tempfile.mkstemp(dir=directory, suffix='.json')
+    with os.fdopen(tmphandle, 'w') as f:
+        json.dump(dict(mesh_name=mesh_name, arrays=names), f)
+    os.replace(tmpsave, '{}.json'.format(root))
+
+
+def load_arrays(root, mmap_mode='r'):
+    """
+    Load the arrays saved with ``save_arrays``, memory mapped so every process
+    shares the page cache copy. Returns None if there is no (complete) set.
+    """
+    try:
+        with open('{}.json'.format(root)) as f:
+            manifest = json.load(f)
+        arrays = {
+            name: np.load('{}.{}.npy'.format(root, name), mmap_mode=mmap_mode)
+            for name in manifest['arrays']
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    return manifest.get('mesh_name'), arrays
+
+
+def face_bounds(nodes, faces):
+    """
+    Bounding boxes of every face as an (N, 4) array of (xmin, ymin, xmax, ymax),
+    computed in one vectorized pass. Padded (masked or negative) vertices of
+    mixed meshes are ignored.
+    """
+    faces = np.ma.asarray(faces)
+    mask = np.ma.getmaskarray(faces) | (faces.filled(0) < 0)
+    vertices = np.where(mask, 0, faces.filled(0))
+    bounds = np.empty((faces.shape[0], 4), dtype=np.float64)
+    for axis in (0, 1):
+        coords = np.ma.array(nodes[:, axis][vertices], mask=mask)
+        bounds[:, axis] = coords.min(axis=1).filled(np.nan)
+        bounds[:, axis + 2] = coords.max(axis=1).filled(np.nan)
+    return bounds
+
+
+def point_bounds(x, y):
+    """ Degenerate (xmin, ymin, xmax, ymax) boxes for points """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    return np.column_stack((x, y, x, y))
+
+
+def write_rtree(root, bounds, ids=None):
+    """
+    Bulk load a disk R-tree at ``[root].dat`` and ``[root].idx`` from an (N, 4)
+    array of (xmin, ymin, xmax, ymax) bounds. ``ids`` default to the row number.
+    Entries with non-finite bounds are skipped and no objects are stored, so
+    lookups should use the entry ids.
+
+    The arrays are handed to libspatialindex in one call when the installed
+    rtree supports it (rtree>=1.1, libspatialindex>=2.1), otherwise they are
+    streamed, which still packs the tree instead of inserting one at a time.
+    """
+    if ids is None:
+        ids = np.arange(bounds.shape[0])
+    valid = np.all(np.isfinite(bounds), axis=1)
+    ids = np.ascontiguousarray(ids[valid], dtype=np.int64)
+    bounds = bounds[valid]
+
+    tmphandle, temp_file = tempfile.mkstemp(suffix='.rtree')
+    os.close(tmphandle)
+    os.remove(temp_file)
+
+    def properties():
+        p = index.Property()
+        p.filename = str(temp_file)
+        p.overwrite = True
+        p.storage   = index.RT_Disk
+        p.dimension = 2
+        return p
+
+    try:
+        idx = None
+        if hasattr(index.Index, '_create_idx_from_array'):
+            try:
+                idx = index.Index(temp_file,
+                                  (ids, np.ascontiguousarray(bounds[:, :2]), np.ascontiguousarray(bounds[:, 2:])),
+                                  properties=properties(),
+                                  interleaved=True,
+                                  overwrite=True)
+            except NotImplementedError:
+                idx = None
+        if idx is None:
+            idx = index.Index(temp_file,
+                              ((i, b, None) for i, b in zip(ids.tolist(), bounds.tolist())),
+                              properties=properties(),
+                              interleaved=True,
+                              overwrite=True)
+        idx.close()
+        shutil.move('{}.dat'.format(temp_file), '{}.dat'.format(root))
+        shutil.move('{}.idx'.format(temp_file), '{}.idx'.format(root))
+    finally:
+        for ext in ('dat', 'idx'):
+            if os.path.isfile('{}.{}'.format(temp_file, ext)):
+                os.remove('{}.{}'.format(temp_file, ext))
+
+
+class PointLocator(object):
+    """
+    Nearest neighbour lookups on a KD-tree of point coordinates, used to answer
+    GetFeatureInfo requests without opening the disk RTree. Points with
+    non-finite coordinates are left out. ``ids`` default to the point index.
+    """
+
+    def __init__(self, x, y, ids=None):
+        x = np.ma.filled(np.asarray(x, dtype=np.float64), np.nan).ravel()
+        y = np.ma.filled(np.asarray(y, dtype=np.float64), np.nan).ravel()
+        if ids is None:
+            ids = np.arange(x.size)
+        valid = np.isfinite(x) & np.isfinite(y)
+        self.ids = ids[valid]
+        self.points = np.column_stack((x[valid], y[valid]))
+        self.tree = cKDTree(self.points) if self.ids.size else None
+
+    def nearest(self, x, y):
+        """ Returns (id, x, y) of the closest point or None if there are no points """
+        if self.tree is None:
+            return None
+        _, i = self.tree.query((x, y))
+        return self.ids[i].item(), self.points[i, 0].item(), self.points[i, 1].item()
+
+    @property
+    def nbytes(self):
+        # The tree itself holds a permutation of the points and its nodes
+        return 2 * self.points.nbytes + self.ids.nbytes + (self.ids.size * 8)
+
+
+class BucketIndex(object):
+    """
+    A uniform grid of buckets over a set of points. Returns the ids of the
+    points in the buckets a bounding box touches, so a bbox subset only has
+    to look at (a superset of) what is visible instead of every point.
+
+    ``order`` holds the point ids sorted by bucket (row major) and ``offsets``
+    where each bucket starts in ``order``.
+    """
+
+    def __init__(self, grid, order, offsets):
+        # grid is [xmin, ymin, xmax, ymax, nx, ny]
+        self.grid = grid
+        self.order = order
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, x, y, per_bucket=16):
+        x = np.ma.filled(np.asarray(x, dtype=np.float64), np.nan).ravel()
+        y = np.ma.filled(np.asarray(y, dtype=np.float64), np.nan).ravel()
+        ids = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        if not ids.size:
+            return cls(np.array([0, 0, 0, 0, 1, 1], dtype=np.float64), ids, np.zeros(2, dtype=np.int64))
+
+        x = x[ids]
+        y = y[ids]
+        xmin, xmax = x.min(), x.max()
+        ymin, ymax = y.min(), y.max()
+        width = max(xmax - xmin, 1e-9)
+        height = max(ymax - ymin, 1e-9)
+        # Square-ish buckets holding ~per_bucket points on average
+        buckets = max(ids.size // per_bucket, 1)
+        nx = int(min(max(round(np.sqrt(buckets * width / height)), 1), 4096))
+        ny = int(min(max(round(buckets / nx), 1), 4096))
+
+        grid = np.array([xmin, ymin, xmin + width, ymin + height, nx, ny], dtype=np.float64)
+        col = np.clip(((x - xmin) / width * nx).astype(np.int64), 0, nx - 1)
+        row = np.clip(((y - ymin) / height * ny).astype(np.int64), 0, ny - 1)
+        bucket = row * nx + col
+        sort = np.argsort(bucket, kind='mergesort')
+        offsets = np.searchsorted(bucket[sort], np.arange(nx * ny + 1)).astype(np.int64)
+        return cls(grid, ids[sort], offsets)
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        try:
+            return cls(arrays['{}_grid'.format(name)],
+                       arrays['{}_order'.format(name)],
+                       arrays['{}_offsets'.format(name)])
+        except KeyError:
+            return None
+
+    def to_arrays(self, name):
+        return {
+            '{}_grid'.format(name): self.grid,
+            '{}_order'.format(name): self.order,
+            '{}_offsets'.format(name): self.offsets,
+        }
+
+    def query(self, bbox):
+        """ Ids of the points in every bucket that (xmin, ymin, xmax, ymax) touches """
+        xmin, ymin, xmax, ymax, nx, ny = self.grid
+        nx = int(nx)
+        ny = int(ny)
+        if not self.order.size or bbox[0] > xmax or bbox[2] < xmin or bbox[1] > ymax or bbox[3] < ymin:
+            return np.empty(0, dtype=self.order.dtype)
+
+        dx = (xmax - xmin) / nx
+        dy = (ymax - ymin) / ny
+        c0 = int(np.clip((bbox[0] - xmin) // dx, 0, nx - 1))
+        c1 = int(np.clip((bbox[2] - xmin) // dx, 0, nx - 1))
+        r0 = int(np.clip((bbox[1] - ymin) // dy, 0, ny - 1))
+        r1 = int(np.clip((bbox[3] - ymin) // dy, 0, ny - 1))
+        if c0 == 0 and r0 == 0 and c1 == nx - 1 and r1 == ny - 1:
+            return np.asarray(self.order)
+
+        # Buckets in a row are contiguous in ``order``
+        return np.concatenate([
+            self.order[self.offsets[r * nx + c0]:self.offsets[r * nx + c1 + 1]]
+            for r in range(r0, r1 + 1)
+        ])
+
+    @property
+    def nbytes(self):
+        return sizeof(self.grid) + sizeof(self.order) + sizeof(self.offsets)
+
+
+def slicing_key(slicing):
+    """ A hashable version of an index expression made of slices """
+    if slicing is None:
+        return None
+    if not isinstance(slicing, tuple):
+        slicing = (slicing,)
+    return tuple((s.start, s.stop, s.step) if isinstance(s, slice) else s for s in slicing)
+
+
+def _readonly(arr):
+    if isinstance(arr, np.ndarray):
+        arr.setflags(write=False)
+    return arr
+
+
+class Topology(object):
+    """
+    Things computed from a topology (nearest neighbour and bucket indexes, ...)
+    are built on first use and kept with it, so they live and die with the
+    registry entry. The registry sets ``key`` and ``resize`` to re-account the
+    entry size.
+    """
+
+    key = None
+    resize = None
+
+    def derived(self, key, build):
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = build()
+            if self.resize is not None:
+                self.resize()
+            return value
+
+    def projected(self, location, crs):
+        """
+        The coordinates of ``location`` transformed into the projection ``crs``
+        (a CRS string like 'EPSG:3857') as read-only (x, y) arrays, computed
+        once per projection.
+        """
+        def build():
+            lon, lat = self.lon_lat(location)
+            x, y = projections.from_wgs84(crs, lon, lat)
+            return _readonly(x), _readonly(y)
+        return self.derived(('projected', location, crs), build)
+
+    def lon_lat(self, location):
+        raise NotImplementedError
+
+    def arrays_nbytes(self):
+        raise NotImplementedError
+
+    @property
+    def nbytes(self):
+        return self.arrays_nbytes() + sizeof(self._derived)
+
+
+class UGridTopology(Topology):
+    """
+    The parsed arrays of a single UGRID mesh. Instances are shared between
+    requests so the arrays are read-only; copy before modifying.
+    """
+
+    def __init__(self, mesh_name, nodes, faces, face_coordinates=None, edge_coordinates=None, version=None):
+        self.mesh_name = mesh_name
+        self.nodes = _readonly(nodes)
+        self.faces = _readonly(faces)
+        self.face_coordinates = _readonly(face_coordinates)
+        self.edge_coordinates = _readonly(edge_coordinates)
+        self.version = version
+        self._derived = {}
+
+    @classmethod
+    def from_ncfile(cls, topology_file, mesh_name=None):
+        return cls.from_ugrid(UGrid.from_ncfile(topology_file, mesh_name=mesh_name))
+
+    @classmethod
+    def from_ugrid(cls, ug):
+        return cls(mesh_name=ug.mesh_name,
+                   nodes=ug.nodes,
+                   faces=ug.faces,
+                   face_coordinates=ug.face_coordinates,
+                   edge_coordinates=ug.edge_coordinates)
+
+    @classmethod
+    def from_arrays(cls, arrays_root, mesh_name=None):
+        loaded = load_arrays(arrays_root)
+        if loaded is None:
+            return None
+        saved_mesh, arrays = loaded
+        if mesh_name is not None and saved_mesh != mesh_name:
+            return None
+        faces = arrays['faces']
+        if faces.size and faces.min() < 0:
+            # Mixed meshes have padded faces
+            faces = np.ma.masked_where(faces < 0, faces, copy=False)
+        topo = cls(mesh_name=saved_mesh,
+                   nodes=arrays['nodes'],
+                   faces=faces,
+                   face_coordinates=arrays.get('face_coordinates'),
+                   edge_coordinates=arrays.get('edge_coordinates'))
+        for name in ('node', 'face'):
+            bucket_index = BucketIndex.from_arrays(arrays, '{}_buckets'.format(name))
+            if bucket_index is not None:
+                topo._derived[('buckets', name)] = bucket_index
+        return topo
+
+    def save_arrays(self, arrays_root):
+        arrays = dict(nodes=self.nodes,
+                      faces=self.faces,
+                      face_coordinates=self.face_coordinates,
+                      edge_coordinates=self.edge_coordinates)
+        arrays.update(self.bucket_index('node').to_arrays('node_buckets'))
+        arrays.update(self.face_bucket_index().to_arrays('face_buckets'))
+        save_arrays(arrays_root, mesh_name=self.mesh_name, **arrays)
+
+    def coordinates(self, location):
+        if location == 'node':
+            return self.nodes
+        elif location == 'face':
+            return self.face_coordinates
+        elif location == 'edge':
+            return self.edge_coordinates
+        return np.empty(0)
+
+    def lon_lat(self, location):
+        coords = self.coordinates(location)
+        return coords[:, 0], coords[:, 1]
+
+    def face_centers(self):
+        coords = self.face_coordinates
+        if coords is None:
+            # No face coordinates in the file, use the center of each face
+            bounds = face_bounds(self.nodes, self.faces)
+            coords = np.column_stack(((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2))
+        return coords
+
+    def locator(self, location):
+        """ Nearest neighbour index of the location, None when the mesh has no coordinates for it """
+        def build():
+            coords = self.face_centers() if location == 'face' else self.coordinates(location)
+            if coords is None or coords.size == 0:
+                return None
+            return PointLocator(coords[:, 0], coords[:, 1])
+        return self.derived(('locator', location), build)
+
+    def triangle_locator(self, crs):
+        """ Locates the face under a projected point (see wms.raster) """
+        from wms.raster import TriangleLocator
+
+        def build():
+            x, y = self.projected('node', crs)
+            return TriangleLocator(x, y, self.faces)
+        return self.derived(('triangles', crs), build)
+
+    def bucket_index(self, location):
+        """ Bucket index over the coordinates of the location """
+        def build():
+            coords = self.face_centers() if location == 'face' else self.coordinates(location)
+            return BucketIndex.build(coords[:, 0], coords[:, 1])
+        return self.derived(('buckets', location), build)
+
+    def face_bucket_index(self):
+        """
+        Faces bucketed by the position of their first node. A face with all of
+        its nodes inside a bbox has its first node inside, so querying this
+        index returns every candidate face for a node subset.
+        """
+        def build():
+            first = np.ma.filled(self.faces[:, 0], 0)
+            return BucketIndex.build(self.nodes[first, 0], self.nodes[first, 1])
+        return self.derived(('buckets', 'face_nodes'), build)
+
+    def arrays_nbytes(self):
+        arrays = (self.nodes, self.faces, self.face_coordinates, self.edge_coordinates)
+        return sum(sizeof(a) for a in arrays if a is not None)
+
+
+class SGridTopology(Topology):
+    """
+    The cell center coordinates and angles of an SGRID, backed by the memory
+    mapped arrays when they exist. Attribute lookups that are not arrays (grid
+    variables, slicing, ...) are passed through to the pysgrid object.
+    """
+
+    def __init__(self, grid, center_lon, center_lat, angles=None, version=None):
+        self.grid = grid
+        self.center_lon = _readonly(center_lon)
+        self.center_lat = _readonly(center_lat)
+        self.angles = _readonly(angles)
+        self.version = version
+        self._derived = {}
+
+    @classmethod
+    def from_ncfile(cls, topology_file, arrays_root=None):
+        grid = load_grid(topology_file)
+        loaded = load_arrays(arrays_root) if arrays_root else None
+        if loaded is not None:
+            _, arrays = loaded
+            return cls(grid,
+                       center_lon=arrays['center_lon'],
+                       center_lat=arrays['center_lat'],
+                       angles=arrays.get('angles'))
+        return cls(grid,
+                   center_lon=grid.center_lon,
+                   center_lat=grid.center_lat,
+                   angles=getattr(grid, 'angles', None))
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails
+        if name in ('grid', '_derived', 'key', 'resize'):
+            raise AttributeError(name)
+        return getattr(self.grid, name)
+
+    def lon_lat(self, location='face'):
+        return self.center_lon, self.center_lat
+
+    def quad_locator(self, crs, slicing=None):
+        """
+        Locates the grid cell under a projected point (see wms.raster) for the
+        cell centers in ``slicing`` (the center_slicing of the coordinates).
+        """
+        from wms.raster import QuadLocator
+
+        def build():
+            x, y = self.projected('face', crs)
+            if slicing is not None:
+                x = x[slicing]
+                y = y[slicing]
+            return QuadLocator(x, y)
+        return self.derived(('quads', crs, slicing_key(slicing)), build)
+
+    def extents(self, slicing=None):
+        """
+        (minlon, minlat, maxlon, maxlat) of each row and of each column of
+        the cell centers in ``slicing`` (the center_slicing of the coordinates)
+        """
+        def build():
+            lon = self.center_lon if slicing is None else self.center_lon[slicing]
+            lat = self.center_lat if slicing is None else self.center_lat[slicing]
+            lon = np.ma.filled(np.ma.asarray(lon, dtype=np.float64), np.nan)
+            lat = np.ma.filled(np.ma.asarray(lat, dtype=np.float64), np.nan)
+            with warnings.catch_warnings():
+                # All NaN rows or columns (land, padding) never match a bbox
+                warnings.simplefilter('ignore', RuntimeWarning)
+                rows = np.column_stack((np.nanmin(lon, axis=1), np.nanmin(lat, axis=1),
+                                        np.nanmax(lon, axis=1), np.nanmax(lat, axis=1)))
+                columns = np.column_stack((np.nanmin(lon, axis=0), np.nanmin(lat, axis=0),
+                                           np.nanmax(lon, axis=0), np.nanmax(lat, axis=0)))
+            return _readonly(rows), _readonly(columns)
+        return self.derived(('extents', slicing_key(slicing)), build)
+
+    def window(self, bbox, slicing=None):
+        """
+        The (rows, columns) slices of the smallest window of the cell centers
+        in ``slicing`` that holds all of the centers inside a lon/lat ``bbox``
+        (minx, miny, maxx, maxy), None if no center is inside. Data of the
+        window is read as one rectangular slab.
+        """
+        minx, miny, maxx, maxy = bbox
+
+        def crossing(extents):
+            return np.flatnonzero((extents[:, 0] <= maxx) & (extents[:, 2] >= minx) &
+                                  (extents[:, 1] <= maxy) & (extents[:, 3] >= miny))
+
+        rows, columns = (crossing(e) for e in self.extents(slicing))
+        if not rows.size or not columns.size:
+            return None
+
+        # Rows and columns of a curved grid cover a lot more than the bbox, shrink
+        # the window to the centers inside of it
+        window = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+        lon = (self.center_lon if slicing is None else self.center_lon[slicing])[window]
+        lat = (self.center_lat if slicing is None else self.center_lat[slicing])[window]
+        with np.errstate(invalid='ignore'):
+            inside = np.ma.filled((lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy), False)
+        rows = np.flatnonzero(inside.any(axis=1))
+        columns = np.flatnonzero(inside.any(axis=0))
+        if not rows.size:
+            return None
+        return (slice(int(window[0].start + rows[0]), int(window[0].start + rows[-1]) + 1),
+                slice(int(window[1].start + columns[0]), int(window[1].start + columns[-1]) + 1))
+
+    def locator(self, location='face'):
+        # Cell centers, ids are 1-based and flattened like the RTree ids
+        def build():
+            ids = np.arange(1, self.center_lon.size + 1)
+            return PointLocator(self.center_lon, self.center_lat, ids=ids)
+        return self.derived(('locator', location), build)
+
+    def arrays_nbytes(self):
+        arrays = (self.center_lon, self.center_lat, self.angles)
+        return sum(sizeof(a) for a in arrays if a is not None)
+
+
+def save_sgrid_arrays(arrays_root, sg):
+    save_arrays(arrays_root,
+                center_lon=sg.center_lon,
+                center_lat=sg.center_lat,
+                angles=getattr(sg, 'angles', None))
+
+
+class TopologyRegistry(object):
+    """
+    Per-worker registry of parsed topology caches, keyed by the topology file
+    and mesh name. Every lookup checks the file on disk so a grid cache rebuilt
+    by another process is picked up on the next request.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.cache = LRUCache(max_bytes)
+
+    def ugrid(self, topology_file, mesh_name=None, arrays_root=None):
+        key = ('ugrid', topology_file, mesh_name)
+        version = self._version(topology_file, arrays_root)
+        topo = self.cache.get(key)
+        if topo is not None and topo.version == version:
+            return topo
+
+        topo = None
+        if arrays_root is not None:
+            topo = UGridTopology.from_arrays(arrays_root, mesh_name=mesh_name)
+        if topo is None:
+            logger.debug("Loading UGRID topology from {}".format(topology_file))
+            topo = UGridTopology.from_ncfile(topology_file, mesh_name=mesh_name)
+        return self._store(key, topo, version)
+
+    def sgrid(self, topology_file, arrays_root=None):
+        key = ('sgrid', topology_file, None)
+        version = self._version(topology_file, arrays_root)
+        topo = self.cache.get(key)
+        if topo is not None and topo.version == version:
+            return topo
+
+        logger.debug("Loading SGRID topology from {}".format(topology_file))
+        topo = SGridTopology.from_ncfile(topology_file, arrays_root=arrays_root)
+        return self._store(key, topo, version)
+
+    def _store(self, key, topo, version):
+        topo.key = key
+        topo.version = version
+        topo.resize = lambda: self.cache.resize(key)
+        return self.cache.set(key, topo)
+
+    def _version(self, topology_file, arrays_root=None):
+        if arrays_root is None:
+            return file_version(topology_file)
+        return (file_version(topology_file), file_version('{}.json'.format(arrays_root)))
+
+    def invalidate(self, topology_file):
+        self.cache.delete_matching(lambda k: k[1] == topology_file)
+
+    def clear(self):
+        self.cache.clear()
+
+
+registry = TopologyRegistry(max_bytes=settings.TOPOLOGY_REGISTRY_MAX_BYTES)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Vector (arrow) tiles. The vectors are thinned in screen space to at most one
+per square of ``VECTOR_SPACING`` pixels (times VECTORSTEP) and drawn as arrow
+glyphs batched by color, instead of a matplotlib quiver with one path per arrow.
+
+The squares are aligned to the origin of the map projection, so neighbouring
+tiles agree on the vectors along their edges, and each square keeps the
+vector of lowest rank (a fixed hash of its index in the grid). The squares of
+a web mercator zoom level split into four at the next one, so a vector drawn
+at one zoom level is still drawn when zooming in.
+"""
+import numpy as np
+import matplotlib as mpl
+from matplotlib.path import Path
+from matplotlib.collections import PathCollection
+from django.conf import settings
+
+from wms import figures
+from wms import raster
+from wms.data_handler import figure_response
+
+from wms import logger  # noqa
+
+# Arrow shape in shaft widths, the defaults of matplotlib's quiver
+HEAD_WIDTH = 3.
+HEAD_LENGTH = 5.
+HEAD_AXIS_LENGTH = 4.5
+MIN_SHAFT = 1.
+MIN_LENGTH = 1.
+
+CODES = np.array([Path.MOVETO] + [Path.LINETO] * 6 + [Path.CLOSEPOLY], dtype=Path.code_type)
+
+
+def spacing(request):
+    """ Size (pixels) of the squares vectors are thinned to, 0 to draw all of them """
+    return settings.VECTOR_SPACING * max(request.GET['vectorstep'], 1)
+
+
+def rank(ids):
+    """ A fixed pseudo random order of vectors, from their index in the grid """
+    with np.errstate(over='ignore'):
+        return (np.asarray(ids, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(16)
+
+
+def thin(x, y, ids, bbox, width, height, cell):
+    """
+    Indexes of the vectors at projected x/y to draw on a tile: the one of
+    lowest rank in each ``cell`` by ``cell`` pixel square. ``ids`` are the
+    indexes of the vectors in the whole grid.
+    """
+    x = np.ma.filled(np.asarray(x, dtype=np.float64), np.nan).ravel()
+    y = np.ma.filled(np.asarray(y, dtype=np.float64), np.nan).ravel()
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if cell <= 0 or valid.size == 0:
+        return valid
+
+    dx = cell * (bbox.maxx - bbox.minx) / width
+    dy = cell * (bbox.maxy - bbox.miny) / height
+    i = np.floor(x[valid] / dx).astype(np.int64)
+    j = np.floor(y[valid] / dy).astype(np.int64)
+    order = np.lexsort((rank(np.asarray(ids).ravel()[valid]), j, i))
+    i = i[order]
+    j = j[order]
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = (i[1:] != i[:-1]) | (j[1:] != j[:-1])
+    return np.sort(valid[order[first]])
+
+
+def thin_mask(x, y, mask, request):
+    """
+    A boolean ``mask`` of the vectors near a GetMap tile (x/y are projected,
+    for all of the vectors) reduced to the ones thin() draws on it
+    """
+    ids = np.flatnonzero(mask)
+    keep = thin(x[ids], y[ids], ids, request.GET['bbox'], request.GET['width'], request.GET['height'], spacing(request))
+    thinned = np.zeros_like(mask)
+    thinned[ids[keep]] = True
+    return thinned
+
+
+def arrow_glyphs(length):
+    """
+    (N, 8) x and y of arrows pointing along +x with their tail at the origin,
+    in shaft widths, like matplotlib's Quiver._h_arrows. Short arrows shrink,
+    arrows shorter than MIN_LENGTH are drawn as hexagons.
+    """
+    length = np.clip(length, 0, 2 ** 16)[:, np.newaxis]
+    minsh = MIN_SHAFT * HEAD_LENGTH
+    order = [0, 1, 2, 3, 2, 1, 0, 0]
+    sign = np.array([1, 1, 1, 1, -1, -1, -1, 1])
+
+    x = np.array([0, -HEAD_AXIS_LENGTH, -HEAD_LENGTH, 0])[order] + np.array([0, 1, 1, 1])[order] * length
+    y = np.broadcast_to(0.5 * np.array([1, 1, HEAD_WIDTH, 0])[order] * sign, x.shape).copy()
+
+    short = np.broadcast_to(length < minsh, x.shape)
+    shrink = length / minsh
+    x0 = np.array([0, minsh - HEAD_AXIS_LENGTH, minsh - HEAD_LENGTH, minsh])[order] * shrink
+    y0 = 0.5 * np.array([1, 1, HEAD_WIDTH, 0])[order] * sign * shrink
+    np.copyto(x, x0, where=short)
+    np.copyto(y, y0, where=short)
+
+    tiny = np.broadcast_to(length < MIN_LENGTH, x.shape)
+    theta = np.arange(8) * np.pi / 3.
+    np.copyto(x, np.broadcast_to(np.cos(theta) * MIN_LENGTH * 0.5, x.shape), where=tiny)
+    np.copyto(y, np.broadcast_to(np.sin(theta) * MIN_LENGTH * 0.5, x.shape), where=tiny)
+    return x, y
+
+
+def arrows_response(x, y, u, v, request, dpi=None):
+    """
+    A vectors tile of u/v at projected x/y, colored by magnitude. Arrows are
+    as long as matplotlib's quiver draws them with ``scale=vectorscale``
+    (a magnitude of ``vectorscale`` is the width of the tile).
+    """
+    dpi = dpi or 80.
+    bbox = request.GET['bbox']
+    width = request.GET['width']
+    height = request.GET['height']
+    colorscalerange = request.GET['colorscalerange']
+
+    x, y, u, v = (np.ma.filled(np.ma.asarray(a, dtype=np.float64), np.nan).ravel() for a in (x, y, u, v))
+    ok = np.isfinite(x) & np.isfinite(y) & np.isfinite(u) & np.isfinite(v)
+    x, y, u, v = x[ok], y[ok], u[ok], v[ok]
+
+    mags = np.hypot(u, v)
+    norm = raster.get_norm(request, mags)
+    idx, missing = raster.color_indexes(mags, norm, colorscalerange.min, colorscalerange.max)
+
+    # Shaft width (pixels) like quiver's default, from the number of arrows that fit across the tile
+    cell = spacing(request) or 1
+    shaft = 0.06 * width / np.clip(width / cell, 8, 25)
+
+    gx, gy = arrow_glyphs(mags / request.GET['vectorscale'] * width / shaft)
+    # Rotate, scale to pixels and move to the position of each vector on the tile
+    cos = np.where(mags > 0, u / np.where(mags > 0, mags, 1), 1)[:, np.newaxis]
+    sin = np.where(mags > 0, v / np.where(mags > 0, mags, 1), 0)[:, np.newaxis]
+    px = (x - bbox.minx) / (bbox.maxx - bbox.minx) * width
+    py = (y - bbox.miny) / (bbox.maxy - bbox.miny) * height
+    vertices = np.empty(gx.shape + (2,))
+    vertices[..., 0] = (gx * cos - gy * sin) * shaft + px[:, np.newaxis]
+    vertices[..., 1] = (gx * sin + gy * cos) * shaft + py[:, np.newaxis]
+
+    # One compound path per color, arrows of the same color are filled in one go
+    lut = raster.colormap_lut(request.GET['colormap'])
+    idx = idx[~missing]
+    vertices = vertices[~missing]
+    order = np.argsort(idx, kind='stable')
+    colors, starts = np.unique(idx[order], return_index=True)
+    paths = [
+        Path(vertices[group].reshape(-1, 2), np.tile(CODES, group.size))
+        for group in np.split(order, starts[1:])
+    ] if order.size else []
+
+    with figures.pool.figure(width, height, dpi) as (fig, ax):
+        if paths:
+            collection = PathCollection(paths, facecolors=lut[colors] / 255., edgecolors='none', linewidths=0,
+                                        transform=mpl.transforms.IdentityTransform())
+            ax.add_collection(collection, autolim=False)
+
+        ax.set_xlim(bbox.minx, bbox.maxx)
+        ax.set_ylim(bbox.miny, bbox.maxy)
+        ax.set_frame_on(False)
+        ax.set_clip_on(False)
+        ax.set_position([0., 0., 1., 1.])
+
+        return figure_response(fig, request, tight=False)
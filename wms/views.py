@@ -17,6 +17,8 @@ from wms.models import Dataset, Server, Variable, Style, UnidentifiedDataset
 from wms.utils import get_layer_from_request
 from wms.tasks import update_dataset, update_layers, update_time_cache, update_grid_cache
 from wms import gfi_handler
+from wms import tilecache
+from wms import prefetch
 from wms import wms_handler
 from wms import logger
 
@@ -277,6 +279,8 @@ class WmsView(View):
     def get(self, request, dataset):
         dataset = Dataset.objects.filter(slug=dataset).first()
         request = normalize_get_params(request)
+        # Requests without a TIME are drawn at the current time
+        now = request.GET.get('time') is None
 
         # This calls the passed in 'request' method on a Dataset and returns the response
         try:
@@ -296,7 +300,18 @@ class WmsView(View):
                 elif reqtype.lower() == 'getmetadata':
                     request = enhance_getmetadata_request(dataset, layer, request)
 
-                return getattr(dataset, reqtype.lower())(layer, request)
+                def render(request):
+                    with prefetch.prefetcher.foreground():
+                        return getattr(dataset, reqtype.lower())(layer, request)
+
+                response = tilecache.cached_response(dataset, layer, reqtype.lower(), request, render, now=now)
+                if reqtype.lower() == 'getmap' and not now and response.status_code in (200, 304):
+                    # Read the time steps likely asked for next while the client draws this one
+                    try:
+                        prefetch.prefetcher.watch(dataset, layer, request)
+                    except BaseException:
+                        logger.exception("Could not queue prefetches for {}".format(layer))
+                return response
 
         except NotImplementedError as e:
             return HttpResponse('"{}" is not implemented for a {}'.format(reqtype, dataset.__class__.__name__), status=500, reason="Could not process inputs", content_type="application/json")
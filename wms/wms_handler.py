@@ -3,8 +3,8 @@ from datetime import datetime, date
 
 from dateutil.parser import parse
 from dateutil.tz import tzutc
-import pyproj
 
+from wms import projections
 from wms.utils import DotDict, split, tz_aware_to_native
 
 from wms import logger
@@ -24,12 +24,11 @@ def get_wgs84_bbox(request):
     Return the [lonmin, latmin, lonmax, lonmax] - [lower (x,y), upper(x,y)]
     in WGS84
     """
-    EPSG4326 = pyproj.Proj(init='EPSG:4326')
     crs = get_projection(request)
     bbox = get_bbox(request)
 
-    wgs84_minx, wgs84_miny = pyproj.transform(crs, EPSG4326, bbox.minx, bbox.miny)
-    wgs84_maxx, wgs84_maxy = pyproj.transform(crs, EPSG4326, bbox.maxx, bbox.maxy)
+    wgs84_minx, wgs84_miny = projections.to_wgs84(crs, bbox.minx, bbox.miny)
+    wgs84_maxx, wgs84_maxy = projections.to_wgs84(crs, bbox.maxx, bbox.maxy)
 
     return DotDict(minx=wgs84_minx, miny=wgs84_miny, maxx=wgs84_maxx, maxy=wgs84_maxy, bbox=(wgs84_minx, wgs84_miny, wgs84_maxx, wgs84_maxy))
 
@@ -126,6 +125,7 @@ def get_projection(request):
     Return the projection string passed into the request.
     Can be specified by \"SRS\" or \"CRS\" key (string).
     If \"SRS\" or \"CRS\" is not available, default to mercator.
+    Transformers for it are available from wms.projections.
     """
     projstr = request.GET.get("srs")
     if not projstr:
@@ -135,7 +135,7 @@ def get_projection(request):
         projstr = "EPSG:3857"
         logger.debug("SRS or CRS no available in requst, defaulting to EPSG:3857 (mercator)")
 
-    return pyproj.Proj(init=projstr)
+    return projections.normalize(projstr)
 
 
 def get_xy(request):
@@ -258,10 +258,8 @@ def get_dimensions(request, default_width=None, default_height=None):
 
 def get_gfi_positions(xy, bbox, crs, dims):
     """ Returns the latitude and longitude the GFI should be performed at"""
-    EPSG4326 = pyproj.Proj(init='EPSG:4326')
-    lon, lat = pyproj.transform(
+    lon, lat = projections.to_wgs84(
         crs,
-        EPSG4326,
         bbox.minx + ((bbox.maxx - bbox.minx) * (xy.x / dims.width)),
         bbox.maxy - ((bbox.maxy - bbox.miny) * (xy.y / dims.height))
     )